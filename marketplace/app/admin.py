@@ -1,9 +1,289 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db import connections, router
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+from django.utils.functional import cached_property
 
 # Register your models here.
-from .models import Category, Item, Conversation, ConversationMessage
+from .models import Category, Item, Conversation, ConversationMember, ConversationMessage, SavedSearch, Notification, RequestProfile, ProfilingSwitch
+from .profiling import profileToken
+from .purge import softDeleteItems, softDeleteUser
 
-admin.site.register(Category)
-admin.site.register(Item)
-admin.site.register(Conversation)
-admin.site.register(ConversationMessage)
\ No newline at end of file
+batchSize = 1000
+
+def estimatedRowCount(model):
+    """
+    Estimates the number of rows of a table without counting them.
+
+    PostgreSQL keeps a row estimate in its catalog. Other databases fall back to the span of the primary keys, which
+    is read from the index and overestimates by the number of deleted rows in between.
+
+    :param model (Model): The model whose table is estimated.
+
+    :return (int): The estimated number of rows.
+    """
+    connection = connections[router.db_for_read(model)]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [model._meta.db_table])
+            row = cursor.fetchone()
+        if row and row[0] > 0:
+            return int(row[0])
+
+    span = model._default_manager.aggregate(lowest=Min('pk'), highest=Max('pk'))
+    if span['highest'] is None:
+        return 0
+    return span['highest'] - span['lowest'] + 1
+
+class EstimatedCountPaginator(Paginator):
+    """
+        Paginator for large tables that skips the COUNT(*) of unfiltered changelists.
+
+        Filtered or searched changelists are still counted exactly, as are tables small enough for the count to be cheap.
+        Outside PostgreSQL the estimate is the span of the primary keys, so rows deleted in between make it too high
+        and the last page links of an unfiltered changelist can lead to empty pages.
+    """
+    exactCountLimit = 10000
+
+    @cached_property
+    def count(self):
+        # Unfiltered means no conditions beyond the ones the default manager always adds, e.g. hiding deleted items.
+        if self.object_list.query.where == self.object_list.model._default_manager.all().query.where:
+            estimate = estimatedRowCount(self.object_list.model)
+            if estimate > self.exactCountLimit:
+                return estimate
+        return super().count
+
+def usersNamed(username):
+    """
+    :return (list): The id of the user with exactly this username, if any. The exact, case-sensitive match is
+        answered by the unique index on username, unlike iexact.
+    """
+    return list(User.objects.filter(username=username.strip()).values_list('pk', flat=True))
+
+def prefixQ(field, term):
+    """
+    Builds a case-sensitive prefix match as a range, which the database answers from the field's index whereas
+    startswith and istartswith compile to LIKE or UPPER() and scan the table.
+    """
+    return Q(**{field + '__gte': term, field + '__lt': term + chr(0x10ffff)})
+
+def inBatches(queryset):
+    """
+    Yields the primary keys of a queryset in lists of batchSize, so bulk actions never hold every row in memory or
+    lock the table for one long statement.
+    """
+    batch = []
+    for pk in queryset.values_list('pk', flat=True).iterator(chunk_size=batchSize):
+        batch.append(pk)
+        if len(batch) == batchSize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+        Base admin for tables that grow large: estimated counts, no full count next to filtered results and no
+        default delete action, which loads every selected object to build its confirmation page.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+@admin.action(description='Delete selected in batches')
+def deleteInBatches(modeladmin, request, queryset):
+    deleted = 0
+    for batch in inBatches(queryset):
+        deleted += queryset.model._default_manager.filter(pk__in=batch).delete()[1].get(queryset.model._meta.label, 0)
+    modeladmin.message_user(request, 'Deleted %d %s.' % (deleted, queryset.model._meta.verbose_name_plural), messages.SUCCESS)
+
+@admin.action(description='Delete selected items')
+def softDelete(modeladmin, request, queryset):
+    deleted = 0
+    for batch in inBatches(queryset):
+        deleted += softDeleteItems(Item.objects.filter(pk__in=batch))
+    modeladmin.message_user(request, 'Deleted %d items. They are purged in the background.' % deleted, messages.SUCCESS)
+
+@admin.action(description='Deactivate and delete selected users in the background')
+def deleteUsers(modeladmin, request, queryset):
+    count = 0
+    for user in queryset.iterator():
+        softDeleteUser(user)
+        count += 1
+    modeladmin.message_user(request, 'Queued %d users for deletion.' % count, messages.SUCCESS)
+
+@admin.action(description='Mark selected items as sold')
+def markSold(modeladmin, request, queryset):
+    updated = 0
+    for batch in inBatches(queryset):
+        # update() skips auto_now, so the ETag stamp is bumped by hand.
+        updated += Item.objects.filter(pk__in=batch).update(isSold=True, modifiedAt=timezone.now())
+    modeladmin.message_user(request, 'Marked %d items as sold.' % updated, messages.SUCCESS)
+
+def softDeletedObjects(objs):
+    """
+    Lists only the objects themselves on the delete confirmation page, since their dependents are purged later,
+    instead of collecting every related row up front.
+
+    :return (tuple): The values ModelAdmin.get_deleted_objects() returns.
+    """
+    objs = list(objs)
+    counts = {objs[0]._meta.verbose_name_plural: len(objs)} if objs else {}
+    return [str(obj) for obj in objs], counts, set(), []
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ('name',)
+    search_fields = ('name',)
+
+@admin.register(Item)
+class ItemAdmin(LargeTableAdmin):
+    list_display = ('name', 'category', 'owner', 'price', 'isSold', 'createdAt')
+    list_filter = ('isSold', 'category')
+    list_select_related = ('category', 'owner')
+    search_fields = ('name', 'owner__username')
+    autocomplete_fields = ('category',)
+    raw_id_fields = ('owner',)
+    date_hierarchy = 'createdAt'
+    actions = (markSold, softDelete)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Names by case-sensitive prefix, owners by exact username: both answered from indexes.
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        return queryset.filter(prefixQ('name', term) | Q(owner_id__in=usersNamed(term))), False
+
+    # The delete page soft-deletes too; conversations, messages and the image are purged in the background.
+    def delete_model(self, request, obj):
+        softDeleteItems(Item.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        for batch in inBatches(queryset):
+            softDeleteItems(Item.objects.filter(pk__in=batch))
+
+    def get_deleted_objects(self, objs, request):
+        return softDeletedObjects(objs)
+
+class ConversationMemberInline(admin.TabularInline):
+    model = ConversationMember
+    raw_id_fields = ('user',)
+    extra = 0
+
+# Conversations and messages are on the messaging database: items and users are prefetched from the default
+# database instead of joined, and searches look them up there first.
+@admin.register(Conversation)
+class ConversationAdmin(LargeTableAdmin):
+    list_display = ('id', 'item', 'createdAt', 'modifiedAt')
+    list_select_related = ()
+    search_fields = ('=item__name',)
+    raw_id_fields = ('item',)
+    inlines = (ConversationMemberInline,)
+    date_hierarchy = 'modifiedAt'
+    actions = (deleteInBatches,)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('item')
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        itemIds = Item.allObjects.filter(name=search_term.strip()).values_list('pk', flat=True)
+        return queryset.filter(item_id__in=list(itemIds[:batchSize])), False
+
+@admin.register(ConversationMessage)
+class ConversationMessageAdmin(LargeTableAdmin):
+    list_display = ('id', 'conversation', 'host', 'createdAt')
+    list_select_related = ('conversation',)
+    search_fields = ('=host__username',)
+    raw_id_fields = ('conversation', 'host')
+    date_hierarchy = 'createdAt'
+    actions = (deleteInBatches,)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('host')
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(host_id__in=usersNamed(search_term)), False
+
+@admin.register(SavedSearch)
+class SavedSearchAdmin(LargeTableAdmin):
+    list_display = ('query', 'category', 'owner', 'createdAt')
+    list_select_related = ('category', 'owner')
+    search_fields = ('=owner__username',)
+    raw_id_fields = ('owner', 'category')
+    actions = (deleteInBatches,)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(owner_id__in=usersNamed(search_term)), False
+
+@admin.register(Notification)
+class NotificationAdmin(LargeTableAdmin):
+    list_display = ('text', 'user', 'isRead', 'createdAt')
+    list_select_related = ('user',)
+    search_fields = ('=user__username',)
+    raw_id_fields = ('user', 'item', 'savedSearch')
+    actions = (deleteInBatches,)
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(user_id__in=usersNamed(search_term)), False
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('path', 'method', 'statusCode', 'duration', 'queryCount', 'queryTime', 'createdAt')
+    list_filter = ('method', 'statusCode')
+    search_fields = ('^path',)
+    date_hierarchy = 'createdAt'
+    readonly_fields = ('path', 'method', 'statusCode', 'duration', 'queryCount', 'queryTime', 'profileFile', 'summary', 'createdAt')
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(ProfilingSwitch)
+class ProfilingSwitchAdmin(admin.ModelAdmin):
+    list_display = ('enabled', 'sampleRate', 'sampleUntil', 'updatedAt')
+    readonly_fields = ('token',)
+
+    def has_add_permission(self, request):
+        return not ProfilingSwitch.objects.exists()
+
+    @admin.display(description='X-Profile token (valid for an hour)')
+    def token(self, obj):
+        return profileToken()
+
+admin.site.unregister(User)
+
+@admin.register(User)
+class MarketplaceUserAdmin(UserAdmin):
+    actions = (deleteUsers,)
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    # The delete page deactivates the user and queues the account for purgedeleted, like the bulk action.
+    def delete_model(self, request, obj):
+        softDeleteUser(obj)
+
+    def delete_queryset(self, request, queryset):
+        for user in queryset.iterator():
+            softDeleteUser(user)
+
+    def get_deleted_objects(self, objs, request):
+        return softDeletedObjects(objs)
@@ -0,0 +1,393 @@
+"""
+JSON read API for the mobile clients.
+
+Every endpoint serialises straight from values_list() rows, so no model instances are built, and accepts:
+
+- fields: a comma separated list of the fields to return, e.g. ?fields=id,name,price. Only the columns behind the
+  requested fields are selected; id is always returned. Unknown fields are rejected with 400.
+- limit: the page size, 20 by default and at most 100.
+- after: the keyset cursor. Lists are ordered by a unique key and a page continues after the last key of the previous
+  one, so paging stays cheap however deep the client scrolls and does not skip or repeat rows when new ones arrive.
+  The 'next' URL of a page carries the cursor; it is null on the last page.
+
+/api/items/?ids=3,1,2 fetches up to 100 items in one request, in the order asked for, and lists the ids that do not
+exist under 'missing'. The responses carry an ETag from etags.py, so a client revalidating a page it already holds gets
+a 304 Not Modified without the rows being read. The inbox and messages endpoints use the session of the logged in user
+and answer 401 without one. Errors are returned as {"error": "..."} with the matching status code.
+"""
+
+from functools import wraps
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import condition, require_safe
+from django.db.models import Q
+
+from .etags import apiItemsEtag, apiItemEtag, apiCategoriesEtag, apiSearchEtag, apiInboxEtag, apiMessagesEtag
+from .geo import distanceKm, nearQ
+from .models import Category, Conversation, ConversationMember, ConversationMessage, Item
+
+defaultLimit = 20
+maxLimit = 100
+
+# API field name -> column read with values_list().
+itemFields = {
+    'id': 'id',
+    'name': 'name',
+    'description': 'description',
+    'price': 'price',
+    'isSold': 'isSold',
+    'category': 'category_id',
+    'categoryName': 'category__name',
+    'owner': 'owner__username',
+    'image': 'image',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+    'postalCode': 'postalCode',
+    'createdAt': 'createdAt',
+    'modifiedAt': 'modifiedAt',
+}
+conversationFields = ('id', 'item', 'itemName', 'members', 'createdAt', 'modifiedAt')
+messageFields = ('id', 'content', 'createdAt', 'host', 'hostName', 'mine')
+
+class ApiError(Exception):
+    """
+        Raised by the API views for a request they cannot answer; apiView() turns it into a JSON error response.
+    """
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def apiView(loginRequired=False):
+    """
+    Wraps an API view so ApiError becomes a JSON error response.
+
+    :param loginRequired (bool): Answer 401 to anonymous users instead of redirecting them to the login page.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if loginRequired and not request.user.is_authenticated:
+                return JsonResponse({'error': 'Authentication required.'}, status=401)
+            try:
+                return view(request, *args, **kwargs)
+            except ApiError as error:
+                return JsonResponse({'error': error.message}, status=error.status)
+        return wrapper
+    return decorator
+
+def selectedFields(request, available):
+    """
+    :param request (HttpRequest): The request, whose 'fields' parameter lists the wanted fields.
+    :param available (iterable): The fields the endpoint offers, id first.
+
+    :return (list): The requested fields in the order given, with id first; all of them without a 'fields' parameter.
+    """
+    available = list(available)
+    requested = [name.strip() for name in request.GET.get('fields', '').split(',') if name.strip()]
+    if not requested:
+        return available
+
+    unknown = [name for name in requested if name not in available]
+    if unknown:
+        raise ApiError('Unknown fields: %s. Available fields: %s.' % (', '.join(unknown), ', '.join(available)))
+    return ['id'] + [name for name in dict.fromkeys(requested) if name != 'id']
+
+def intParameter(request, name, default=None, minimum=None, maximum=None):
+    value = request.GET.get(name, '')
+    if value == '':
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ApiError('%s must be an integer.' % name)
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise ApiError('%s must be between %s and %s.' % (name, minimum, maximum))
+    return value
+
+def pageLimit(request):
+    return intParameter(request, 'limit', defaultLimit, 1, maxLimit)
+
+def nextUrl(request, cursor):
+    if cursor is None:
+        return None
+    parameters = request.GET.copy()
+    parameters['after'] = cursor
+    return request.build_absolute_uri('%s?%s' % (request.path, parameters.urlencode()))
+
+def itemRows(items, fields, extra=()):
+    """
+    Reads items as dictionaries with values_list(), selecting only the columns behind the requested fields.
+
+    :param items (QuerySet): The items to read.
+    :param fields (list): The API fields to return.
+    :param extra (tuple): Columns needed by the caller but not returned, added under their column names.
+
+    :return (generator): One dictionary per item.
+    """
+    names = list(fields) + list(extra)
+    columns = [itemFields.get(name, name) for name in names]
+    for row in items.values_list(*columns):
+        item = dict(zip(names, row))
+        if item.get('image') is not None:
+            item['image'] = default_storage.url(item['image']) if item['image'] else None
+        yield item
+
+@require_safe
+@apiView()
+@condition(etag_func=apiCategoriesEtag)
+def categories(request):
+    """
+        Lists all categories.
+
+        :param request (HttpRequest): An HTTP request object.
+
+        :return: A JSON object with the categories as {'id', 'name'} under 'categories'.
+    """
+    return JsonResponse({'categories': list(Category.objects.values('id', 'name'))})
+
+@require_safe
+@apiView()
+@condition(etag_func=apiItemsEtag)
+def items(request):
+    """
+        Lists the unsold items, newest first, or fetches items by id.
+
+        :param request (HttpRequest): An HTTP request object. 'ids' selects up to 100 items by id; otherwise
+            'category' filters by category id and 'after' is the id of the last item of the previous page.
+
+        :return: A JSON object with the items under 'items' and the 'next' page URL, or with 'items' and 'missing'
+            for a lookup by id.
+    """
+    fields = selectedFields(request, itemFields)
+
+    if 'ids' in request.GET:
+        try:
+            ids = list(dict.fromkeys(int(pk) for pk in request.GET['ids'].split(',') if pk.strip()))
+        except ValueError:
+            raise ApiError('ids must be a comma separated list of integers.')
+        if len(ids) > maxLimit:
+            raise ApiError('At most %d ids can be fetched at once.' % maxLimit)
+
+        found = {item['id']: item for item in itemRows(Item.objects.filter(pk__in=ids), fields)}
+        return JsonResponse({
+            'items': [found[pk] for pk in ids if pk in found],
+            'missing': [pk for pk in ids if pk not in found],
+        })
+
+    limit = pageLimit(request)
+    queryset = Item.objects.filter(isSold=False).order_by('-id')
+
+    category = intParameter(request, 'category')
+    if category:
+        queryset = queryset.filter(category_id=category)
+
+    after = intParameter(request, 'after')
+    if after is not None:
+        queryset = queryset.filter(id__lt=after)
+
+    rows = list(itemRows(queryset[:limit + 1], fields))
+    return JsonResponse({
+        'items': rows[:limit],
+        'next': nextUrl(request, rows[limit - 1]['id'] if len(rows) > limit else None),
+    })
+
+@require_safe
+@apiView()
+@condition(etag_func=apiItemEtag)
+def item(request, pk):
+    """
+        Returns a single item.
+
+        :param request (HttpRequest): An HTTP request object.
+        :param pk (int): The primary key of the item.
+
+        :return: A JSON object with the item's fields, or a 404 error.
+    """
+    row = next(itemRows(Item.objects.filter(pk=pk), selectedFields(request, itemFields)), None)
+    if row is None:
+        raise ApiError('Item not found.', 404)
+    return JsonResponse(row)
+
+@require_safe
+@apiView()
+@condition(etag_func=apiSearchEtag)
+def search(request):
+    """
+        Searches the unsold items with the parameters of the search page.
+
+        :param request (HttpRequest): An HTTP request object with the optional parameters 'query', 'category',
+            'postal', 'lat'/'lng' with 'radius' in km (default 10) and 'sort=distance'.
+
+        :return: A JSON object with the matching items, newest first, under 'items' and the 'next' page URL. A
+            location search adds each item's 'distance' in km; sorted by distance it returns the nearest 'limit' items
+            and no next page.
+    """
+    fields = selectedFields(request, itemFields)
+    limit = pageLimit(request)
+    queryset = Item.objects.filter(isSold=False).order_by('-id')
+
+    query = request.GET.get('query', '').strip()
+    if query:
+        queryset = queryset.filter(Q(name__icontains=query) | Q(description__icontains=query))
+
+    category = intParameter(request, 'category')
+    if category:
+        queryset = queryset.filter(category_id=category)
+
+    postal = request.GET.get('postal', '').strip().upper()
+    if postal:
+        queryset = queryset.filter(postalCode=postal)
+
+    after = intParameter(request, 'after')
+    if after is not None:
+        queryset = queryset.filter(id__lt=after)
+
+    if 'lat' not in request.GET and 'lng' not in request.GET:
+        rows = list(itemRows(queryset[:limit + 1], fields))
+        return JsonResponse({
+            'items': rows[:limit],
+            'next': nextUrl(request, rows[limit - 1]['id'] if len(rows) > limit else None),
+        })
+
+    try:
+        latitude = float(request.GET['lat'])
+        longitude = float(request.GET['lng'])
+        radius = min(max(float(request.GET.get('radius') or 10), 0.1), 500)
+    except (KeyError, ValueError):
+        raise ApiError('lat and lng must both be numbers, and radius a number of km.')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ApiError('lat must be between -90 and 90 and lng between -180 and 180.')
+
+    # The coordinates are read for the distance check even when they were not asked for.
+    extra = tuple(name for name in ('latitude', 'longitude') if name not in fields)
+
+    def nearby():
+        # The geohash cells are a superset of the circle, so candidates still need the exact distance.
+        for row in itemRows(queryset.filter(nearQ(latitude, longitude, radius)), fields, extra):
+            row['distance'] = round(distanceKm(latitude, longitude, row['latitude'], row['longitude']), 3)
+            for name in extra:
+                del row[name]
+            if row['distance'] <= radius:
+                yield row
+
+    if request.GET.get('sort') == 'distance':
+        rows = sorted(nearby(), key=lambda row: row['distance'])
+        return JsonResponse({'items': rows[:limit], 'next': None})
+
+    rows = list(islice(nearby(), limit + 1))
+    return JsonResponse({
+        'items': rows[:limit],
+        'next': nextUrl(request, rows[limit - 1]['id'] if len(rows) > limit else None),
+    })
+
+def parseInboxCursor(cursor):
+    modifiedAt, _, pk = cursor.rpartition('_')
+    try:
+        modifiedAt = parse_datetime(modifiedAt)
+        pk = int(pk)
+    except ValueError:
+        modifiedAt = None
+    if modifiedAt is None:
+        raise ApiError('after must be the cursor of a previous page.')
+    return modifiedAt, pk
+
+@require_safe
+@apiView(loginRequired=True)
+@condition(etag_func=apiInboxEtag)
+def inbox(request):
+    """
+        Lists the conversations of the logged in user, most recently active first.
+
+        :param request (HttpRequest): An HTTP request object. 'after' is the cursor of the previous page, the
+            modification time and id of its last conversation.
+
+        :return: A JSON object with the conversations under 'conversations' and the 'next' page URL. 'members' holds
+            the usernames of the other members.
+
+        Conversations are on the messaging database, so their items and members are read from the default database
+        with one query each. Conversations about deleted items are left out, as in the HTML inbox, so a page can hold
+        fewer than 'limit' conversations while 'next' is set.
+    """
+    fields = selectedFields(request, conversationFields)
+    limit = pageLimit(request)
+    queryset = Conversation.objects.filter(members__in=[request.user.id]).order_by('-modifiedAt', '-id')
+
+    if request.GET.get('after'):
+        modifiedAt, pk = parseInboxCursor(request.GET['after'])
+        queryset = queryset.filter(Q(modifiedAt__lt=modifiedAt) | Q(modifiedAt=modifiedAt, id__lt=pk))
+
+    rows = list(queryset.values_list('id', 'item_id', 'createdAt', 'modifiedAt')[:limit + 1])
+    cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        cursor = '%s_%s' % (rows[-1][3].isoformat(), rows[-1][0])
+
+    itemNames = dict(Item.objects.filter(pk__in={itemId for _, itemId, _, _ in rows}).values_list('id', 'name'))
+    rows = [row for row in rows if row[1] in itemNames]
+
+    members = {}
+    if 'members' in fields:
+        memberships = list(ConversationMember.objects.filter(conversation_id__in=[row[0] for row in rows])
+                           .exclude(user_id=request.user.id).values_list('conversation_id', 'user_id'))
+        usernames = dict(User.objects.filter(pk__in={userId for _, userId in memberships}).values_list('id', 'username'))
+        for conversationId, userId in memberships:
+            if userId in usernames:
+                members.setdefault(conversationId, []).append(usernames[userId])
+
+    conversations = []
+    for pk, itemId, createdAt, modifiedAt in rows:
+        values = {
+            'id': pk, 'item': itemId, 'itemName': itemNames[itemId], 'members': members.get(pk, []),
+            'createdAt': createdAt, 'modifiedAt': modifiedAt,
+        }
+        conversations.append({name: values[name] for name in fields})
+
+    return JsonResponse({'conversations': conversations, 'next': nextUrl(request, cursor)})
+
+@require_safe
+@apiView(loginRequired=True)
+@condition(etag_func=apiMessagesEtag)
+def messages(request, pk):
+    """
+        Lists the messages of a conversation of the logged in user, oldest first.
+
+        :param request (HttpRequest): An HTTP request object. 'after' is the id of the last message the client has,
+            so polling with it returns only the new messages.
+        :param pk (int): The primary key of the conversation.
+
+        :return: A JSON object with the messages under 'messages' and the 'next' page URL, or a 404 error if the user
+            is not a member of the conversation. 'mine' tells whether the user sent the message.
+    """
+    if not ConversationMember.objects.filter(conversation_id=pk, user_id=request.user.id).exists():
+        raise ApiError('Conversation not found.', 404)
+
+    fields = selectedFields(request, messageFields)
+    limit = pageLimit(request)
+    queryset = ConversationMessage.objects.filter(conversation_id=pk).order_by('id')
+
+    after = intParameter(request, 'after')
+    if after is not None:
+        queryset = queryset.filter(id__gt=after)
+
+    rows = list(queryset.values_list('id', 'content', 'createdAt', 'host_id')[:limit + 1])
+    cursor = rows[limit - 1][0] if len(rows) > limit else None
+    rows = rows[:limit]
+
+    usernames = {}
+    if 'hostName' in fields:
+        usernames = dict(User.objects.filter(pk__in={hostId for _, _, _, hostId in rows}).values_list('id', 'username'))
+
+    result = []
+    for messageId, content, createdAt, hostId in rows:
+        values = {
+            'id': messageId, 'content': content, 'createdAt': createdAt, 'host': hostId,
+            'hostName': usernames.get(hostId), 'mine': hostId == request.user.id,
+        }
+        result.append({name: values[name] for name in fields})
+
+    return JsonResponse({'messages': result, 'next': nextUrl(request, cursor)})
@@ -0,0 +1,16 @@
+from django.urls import path
+from . import api
+
+app_name = 'api'
+
+urlpatterns = [
+    # Catalog
+    path('categories/', api.categories, name='categories'),
+    path('items/', api.items, name='items'),
+    path('items/<int:pk>/', api.item, name='item'),
+    path('search/', api.search, name='search'),
+
+    # Conversations of the logged in user
+    path('inbox/', api.inbox, name='inbox'),
+    path('inbox/<int:pk>/messages/', api.messages, name='messages'),
+]
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        from . import catalog, etags, outbox, purge
+        outbox.connectSignals()
+        catalog.connectSignals()
+        etags.connectSignals()
+        purge.connectSignals()
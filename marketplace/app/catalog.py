@@ -0,0 +1,55 @@
+"""
+Cached catalog data shown on every index and search page.
+
+The category list changes rarely, so it is kept in the default cache for CATEGORY_CACHE_SECONDS instead of being read
+on every request. Saving or deleting a category clears the entry, which with the default per-process cache takes
+effect at once in the process that made the change and within CATEGORY_CACHE_SECONDS everywhere else. The warm-up in
+app/warmup.py fills the cache before workers are forked, so they start with the list already in memory.
+
+Because a worker may render a list that is up to CATEGORY_CACHE_SECONDS old, the ETags of the pages showing it use
+categoryVersion(), the version of the cached list itself, rather than the current state of the table. A stale list
+is then never served under the ETag of a newer one.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+
+from .models import Category
+
+categoriesKey = 'catalog:categories:versioned'
+
+def cachedCategories():
+    """
+    :return (tuple): The version stamp of the cached category list and the list, loading both when not cached.
+    """
+    cached = cache.get(categoriesKey)
+    if cached is None:
+        categories = list(Category.objects.all())
+        # Stamped from the loaded rows themselves, so the stamp always matches the list it is cached with.
+        latest = max((category.modifiedAt for category in categories), default=None)
+        cached = ('%s:%s' % (latest.isoformat() if latest else '', len(categories)), categories)
+        cache.set(categoriesKey, cached, settings.CATEGORY_CACHE_SECONDS)
+    return cached
+
+def categoryList():
+    """
+    :return (list): All categories in their default order, from the cache when possible.
+    """
+    return cachedCategories()[1]
+
+def categoryVersion():
+    """
+    :return (str): The version stamp of the category list categoryList() returns.
+    """
+    return cachedCategories()[0]
+
+def forgetCategories(**kwargs):
+    cache.delete(categoriesKey)
+
+def connectSignals():
+    """
+    Clears the cached categories whenever a category changes. Called from AppConfig.ready().
+    """
+    post_save.connect(forgetCategories, sender=Category, dispatch_uid='catalog-categories-save')
+    post_delete.connect(forgetCategories, sender=Category, dispatch_uid='catalog-categories-delete')
@@ -0,0 +1,234 @@
+"""
+Batched digests of new conversation messages.
+
+Instead of polling the inbox, members of a conversation get one digest per window listing the messages they have not
+been told about yet. The senddigests command runs periodically and works in two bulk steps:
+
+1. collect() reads the ConversationMessage 'create' events of the messaging database's outbox as the 'digests'
+   consumer and raises NotificationPreference.pendingMessageId of every member except the sender, creating a
+   preference with the defaults for users who have none.
+2. deliver() takes the preferences with pending messages whose window has passed and that are outside their quiet
+   hours, loads their messages, conversations, items and senders with one query each and delivers the digests:
+   emails over a single connection of the configured email backend, or Notification rows for the in-app feed.
+
+lastMessageId only moves forward once a digest has been delivered, so a digest held back by the window or by quiet
+hours simply contains more messages.
+"""
+
+import zoneinfo
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage, get_connection
+from django.db import router, transaction
+from django.db.models import F, Max
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Conversation, ConversationMember, ConversationMessage, Item, Notification, NotificationPreference, OutboxEvent
+from .outbox import OutboxConsumer
+
+consumerName = 'digests'
+
+def newestMessageId():
+    return ConversationMessage.objects.aggregate(newest=Max('pk'))['newest'] or 0
+
+def inQuietHours(preference, now):
+    """
+    :param preference (NotificationPreference): The recipient's preference.
+    :param now (datetime): The current time.
+
+    :return (bool): True if now falls between the preference's quietStart and quietEnd in its time zone.
+    """
+    start, end = preference.quietStart, preference.quietEnd
+    if start is None or end is None or start == end:
+        return False
+
+    try:
+        zone = zoneinfo.ZoneInfo(preference.timeZone)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        zone = zoneinfo.ZoneInfo('UTC')
+    local = now.astimezone(zone).time()
+
+    if start < end:
+        return start <= local < end
+    # Quiet hours over midnight, e.g. 22:00 to 07:00.
+    return local >= start or local < end
+
+def isDue(preference, now):
+    """
+    :return (bool): True if a digest may be sent to the preference's user now.
+    """
+    if preference.lastDigestAt and now - preference.lastDigestAt < timedelta(minutes=preference.windowMinutes):
+        return False
+    return not inQuietHours(preference, now)
+
+def collect(batchSize=1000):
+    """
+    Marks the recipients of new messages as having pending messages.
+
+    The first run only records the current end of the outbox, so existing messages are not sent as digests.
+
+    :param batchSize (int): The number of outbox events read per batch.
+
+    :return (int): The number of messages collected.
+    """
+    consumer = OutboxConsumer(consumerName, using=router.db_for_write(ConversationMessage), batchSize=batchSize)
+    if not consumer.checkpoints.filter(consumer=consumerName).exists():
+        consumer.commit(OutboxEvent.objects.using(consumer.using).aggregate(newest=Max('pk'))['newest'] or 0)
+        return 0
+
+    collected = 0
+    for batch in consumer.batches():
+        messageIds = [event.objectId for event in batch if event.model == 'ConversationMessage' and event.action == 'create']
+        messages = list(ConversationMessage.objects.filter(pk__in=messageIds).values_list('pk', 'conversation_id', 'host_id'))
+
+        members = defaultdict(list)
+        memberships = ConversationMember.objects.filter(conversation_id__in={conversationId for _, conversationId, _ in messages})
+        for conversationId, userId in memberships.values_list('conversation_id', 'user_id'):
+            members[conversationId].append(userId)
+
+        oldest = {}
+        newest = {}
+        for pk, conversationId, hostId in messages:
+            for userId in members[conversationId]:
+                if userId != hostId:
+                    oldest[userId] = min(oldest.get(userId, pk), pk)
+                    newest[userId] = max(newest.get(userId, 0), pk)
+
+        markPending(oldest, newest)
+        consumer.commit(batch[-1])
+        collected += len(messages)
+
+    return collected
+
+def markPending(oldest, newest):
+    """
+    Raises pendingMessageId for the given users, creating missing preferences.
+
+    :param oldest (dict): The oldest new message id per user id.
+    :param newest (dict): The newest new message id per user id.
+    """
+    preferences = {preference.user_id: preference for preference in NotificationPreference.objects.filter(user_id__in=list(newest))}
+
+    changed = []
+    for userId, preference in preferences.items():
+        if newest[userId] > preference.pendingMessageId:
+            preference.pendingMessageId = newest[userId]
+            changed.append(preference)
+    NotificationPreference.objects.bulk_update(changed, ['pendingMessageId'], batch_size=500)
+
+    # Members may have been deleted since; they get no preference.
+    missing = set(User.objects.filter(pk__in=[userId for userId in newest if userId not in preferences]).values_list('pk', flat=True))
+    NotificationPreference.objects.bulk_create([
+        NotificationPreference(user_id=userId, lastMessageId=oldest[userId] - 1, pendingMessageId=newest[userId])
+        for userId in missing
+    ], batch_size=500)
+
+def deliver(now=None, batchSize=200):
+    """
+    Delivers the digests that are due.
+
+    :param now (datetime): The current time, defaults to timezone.now().
+    :param batchSize (int): The number of recipients handled per pass.
+
+    :return (dict): The number of digests sent by email, posted to the feed and dropped for users who switched them off.
+    """
+    now = now or timezone.now()
+    pending = NotificationPreference.objects.filter(pendingMessageId__gt=F('lastMessageId')).select_related('user')
+    due = [preference for preference in pending if preference.channel == NotificationPreference.OFF or isDue(preference, now)]
+
+    counts = {'email': 0, 'feed': 0, 'off': 0}
+    for start in range(0, len(due), batchSize):
+        for channel, count in deliverBatch(due[start:start + batchSize], now).items():
+            counts[channel] += count
+    return counts
+
+def deliverBatch(preferences, now):
+    active = [preference for preference in preferences if preference.channel != NotificationPreference.OFF]
+
+    conversationIds = defaultdict(set)
+    for conversationId, userId in ConversationMember.objects.filter(user_id__in=[preference.user_id for preference in active]).values_list('conversation_id', 'user_id'):
+        conversationIds[userId].add(conversationId)
+
+    messages = defaultdict(list)
+    if active:
+        newMessages = ConversationMessage.objects.filter(
+            conversation_id__in=set().union(*conversationIds.values()),
+            pk__gt=min(preference.lastMessageId for preference in active),
+            pk__lte=max(preference.pendingMessageId for preference in active),
+        ).order_by('pk').values('pk', 'conversation_id', 'host_id', 'content', 'createdAt')
+        for message in newMessages:
+            messages[message['conversation_id']].append(message)
+
+    itemIds = dict(Conversation.objects.filter(pk__in=list(messages)).values_list('pk', 'item_id'))
+    items = Item.allObjects.only('name', 'deletedAt').in_bulk(set(itemIds.values()))
+    hosts = User.objects.only('username').in_bulk({message['host_id'] for conversation in messages.values() for message in conversation})
+
+    emails = []
+    notifications = []
+    counts = {'email': 0, 'feed': 0, 'off': 0}
+    for preference in preferences:
+        digest = []
+        if preference.channel != NotificationPreference.OFF:
+            for conversationId in sorted(conversationIds[preference.user_id]):
+                unseen = [
+                    dict(message, host=hosts.get(message['host_id']))
+                    for message in messages[conversationId]
+                    if preference.lastMessageId < message['pk'] <= preference.pendingMessageId and message['host_id'] != preference.user_id
+                ]
+                if unseen:
+                    digest.append({'item': items.get(itemIds.get(conversationId)), 'messages': unseen})
+
+        if preference.channel == NotificationPreference.OFF:
+            counts['off'] += 1
+        elif not digest:
+            pass
+        elif preference.channel == NotificationPreference.EMAIL and preference.user.email:
+            emails.append(digestEmail(preference.user, digest))
+            counts['email'] += 1
+        else:
+            notifications.append(digestNotification(preference.user, digest))
+            counts['feed'] += 1
+
+        preference.lastMessageId = preference.pendingMessageId
+        if digest:
+            preference.lastDigestAt = now
+
+    # Sent first: if the backend fails nothing is marked as delivered and the next run tries again.
+    if emails:
+        get_connection().send_messages(emails)
+
+    with transaction.atomic():
+        Notification.objects.bulk_create(notifications)
+        NotificationPreference.objects.bulk_update(preferences, ['lastMessageId', 'lastDigestAt'], batch_size=500)
+
+    return counts
+
+def digestEmail(user, digest):
+    count = sum(len(conversation['messages']) for conversation in digest)
+    body = render_to_string('app/digestEmail.txt', {
+        'user': user,
+        'count': count,
+        'digest': digest,
+        'inboxUrl': settings.SITE_URL + reverse('item:inbox'),
+        'settingsUrl': settings.SITE_URL + reverse('item:notifications'),
+    })
+    return EmailMessage('You have %d new message%s' % (count, '' if count == 1 else 's'), body, to=[user.email])
+
+def digestNotification(user, digest):
+    count = sum(len(conversation['messages']) for conversation in digest)
+    if len(digest) == 1:
+        conversation = digest[0]
+        senders = sorted({message['host'].username for message in conversation['messages'] if message['host']})
+        text = '%d new message%s from %s about %s' % (
+            count, '' if count == 1 else 's', ', '.join(senders) or 'a deleted user',
+            conversation['item'].name if conversation['item'] else 'a deleted item',
+        )
+        item = conversation['item'] if conversation['item'] and conversation['item'].deletedAt is None else None
+        return Notification(user=user, item=item, text=text[:255])
+
+    return Notification(user=user, text='%d new messages in %d conversations' % (count, len(digest)))
@@ -0,0 +1,137 @@
+"""
+ETag functions for the conditional views in views.py and api.py.
+
+Each ETag is built from data version stamps instead of hashing the rendered body, so a matching If-None-Match lets
+the view return 304 before any template is rendered. The requesting user is part of every ETag because base.html
+changes with the login state.
+
+Pages listing items use dataVersion(), the counters that outbox.record() bumps in every transaction writing items or
+categories, including QuerySet.update() and deletes. Reading them is one indexed lookup, where aggregating the
+modifiedAt of every listed item grew with the table. Renaming a user bumps the modifiedAt of their items (see
+connectSignals()), which is a write to the items, so the counters also cover the owner names shown next to them. Only
+the inbox, which is bounded by the user's own conversations, still stamps its items one by one.
+"""
+
+import hashlib
+
+from django.contrib.auth.models import User
+from django.db.models import Count, Max
+from django.db.models.signals import pre_save
+from django.utils import timezone
+
+from .catalog import categoryVersion
+from .models import Category, Conversation, ConversationMember, ConversationMessage, DataVersion, Item
+
+def itemStamp(items):
+    """
+    Returns a cheap version stamp for a queryset of items.
+
+    :param items (QuerySet): The items shown on the page.
+
+    :return (str): The newest modification time and the number of items, joined by a colon.
+    """
+    stamp = items.aggregate(latest=Max('modifiedAt'), total=Count('id'))
+    latest = stamp['latest'].isoformat() if stamp['latest'] else ''
+    return '%s:%s' % (latest, stamp['total'])
+
+def dataVersion(*models):
+    """
+    Returns the version stamp of whole tables.
+
+    :param models (Model): The tracked models whose rows the page shows.
+
+    :return (str): The DataVersion counters of the models, joined by colons.
+    """
+    names = [model.__name__ for model in models]
+    versions = dict(DataVersion.objects.filter(model__in=names).values_list('model', 'version'))
+    return ':'.join(str(versions.get(name, 0)) for name in names)
+
+def makeEtag(request, *parts):
+    """
+    Hashes the version stamps of a page together with the requesting user.
+
+    :param request (HttpRequest): The request the ETag is computed for.
+    :param parts (str): Version stamps and request parameters that change the page.
+
+    :return (str): The unquoted ETag value.
+    """
+    key = '|'.join([str(request.user.pk or 0)] + [str(part) for part in parts])
+    return hashlib.md5(key.encode()).hexdigest()
+
+def indexEtag(request):
+    return makeEtag(request, 'index', dataVersion(Item), categoryVersion())
+
+def searchEtag(request):
+    """
+    The search page renders a CSRF token for the Save Search form, so the CSRF secret is part of the stamp: a page
+    cached before the secret rotated, e.g. by logging in again, would otherwise be revalidated with a stale token.
+    """
+    return makeEtag(request, 'search', request.GET.urlencode(), request.META.get('CSRF_COOKIE', ''),
+                    dataVersion(Item), categoryVersion())
+
+def detailEtag(request, pk):
+    """
+    The detail page shows the item, its category and related items. Returns None when the item does not exist so
+    the view can raise the 404 itself.
+    """
+    if not Item.objects.filter(pk=pk).exists():
+        return None
+
+    return makeEtag(request, 'detail', pk, dataVersion(Item, Category))
+
+def apiItemsEtag(request):
+    """
+    Items carry their category's name, so the category version is included.
+    """
+    return makeEtag(request, 'api-items', request.GET.urlencode(), dataVersion(Item, Category))
+
+def apiItemEtag(request, pk):
+    if not Item.objects.filter(pk=pk).exists():
+        return None
+
+    return makeEtag(request, 'api-item', pk, request.GET.urlencode(), dataVersion(Item, Category))
+
+def apiCategoriesEtag(request):
+    return makeEtag(request, 'api-categories', dataVersion(Category))
+
+def apiSearchEtag(request):
+    return makeEtag(request, 'api-search', request.GET.urlencode(), dataVersion(Item, Category))
+
+def apiInboxEtag(request):
+    """
+    Posting a message does not touch its conversation, so the newest message id is part of the stamp. The inbox shows
+    item names and leaves out conversations about deleted items, so the items of the user's conversations are stamped
+    too, on the default database.
+    """
+    conversations = Conversation.objects.filter(members__in=[request.user.id])
+    stamp = conversations.aggregate(latest=Max('modifiedAt'), total=Count('id'))
+    newest = ConversationMessage.objects.filter(conversation__in=conversations).aggregate(newest=Max('id'))['newest']
+    items = itemStamp(Item.objects.filter(pk__in=set(conversations.values_list('item_id', flat=True))))
+    return makeEtag(request, 'api-inbox', request.GET.urlencode(), stamp['latest'], stamp['total'], newest, items)
+
+def apiMessagesEtag(request, pk):
+    """
+    Returns None unless the requesting user is a member of the conversation, so the view answers with 404 itself.
+    """
+    if not ConversationMember.objects.filter(conversation_id=pk, user_id=request.user.id).exists():
+        return None
+
+    stamp = ConversationMessage.objects.filter(conversation_id=pk).aggregate(newest=Max('id'), total=Count('id'))
+    return makeEtag(request, 'api-messages', pk, request.GET.urlencode(), stamp['newest'], stamp['total'])
+
+def touchOwnerItems(sender, instance, update_fields=None, **kwargs):
+    """
+    Bumps the modifiedAt stamp of a user's items when the username changes, since item pages show it.
+    """
+    if instance.pk is None or (update_fields is not None and 'username' not in update_fields):
+        return
+
+    previous = User.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+    if previous is not None and previous != instance.username:
+        Item.allObjects.filter(owner_id=instance.pk).update(modifiedAt=timezone.now())
+
+def connectSignals():
+    """
+    Keeps the item stamps in step with the usernames shown next to items. Called from AppConfig.ready().
+    """
+    pre_save.connect(touchOwnerItems, sender=User, dispatch_uid='etags-owner-username')
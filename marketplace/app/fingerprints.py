@@ -0,0 +1,174 @@
+"""
+Near-duplicate detection for listings.
+
+Each item gets an ItemFingerprint holding a 64-bit difference hash (dHash) of its image and a MinHash signature of
+its description. Both are indexed through FingerprintBucket rows so a lookup never compares against every listing:
+
+- The image hash is split into four 16-bit chunks. Two hashes within a Hamming distance of 3 must share at least one
+  chunk exactly (pigeonhole), so candidates are the items sharing any chunk (multi-index hashing).
+- The MinHash signature is split into bands (locality-sensitive hashing). Descriptions with a high Jaccard
+  similarity share at least one band with high probability.
+
+Candidates from the indexed bucket lookup are then verified against the full hash or signature.
+"""
+
+import hashlib
+import random
+import re
+
+from PIL import Image
+
+from .models import FingerprintBucket, ItemFingerprint
+
+imageChunks = 4
+maxImageDistance = 3
+minhashSize = 32
+minhashBands = 8
+minTextSimilarity = 0.8
+shingleSize = 3
+mersennePrime = (1 << 61) - 1
+
+_rng = random.Random(28)
+_permutations = [(_rng.randrange(1, mersennePrime), _rng.randrange(0, mersennePrime)) for _ in range(minhashSize)]
+_words = re.compile(r'\w+')
+
+def imageHash(file):
+    """
+    Computes the difference hash of an image: the image is shrunk to 9x8 greyscale pixels and each bit records
+    whether a pixel is brighter than its right-hand neighbour. Resizing, recompression and small edits barely
+    change the hash.
+
+    :param file (File): An open image file. It is rewound afterwards so it can still be saved.
+
+    :return (int): The 64-bit hash, or None if the file is not a readable image.
+    """
+    try:
+        file.seek(0)
+        image = Image.open(file)
+        # Lets the JPEG decoder downscale while decoding instead of decoding the full-size photo.
+        image.draft('L', (64, 64))
+        pixels = list(image.convert('L').resize((9, 8), Image.BOX).getdata())
+    except (OSError, ValueError):
+        return None
+    finally:
+        file.seek(0)
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def textSignature(text):
+    """
+    Computes the MinHash signature of a description's word shingles.
+
+    :param text (str): The description.
+
+    :return (list): minhashSize 32-bit values, or None if the text is too short to compare.
+    """
+    words = _words.findall((text or '').lower())
+    if len(words) < shingleSize + 2:
+        return None
+
+    shingles = {' '.join(words[index:index + shingleSize]) for index in range(len(words) - shingleSize + 1)}
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'big') for shingle in shingles]
+
+    return [min((a * value + b) % mersennePrime for value in hashes) & 0xffffffff for a, b in _permutations]
+
+def hamming(first, second):
+    return bin(first ^ second).count('1')
+
+def similarity(first, second):
+    """
+    :return (float): The Jaccard similarity estimated from two MinHash signatures.
+    """
+    return sum(1 for a, b in zip(first, second) if a == b) / minhashSize
+
+def encodeSignature(signature):
+    return ''.join('%08x' % value for value in signature) if signature else ''
+
+def decodeSignature(value):
+    return [int(value[index:index + 8], 16) for index in range(0, len(value), 8)] if value else None
+
+def bucketKeys(hashValue, signature):
+    """
+    :return (list): The index keys of an image hash and a description signature.
+    """
+    keys = []
+
+    if hashValue is not None:
+        for chunk in range(imageChunks):
+            keys.append('i%d:%04x' % (chunk, (hashValue >> (16 * chunk)) & 0xffff))
+
+    if signature:
+        rows = minhashSize // minhashBands
+        for band in range(minhashBands):
+            digest = hashlib.blake2b(encodeSignature(signature[band * rows:(band + 1) * rows]).encode(), digest_size=8)
+            keys.append('d%d:%s' % (band, digest.hexdigest()))
+
+    return keys
+
+def findDuplicates(hashValue, signature, exclude=None):
+    """
+    Finds the listings whose image or description is a near-duplicate.
+
+    :param hashValue (int): The image hash of the new listing, or None.
+    :param signature (list): The description signature of the new listing, or None.
+    :param exclude (int): The primary key of an item to leave out, e.g. the item being edited.
+
+    :return (list): Primary keys of the matching items.
+    """
+    keys = bucketKeys(hashValue, signature)
+    if not keys:
+        return []
+
+    candidates = (ItemFingerprint.objects.filter(buckets__key__in=keys)
+                  .values_list('item_id', 'imageHash', 'textSignature').distinct())
+
+    duplicates = []
+    for itemId, candidateHash, candidateSignature in candidates:
+        if itemId == exclude:
+            continue
+
+        if hashValue is not None and candidateHash and hamming(hashValue, int(candidateHash, 16)) <= maxImageDistance:
+            duplicates.append(itemId)
+        elif signature and candidateSignature and similarity(signature, decodeSignature(candidateSignature)) >= minTextSimilarity:
+            duplicates.append(itemId)
+
+    return duplicates
+
+def storeFingerprint(item, hashValue, signature):
+    """
+    Saves the fingerprint of an item and replaces its index keys.
+    """
+    fingerprint, created = ItemFingerprint.objects.update_or_create(item=item, defaults={
+        'imageHash': '%016x' % hashValue if hashValue is not None else '',
+        'textSignature': encodeSignature(signature),
+    })
+
+    if not created:
+        fingerprint.buckets.all().delete()
+
+    FingerprintBucket.objects.bulk_create(
+        FingerprintBucket(fingerprint=fingerprint, key=key) for key in bucketKeys(hashValue, signature)
+    )
+    return fingerprint
+
+def fingerprintItem(item):
+    """
+    Computes and saves the fingerprint of an already saved item from its stored image and description.
+
+    :return (tuple): The image hash and the description signature.
+    """
+    hashValue = None
+    if item.image:
+        try:
+            with item.image.open('rb') as file:
+                hashValue = imageHash(file)
+        except OSError:
+            pass
+
+    signature = textSignature(item.description)
+    storeFingerprint(item, hashValue, signature)
+    return hashValue, signature
@@ -1,7 +1,11 @@
+import zoneinfo
+
 from django import forms
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.models import User
-from .models import Item, Conversation, ConversationMessage
+from django.core.files.uploadedfile import UploadedFile
+from .models import Item, Conversation, ConversationMessage, NotificationPreference
 
 class SignUp(UserCreationForm):
     """
@@ -59,6 +63,20 @@ class Login(AuthenticationForm):
 
 inputClass = 'w-full py-4 px-6 rounded-xl border'
 
+def cleanImageSize(image):
+    """
+    Applies UPLOAD_MAX_BYTES to images posted with the item forms, as startUpload() does for resumable uploads.
+
+    :param image (File): The cleaned image field, the item's current image when no new file was posted.
+
+    :return (File): The image.
+
+    :raises ValidationError: If a newly posted image is too large.
+    """
+    if isinstance(image, UploadedFile) and image.size > settings.UPLOAD_MAX_BYTES:
+        raise forms.ValidationError('Images may be at most %d bytes.' % settings.UPLOAD_MAX_BYTES)
+    return image
+
 class NewItem(forms.ModelForm):
     """
         Form for creating a new item.
@@ -69,11 +87,17 @@ class NewItem(forms.ModelForm):
             description (Textarea): A description of the new item.
             price (CharField): The price of the new item.
             image (FileInput): An image representing the new item.
+            latitude (NumberInput): Latitude of the pickup location.
+            longitude (NumberInput): Longitude of the pickup location.
+            postalCode (CharField): Postal area of the pickup location.
+            upload (HiddenInput): The id of an image sent through the resumable upload endpoint, used instead of image.
 
     """
+    upload = forms.UUIDField(required=False, widget=forms.HiddenInput)
+
     class Meta:
         model = Item
-        fields = ('category', 'name', 'description', 'price', 'image',)
+        fields = ('category', 'name', 'description', 'price', 'image', 'latitude', 'longitude', 'postalCode',)
 
         widgets = {
             'category' : forms.Select(attrs={
@@ -91,9 +115,23 @@ class NewItem(forms.ModelForm):
             'image': forms.FileInput(attrs={
                 'class': inputClass,
             }),
+            'latitude': forms.NumberInput(attrs={
+                'class': inputClass,
+                'step': 'any',
+            }),
+            'longitude': forms.NumberInput(attrs={
+                'class': inputClass,
+                'step': 'any',
+            }),
+            'postalCode': forms.TextInput(attrs={
+                'class': inputClass,
+            }),
 
         }
 
+    def clean_image(self):
+        return cleanImageSize(self.cleaned_data.get('image'))
+
 class EditItem(forms.ModelForm):
     """
         Form for editing an existing item.
@@ -104,11 +142,17 @@ class EditItem(forms.ModelForm):
             price (CharField): The updated price of the item.
             image (FileInput): The updated image representing the item.
             isSold (CheckboxInput): Indicates whether the item is sold or not.
+            latitude (NumberInput): The updated latitude of the pickup location.
+            longitude (NumberInput): The updated longitude of the pickup location.
+            postalCode (CharField): The updated postal area of the pickup location.
+            upload (HiddenInput): The id of an image sent through the resumable upload endpoint, used instead of image.
 
     """
+    upload = forms.UUIDField(required=False, widget=forms.HiddenInput)
+
     class Meta:
         model = Item
-        fields = ('name', 'description', 'price', 'image','isSold')
+        fields = ('name', 'description', 'price', 'image','isSold', 'latitude', 'longitude', 'postalCode')
 
         widgets = {
             'name': forms.TextInput(attrs={
@@ -123,9 +167,23 @@ class EditItem(forms.ModelForm):
             'image': forms.FileInput(attrs={
                 'class': inputClass,
             }),
+            'latitude': forms.NumberInput(attrs={
+                'class': inputClass,
+                'step': 'any',
+            }),
+            'longitude': forms.NumberInput(attrs={
+                'class': inputClass,
+                'step': 'any',
+            }),
+            'postalCode': forms.TextInput(attrs={
+                'class': inputClass,
+            }),
 
         }
 
+    def clean_image(self):
+        return cleanImageSize(self.cleaned_data.get('image'))
+
 class MessageForm(forms.ModelForm):
     """
     Form for sending a message in a conversation.
@@ -141,4 +199,52 @@ class MessageForm(forms.ModelForm):
             'content' : forms.Textarea(attrs={
                 'class' : 'w-full py-4 px-6 rounded-xl border'
             })
-        }
\ No newline at end of file
+        }
+
+class NotificationPreferenceForm(forms.ModelForm):
+    """
+    Form for choosing how and when new messages are announced.
+
+    Attributes:
+        channel (Select): Email, the notifications page or nothing.
+        windowMinutes (NumberInput): Minimum minutes between two digests.
+        quietStart (TimeInput): Start of the quiet hours (optional).
+        quietEnd (TimeInput): End of the quiet hours (optional).
+        timeZone (TextInput): The time zone of the quiet hours.
+
+    """
+    class Meta:
+        model = NotificationPreference
+        fields = ('channel', 'windowMinutes', 'quietStart', 'quietEnd', 'timeZone')
+        labels = {
+            'windowMinutes': 'Minutes between digests',
+            'quietStart': 'Quiet hours from',
+            'quietEnd': 'Quiet hours until',
+            'timeZone': 'Time zone',
+        }
+        widgets = {
+            'channel': forms.Select(attrs={
+                'class': inputClass,
+            }),
+            'windowMinutes': forms.NumberInput(attrs={
+                'class': inputClass,
+            }),
+            'quietStart': forms.TimeInput(attrs={
+                'class': inputClass,
+                'type': 'time',
+            }),
+            'quietEnd': forms.TimeInput(attrs={
+                'class': inputClass,
+                'type': 'time',
+            }),
+            'timeZone': forms.TextInput(attrs={
+                'class': inputClass,
+                'placeholder': 'Europe/Berlin',
+            }),
+        }
+
+    def clean_timeZone(self):
+        timeZone = self.cleaned_data['timeZone'].strip()
+        if timeZone not in zoneinfo.available_timezones():
+            raise forms.ValidationError('Enter a time zone such as America/New_York.')
+        return timeZone
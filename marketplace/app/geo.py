@@ -0,0 +1,169 @@
+"""
+Geohash helpers for location-aware search.
+
+Every item with coordinates stores its geohash in Item.geohash, which is indexed. A radius query is answered by
+picking a geohash precision whose cells are at least as large as the radius, covering the search circle with the
+cells its bounding box overlaps and fetching only the items inside those cells with indexed range scans. That is
+usually up to nine cells around the centre, but near the poles and for very large radii even the coarsest cells are
+smaller than the box and many more are needed. The exact distance is then computed for the candidates only.
+"""
+
+import math
+
+from django.db.models import Q
+
+base32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+earthRadiusKm = 6371.0088
+storedPrecision = 9
+
+def encode(latitude, longitude, precision=storedPrecision):
+    """
+    Encodes a coordinate as a geohash.
+
+    :param latitude (float): Latitude in degrees, between -90 and 90.
+    :param longitude (float): Longitude in degrees, between -180 and 180.
+    :param precision (int): Number of characters of the geohash.
+
+    :return (str): The geohash of the cell containing the coordinate.
+    """
+    latRange = [-90.0, 90.0]
+    lonRange = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bitCount = 0
+    evenBit = True
+
+    while len(geohash) < precision:
+        if evenBit:
+            middle = (lonRange[0] + lonRange[1]) / 2
+            if longitude >= middle:
+                bits = bits * 2 + 1
+                lonRange[0] = middle
+            else:
+                bits = bits * 2
+                lonRange[1] = middle
+        else:
+            middle = (latRange[0] + latRange[1]) / 2
+            if latitude >= middle:
+                bits = bits * 2 + 1
+                latRange[0] = middle
+            else:
+                bits = bits * 2
+                latRange[1] = middle
+
+        evenBit = not evenBit
+        bitCount += 1
+
+        if bitCount == 5:
+            geohash.append(base32[bits])
+            bits = 0
+            bitCount = 0
+
+    return ''.join(geohash)
+
+def cellSize(precision):
+    """
+    :return (tuple): The (latitude, longitude) size in degrees of a geohash cell of the given precision.
+    """
+    lonBits = (5 * precision + 1) // 2
+    latBits = (5 * precision) // 2
+    return 180.0 / 2 ** latBits, 360.0 / 2 ** lonBits
+
+def distanceKm(latitude1, longitude1, latitude2, longitude2):
+    """
+    :return (float): The great-circle distance between two coordinates in kilometres (haversine formula).
+    """
+    lat1 = math.radians(latitude1)
+    lat2 = math.radians(latitude2)
+    dLat = lat2 - lat1
+    dLon = math.radians(longitude2 - longitude1)
+
+    a = math.sin(dLat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dLon / 2) ** 2
+    return 2 * earthRadiusKm * math.asin(min(1.0, math.sqrt(a)))
+
+def steps(start, end, step):
+    """
+    Yields points from start to end, both included, at most step apart, so every cell of that size between them is hit.
+    """
+    point = start
+    while point < end:
+        yield point
+        point += step
+    yield end
+
+def coveringCells(latitude, longitude, radiusKm):
+    """
+    Returns the geohash cells that together cover a circle.
+
+    The precision is the finest one whose cells are at least as tall and as wide as the radius. The circle's
+    bounding box then spans at most three cells per axis, and sampling the box at its edges and centre hits each
+    of them. Near the poles, or for very large radii, even the coarsest cells are smaller than the box, which is then
+    sampled once per cell width; a circle containing a pole spans every longitude.
+
+    :param latitude (float): Latitude of the centre in degrees.
+    :param longitude (float): Longitude of the centre in degrees.
+    :param radiusKm (float): Radius of the circle in kilometres.
+
+    :return (set): Geohash prefixes of the covering cells.
+    """
+    # Exact bounding box on the sphere: the widest point of the circle lies poleward of its centre.
+    angle = radiusKm / earthRadiusKm
+    dLat = math.degrees(angle)
+    if abs(latitude) + dLat >= 90:
+        dLon = 180.0
+    else:
+        dLon = math.degrees(math.asin(min(1.0, math.sin(angle) / math.cos(math.radians(latitude)))))
+
+    precision = storedPrecision
+    while precision > 1:
+        height, width = cellSize(precision)
+        if height >= dLat and width >= dLon:
+            break
+        precision -= 1
+    height, width = cellSize(precision)
+
+    cells = set()
+    for lat in steps(latitude - dLat, latitude + dLat, min(height, dLat) or height):
+        for lon in steps(longitude - dLon, longitude + dLon, min(width, dLon) or width):
+            lat = min(max(lat, -90.0), 90.0)
+            lon = (lon + 180.0) % 360.0 - 180.0
+            cells.add(encode(lat, lon, precision))
+
+    return cells
+
+def nearQ(latitude, longitude, radiusKm):
+    """
+    Builds a filter selecting the items inside the cells covering a circle.
+
+    Each cell becomes a range condition on the indexed geohash column rather than a LIKE, so the database can answer
+    it with an index range scan.
+
+    :return (Q): A filter for Item querysets. Candidates still need an exact distance check.
+    """
+    query = Q()
+    for cell in coveringCells(latitude, longitude, radiusKm):
+        query |= Q(geohash__gte=cell, geohash__lt=cell + '~')
+    return query
+
+def withinRadius(items, latitude, longitude, radiusKm, sortByDistance=False):
+    """
+    Filters an item queryset to the items within a radius and annotates each with its distance.
+
+    :param items (QuerySet): The items to search.
+    :param latitude (float): Latitude of the centre in degrees.
+    :param longitude (float): Longitude of the centre in degrees.
+    :param radiusKm (float): Radius in kilometres.
+    :param sortByDistance (bool): Whether to order the result by distance instead of the queryset's ordering.
+
+    :return (list): The matching items, each with a distance attribute in kilometres.
+    """
+    nearby = []
+    for item in items.filter(nearQ(latitude, longitude, radiusKm)):
+        item.distance = distanceKm(latitude, longitude, item.latitude, item.longitude)
+        if item.distance <= radiusKm:
+            nearby.append(item)
+
+    if sortByDistance:
+        nearby.sort(key=lambda item: item.distance)
+
+    return nearby
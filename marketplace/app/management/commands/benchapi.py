@@ -0,0 +1,94 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from app.models import ConversationMember, Item
+
+class Command(BaseCommand):
+    """
+        Compares the throughput of the JSON API with the HTML pages showing the same data.
+
+        Every pair is requested --requests times in-process with the test client, without network or server overhead,
+        so the numbers compare the work done by the views themselves. For each page it prints the requests per second,
+        the mean response size and the queries per request over all databases, followed by the same numbers for a
+        revalidation with the ETag of the first response. The inbox pairs are only measured with --user, whose session
+        is used for them.
+
+        Usage: python manage.py benchapi [--requests 200] [--user username]
+    """
+    help = 'Benchmark the JSON API against the HTML views.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per page.')
+        parser.add_argument('--user', help='Username to log in as for the inbox pages.')
+
+    def handle(self, *args, **options):
+        host = next((host for host in settings.ALLOWED_HOSTS if '*' not in host), 'localhost').lstrip('.')
+        client = Client(HTTP_HOST=host)
+
+        pairs = [
+            ('index', reverse('item:index'), reverse('api:items')),
+            ('search', reverse('item:search') + '?query=a', reverse('api:search') + '?query=a'),
+        ]
+
+        item = Item.objects.filter(isSold=False).order_by('-id').first()
+        if item is not None:
+            pairs.append(('detail', reverse('item:detail', args=[item.id]), reverse('api:item', args=[item.id])))
+
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError('No user named %s.' % options['user'])
+            client.force_login(user)
+
+            pairs.append(('inbox', reverse('item:inbox'), reverse('api:inbox')))
+            membership = ConversationMember.objects.filter(user_id=user.id).order_by('-conversation_id').first()
+            if membership is not None:
+                pairs.append(('conversation', reverse('item:info', args=[membership.conversation_id]),
+                              reverse('api:messages', args=[membership.conversation_id])))
+
+        self.stdout.write('%-14s %-6s %10s %10s %9s %10s %9s' % ('page', 'kind', 'req/s', 'bytes', 'queries', '304 req/s', 'queries'))
+
+        for name, html, api in pairs:
+            for kind, path in (('html', html), ('api', api)):
+                perSecond, size, queries, etag = self.measure(client, path, options['requests'])
+                revalidated = '-', '-'
+                if etag:
+                    notModified = self.measure(client, path, options['requests'], HTTP_IF_NONE_MATCH=etag)
+                    revalidated = '%.0f' % notModified[0], '%.1f' % notModified[2]
+                self.stdout.write('%-14s %-6s %10.0f %10d %9.1f %10s %9s' % (name, kind, perSecond, size, queries, *revalidated))
+
+    def measure(self, client, path, count, **headers):
+        """
+        Requests a page repeatedly.
+
+        :return (tuple): Requests per second, mean response size in bytes, queries per request and the ETag of the
+            first response.
+        """
+        response = client.get(path, **headers)
+        if response.status_code not in (200, 304):
+            raise CommandError('%s answered %d.' % (path, response.status_code))
+        etag = response.get('ETag')
+
+        contexts = [CaptureQueriesContext(connection) for connection in connections.all()]
+        for context in contexts:
+            context.__enter__()
+
+        size = 0
+        started = time.perf_counter()
+        try:
+            for _ in range(count):
+                size += len(client.get(path, **headers).content)
+        finally:
+            elapsed = time.perf_counter() - started
+            for context in contexts:
+                context.__exit__(None, None, None)
+
+        queries = sum(len(context) for context in contexts)
+        return count / elapsed, size / count, queries / count, etag
@@ -0,0 +1,83 @@
+import random
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import geo
+
+class Command(BaseCommand):
+    """
+        Benchmarks radius queries on a synthetic dataset.
+
+        Builds an in-memory SQLite table with the same location columns as Item (latitude, longitude and an indexed
+        geohash), fills it with random points spread over the continental US and compares a full scan that computes
+        the distance for every row against the geohash cell lookup from geo.py. Both must return the same ids.
+
+        Usage: python manage.py benchgeo [--items 1000000] [--queries 200] [--radius 10]
+    """
+    help = 'Compare full-scan and geohash-indexed radius queries on synthetic items.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--radius', type=float, default=10.0)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        radius = options['radius']
+
+        db = sqlite3.connect(':memory:')
+        db.create_function('distance', 4, geo.distanceKm, deterministic=True)
+        db.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, latitude REAL, longitude REAL, geohash TEXT)')
+
+        started = time.perf_counter()
+        batch = []
+        for pk in range(1, options['items'] + 1):
+            latitude = rng.uniform(25.0, 49.0)
+            longitude = rng.uniform(-124.0, -67.0)
+            batch.append((pk, latitude, longitude, geo.encode(latitude, longitude)))
+
+            if len(batch) == 10000:
+                db.executemany('INSERT INTO item VALUES (?, ?, ?, ?)', batch)
+                batch = []
+        db.executemany('INSERT INTO item VALUES (?, ?, ?, ?)', batch)
+        db.execute('CREATE INDEX item_geohash ON item (geohash)')
+        db.commit()
+        self.stdout.write('Loaded %d items in %.1fs' % (options['items'], time.perf_counter() - started))
+
+        centres = [(rng.uniform(25.0, 49.0), rng.uniform(-124.0, -67.0)) for _ in range(options['queries'])]
+
+        started = time.perf_counter()
+        scanned = []
+        for latitude, longitude in centres:
+            rows = db.execute('SELECT id FROM item WHERE distance(?, ?, latitude, longitude) <= ?',
+                              (latitude, longitude, radius))
+            scanned.append(sorted(row[0] for row in rows))
+        scanTime = time.perf_counter() - started
+
+        started = time.perf_counter()
+        indexed = []
+        candidates = 0
+        for latitude, longitude in centres:
+            found = []
+            for cell in geo.coveringCells(latitude, longitude, radius):
+                rows = db.execute('SELECT id, latitude, longitude FROM item WHERE geohash >= ? AND geohash < ?',
+                                  (cell, cell + '~'))
+                for pk, lat, lng in rows:
+                    candidates += 1
+                    if geo.distanceKm(latitude, longitude, lat, lng) <= radius:
+                        found.append(pk)
+            indexed.append(sorted(found))
+        indexTime = time.perf_counter() - started
+
+        queries = len(centres)
+        self.stdout.write('Full scan:     %8.2f ms/query' % (scanTime * 1000 / queries))
+        self.stdout.write('Geohash index: %8.2f ms/query (%.0f candidates/query, %.1f matches/query)' % (
+            indexTime * 1000 / queries, candidates / queries, sum(map(len, indexed)) / queries))
+
+        if scanned != indexed:
+            self.stderr.write('Result mismatch between full scan and geohash index')
+        else:
+            self.stdout.write('Results identical, %.0fx faster' % (scanTime / max(indexTime, 1e-9)))
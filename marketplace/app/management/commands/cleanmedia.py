@@ -0,0 +1,86 @@
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.models import Item, Upload, UploadUsage
+from app.uploads import discardUpload
+
+class Command(BaseCommand):
+    """
+        Removes item images that no item or upload references any more, abandoned partial uploads and the upload
+        quota counters of past days.
+
+        The image directory is walked with os.scandir and checked against the database a batch of file names at a
+        time, so neither the directory listing nor the Item table is ever held in memory. Files younger than
+        --grace-hours are kept because they may belong to a listing that is being created right now.
+
+        Usage: python manage.py cleanmedia [--dry-run] [--grace-hours 24] [--batch-size 500]
+    """
+    help = 'Delete unreferenced item images and abandoned uploads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only list what would be deleted.')
+        parser.add_argument('--grace-hours', type=float, default=24)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        self.dryRun = options['dry_run']
+        self.cutoff = time.time() - options['grace_hours'] * 3600
+        uploadTo = Item._meta.get_field('image').upload_to
+        directory = os.path.join(settings.MEDIA_ROOT, uploadTo)
+
+        removed = 0
+        batch = []
+        if os.path.isdir(directory):
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.stat().st_mtime < self.cutoff:
+                        batch.append('%s/%s' % (uploadTo, entry.name))
+
+                    if len(batch) == options['batch_size']:
+                        removed += self.removeUnreferenced(batch)
+                        batch = []
+        removed += self.removeUnreferenced(batch)
+
+        stale = Upload.objects.filter(isComplete=False, createdAt__lt=timezone.now() - timedelta(hours=options['grace_hours']))
+        if self.dryRun:
+            abandoned = stale.count()
+        else:
+            abandoned = 0
+            while True:
+                # Materialised first: SQLite gives no isolation between a running cursor and deletes on the same
+                # connection. Every discarded upload leaves the queryset, so the next slice starts on fresh rows.
+                batch = list(stale.order_by('pk')[:options['batch_size']])
+                if not batch:
+                    break
+                for upload in batch:
+                    discardUpload(upload)
+                abandoned += len(batch)
+
+        # The quota only reads today's counters.
+        if not self.dryRun:
+            UploadUsage.objects.filter(day__lt=timezone.now().date()).delete()
+
+        prefix = 'Would remove' if self.dryRun else 'Removed'
+        self.stdout.write('%s %d unreferenced images and %d abandoned uploads.' % (prefix, removed, abandoned))
+
+    def removeUnreferenced(self, names):
+        if not names:
+            return 0
+
+        referenced = set(Item.allObjects.filter(image__in=names).values_list('image', flat=True))
+        referenced.update(Upload.objects.filter(file__in=names).values_list('file', flat=True))
+
+        removed = 0
+        for name in names:
+            if name not in referenced:
+                self.stdout.write(('Would remove %s' if self.dryRun else 'Removing %s') % name)
+                if not self.dryRun:
+                    default_storage.delete(name)
+                removed += 1
+        return removed
@@ -0,0 +1,112 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+
+from app.models import Conversation, ConversationMember, ConversationMessage
+
+# Parents first, so rows never refer to a conversation that has not been copied yet.
+messagingModels = (Conversation, ConversationMember, ConversationMessage)
+
+class Command(BaseCommand):
+    """
+        Copies conversations, their members and their messages from the tables they used to have on the default
+        database to the messaging database the router now sends them to.
+
+        Rows are copied in primary key order, --batch-size rows per transaction, keeping their ids so links and
+        outbox events stay valid. Rows already on the messaging database are skipped, so an interrupted run can
+        simply be started again; a row that exists on both sides with different contents is reported as a conflict.
+        Run it after migrate --database messaging and before serving traffic, so new conversations cannot take the
+        ids of old ones. --drop removes the old tables once every row has been copied; until then their foreign keys
+        keep items they refer to from being purged.
+
+        Usage: python manage.py movemessaging [--source default] [--batch-size 1000] [--drop]
+    """
+    help = 'Move conversations and messages from the default database to the messaging database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default='default', help='Database alias holding the old tables.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--drop', action='store_true', help='Drop the old tables after a complete copy.')
+
+    def handle(self, *args, **options):
+        source = connections[options['source']]
+        sourceTables = source.introspection.table_names()
+
+        complete = True
+        for model in messagingModels:
+            target = connections[router.db_for_write(model)]
+            if target.alias == source.alias:
+                raise CommandError('%s is routed to %s already, there is nothing to move.' % (model.__name__, source.alias))
+            if model._meta.db_table not in target.introspection.table_names():
+                raise CommandError('Run "python manage.py migrate --database %s" first.' % target.alias)
+            if model._meta.db_table not in sourceTables:
+                self.stdout.write('%s: no table on %s, skipped.' % (model._meta.db_table, source.alias))
+                continue
+
+            copied, skipped, conflicts = self.copy(model, source, target, options['batch_size'])
+            self.stdout.write('%s: copied %d rows, %d already present, %d conflicts.' % (model._meta.db_table, copied, skipped, conflicts))
+            complete = complete and not conflicts
+
+            # Explicit ids leave PostgreSQL sequences behind the copied rows.
+            with target.cursor() as cursor:
+                for sql in target.ops.sequence_reset_sql(no_style(), [model]):
+                    cursor.execute(sql)
+
+        if not complete:
+            raise CommandError('Some rows differ between the databases; resolve the conflicts before dropping anything.')
+
+        if options['drop']:
+            with source.schema_editor() as editor:
+                for model in reversed(messagingModels):
+                    if model._meta.db_table in sourceTables:
+                        editor.delete_model(model)
+            self.stdout.write('Dropped the old tables from %s.' % source.alias)
+
+    def copy(self, model, source, target, batchSize):
+        """
+        Copies one table in primary key order.
+
+        :return (tuple): The number of copied rows, of rows already present and of conflicting rows.
+        """
+        columns = [field.column for field in model._meta.local_concrete_fields]
+        pk = model._meta.pk.column
+        table = model._meta.db_table
+
+        def select(connection, where):
+            return 'SELECT %s FROM %s WHERE %s' % (
+                ', '.join(connection.ops.quote_name(column) for column in columns), connection.ops.quote_name(table), where,
+            )
+
+        insert = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            target.ops.quote_name(table), ', '.join(target.ops.quote_name(column) for column in columns), ', '.join(['%s'] * len(columns)),
+        )
+        nextBatch = select(source, '{0} > %s ORDER BY {0} LIMIT %s'.format(source.ops.quote_name(pk)))
+        pkIndex = columns.index(pk)
+
+        copied = skipped = conflicts = 0
+        last = 0
+        while True:
+            with source.cursor() as cursor:
+                cursor.execute(nextBatch, [last, batchSize])
+                rows = cursor.fetchall()
+            if not rows:
+                return copied, skipped, conflicts
+            last = rows[-1][pkIndex]
+
+            with transaction.atomic(using=target.alias):
+                with target.cursor() as cursor:
+                    ids = [row[pkIndex] for row in rows]
+                    cursor.execute(select(target, '%s IN (%s)' % (target.ops.quote_name(pk), ', '.join(['%s'] * len(ids)))), ids)
+                    existing = {row[pkIndex]: tuple(row) for row in cursor.fetchall()}
+
+                    missing = [row for row in rows if row[pkIndex] not in existing]
+                    if missing:
+                        cursor.executemany(insert, missing)
+
+            copied += len(missing)
+            for row in rows:
+                if row[pkIndex] in existing:
+                    if existing[row[pkIndex]] == tuple(row):
+                        skipped += 1
+                    else:
+                        conflicts += 1
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from app.models import OutboxCheckpoint, OutboxEvent
+from app.outbox import OutboxConsumer, prune
+
+class Command(BaseCommand):
+    """
+        Inspects and maintains the change outbox.
+
+        Without options it prints the newest event id and every consumer's position and lag. --replay rewinds a
+        consumer, --prune deletes the events all consumers have committed.
+
+        Usage: python manage.py outbox [--database default] [--replay CONSUMER [--from ID]] [--prune [--keep N]]
+    """
+    help = 'Show outbox consumer positions, rewind a consumer or prune consumed events.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--replay', metavar='CONSUMER')
+        parser.add_argument('--from', dest='fromId', type=int, default=0)
+        parser.add_argument('--prune', action='store_true')
+        parser.add_argument('--keep', type=int, default=0)
+
+    def handle(self, *args, **options):
+        using = options['database']
+
+        if options['replay']:
+            OutboxConsumer(options['replay'], using=using).replay(options['fromId'])
+            self.stdout.write('Rewound %s to event %d.' % (options['replay'], options['fromId']))
+
+        if options['prune']:
+            self.stdout.write('Pruned %d events.' % prune(using, options['keep']))
+
+        newest = OutboxEvent.objects.using(using).aggregate(newest=Max('pk'))['newest'] or 0
+        self.stdout.write('Newest event: %d' % newest)
+        for checkpoint in OutboxCheckpoint.objects.using(using).order_by('consumer'):
+            self.stdout.write('  %-30s at %d, %d behind' % (checkpoint.consumer, checkpoint.position, newest - checkpoint.position))
@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from app.models import ProfilingSwitch
+from app.profiling import currentSwitch, profileToken
+
+class Command(BaseCommand):
+    """
+        Shows and changes the runtime switch of the request profiling and prints X-Profile tokens.
+
+        --enable and --disable switch all profiling on or off, --sample-rate profiles that fraction of all requests,
+        for --minutes if given, and --token prints a token for the X-Profile header that is valid for --max-age
+        seconds. Running workers pick up changes within PROFILING_SWITCH_SECONDS. The current switch is printed last.
+
+        Usage: python manage.py profiling [--enable | --disable] [--sample-rate 0.01 [--minutes 30]] [--token [--max-age 3600]]
+    """
+    help = 'Switch request profiling at runtime and create X-Profile tokens.'
+
+    def add_arguments(self, parser):
+        switch = parser.add_mutually_exclusive_group()
+        switch.add_argument('--enable', action='store_true')
+        switch.add_argument('--disable', action='store_true')
+        parser.add_argument('--sample-rate', type=float)
+        parser.add_argument('--minutes', type=int, help='Stop sampling after this many minutes.')
+        parser.add_argument('--token', action='store_true')
+        parser.add_argument('--max-age', type=int, default=3600, help='Seconds the token stays valid.')
+
+    def handle(self, *args, **options):
+        if options['sample_rate'] is not None and not 0 <= options['sample_rate'] <= 1:
+            raise CommandError('--sample-rate must be between 0 and 1.')
+
+        if options['enable'] or options['disable'] or options['sample_rate'] is not None:
+            enabled, sampleRate = currentSwitch()
+            switch = ProfilingSwitch.objects.order_by('pk').first() or ProfilingSwitch(enabled=enabled, sampleRate=sampleRate)
+            if options['enable'] or options['disable']:
+                switch.enabled = options['enable']
+            if options['sample_rate'] is not None:
+                switch.sampleRate = options['sample_rate']
+                switch.sampleUntil = timezone.now() + timedelta(minutes=options['minutes']) if options['minutes'] else None
+            switch.save()
+
+        if options['token']:
+            self.stdout.write(profileToken(options['max_age']))
+
+        # With --token only the token goes to stdout, so it can be captured in a shell variable.
+        enabled, sampleRate = currentSwitch()
+        output = self.stderr if options['token'] else self.stdout
+        output.write('Profiling %s, sampling %g of requests.' % ('enabled' if enabled else 'disabled', sampleRate))
@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.models import Item, UserDeletion
+from app.purge import purgeItem, purgeUser
+
+class Command(BaseCommand):
+    """
+        Permanently removes soft-deleted items and queued user deletions in bounded batches.
+
+        Meant to run periodically (cron, systemd timer). Items are purged once they have been deleted for longer than
+        --grace-minutes; every batch of dependent rows is deleted in its own short transaction and --pause sleeps
+        between batches so requests are not starved of the database write lock.
+
+        Usage: python manage.py purgedeleted [--batch-size 500] [--pause 0.05] [--grace-minutes 10] [--limit 1000]
+    """
+    help = 'Purge soft-deleted items and deleted users in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0.05)
+        parser.add_argument('--grace-minutes', type=int, default=10)
+        parser.add_argument('--limit', type=int, default=1000, help='Maximum number of items to purge in one run.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['grace_minutes'])
+        items = (Item.allObjects.filter(deletedAt__lte=cutoff).order_by('deletedAt')
+                 .only('pk', 'image')[:options['limit']])
+
+        purgedItems = 0
+        rows = 0
+        # Materialised first: SQLite gives no isolation between a running cursor and deletes on the same connection.
+        for item in list(items):
+            rows += purgeItem(item, options['batch_size'], options['pause'])
+            purgedItems += 1
+
+        purgedUsers = 0
+        for deletion in list(UserDeletion.objects.select_related('user')[:options['limit']]):
+            deleted = purgeUser(deletion.user, options['batch_size'], options['pause'])
+            if deleted:
+                rows += deleted
+                purgedUsers += 1
+
+        self.stdout.write('Purged %d items and %d users (%d rows).' % (purgedItems, purgedUsers, rows))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from app.fingerprints import fingerprintItem, findDuplicates
+from app.models import Item
+
+class Command(BaseCommand):
+    """
+        Fingerprints existing items and reports near-duplicate listings.
+
+        Items are streamed in primary key order so the whole table is never loaded at once. Without --rebuild only
+        items that have no fingerprint yet are hashed; every scanned item is then looked up in the index and each
+        duplicate pair is printed once.
+
+        Usage: python manage.py rescanduplicates [--rebuild] [--batch-size 500]
+    """
+    help = 'Fingerprint items and report near-duplicate listings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute fingerprints that already exist.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        items = Item.objects.order_by('pk')
+        if not options['rebuild']:
+            items = items.filter(fingerprint__isnull=True)
+
+        scanned = 0
+        pairs = set()
+        for item in items.iterator(chunk_size=options['batch_size']):
+            hashValue, signature = fingerprintItem(item)
+            scanned += 1
+
+            for duplicate in findDuplicates(hashValue, signature, exclude=item.pk):
+                pair = (min(item.pk, duplicate), max(item.pk, duplicate))
+
+                if pair not in pairs:
+                    pairs.add(pair)
+                    self.stdout.write('Item %d duplicates item %d' % pair)
+
+        self.stdout.write('Scanned %d items, found %d duplicate pairs.' % (scanned, len(pairs)))
@@ -0,0 +1,81 @@
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+
+from app import geo
+from app.models import Category, Conversation, ConversationMember, ConversationMessage, Item
+
+class Command(BaseCommand):
+    """
+        Seeds the database with a large synthetic dataset for load and admin testing.
+
+        Rows are inserted with bulk_create in batches inside one transaction per batch, so seeding a million items
+        neither holds them all in memory nor commits row by row. Seeded users get unusable passwords.
+
+        Usage: python manage.py seeddata [--users 1000] [--items 100000] [--conversations 20000] [--messages 100000]
+    """
+    help = 'Seed users, categories, items, conversations and messages in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--items', type=int, default=100000)
+        parser.add_argument('--conversations', type=int, default=20000)
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        self.batchSize = options['batch_size']
+        words = ('red', 'blue', 'vintage', 'new', 'used', 'bike', 'lamp', 'chair', 'desk', 'phone', 'camera',
+                 'guitar', 'book', 'jacket', 'table', 'sofa', 'watch', 'bag', 'shoes', 'tent')
+
+        start = (User.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+        self.insert(User, (User(username='seed%d' % index, password='!') for index in range(start, start + options['users'])))
+        userIds = list(User.objects.filter(username__startswith='seed').values_list('pk', flat=True))
+
+        self.insert(Category, (Category(name='Seed Category %d' % index) for index in range(options['categories'])))
+        categoryIds = list(Category.objects.values_list('pk', flat=True))
+
+        def items():
+            for _ in range(options['items']):
+                latitude = rng.uniform(25.0, 49.0)
+                longitude = rng.uniform(-124.0, -67.0)
+                yield Item(
+                    category_id=rng.choice(categoryIds), owner_id=rng.choice(userIds),
+                    name=' '.join(rng.sample(words, 3)), description=' '.join(rng.choices(words, k=12)),
+                    price=round(rng.uniform(1, 500), 2), isSold=rng.random() < 0.2,
+                    latitude=latitude, longitude=longitude, geohash=geo.encode(latitude, longitude),
+                )
+        self.insert(Item, items())
+        itemIds = list(Item.objects.values_list('pk', flat=True))
+
+        firstConversation = (Conversation.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+        self.insert(Conversation, (Conversation(item_id=rng.choice(itemIds)) for _ in range(options['conversations'])))
+        conversationIds = list(Conversation.objects.filter(pk__gte=firstConversation).values_list('pk', flat=True))
+
+        self.insert(ConversationMember, (ConversationMember(conversation_id=pk, user_id=userId)
+                                         for pk in conversationIds for userId in rng.sample(userIds, 2)))
+
+        self.insert(ConversationMessage, (ConversationMessage(
+            conversation_id=rng.choice(conversationIds), host_id=rng.choice(userIds), content=' '.join(rng.choices(words, k=8)),
+        ) for _ in range(options['messages'] if conversationIds else 0)))
+
+    def insert(self, model, objects):
+        total = 0
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) == self.batchSize:
+                total += self.flush(model, batch)
+                batch = []
+        total += self.flush(model, batch)
+        self.stdout.write('Inserted %d %s' % (total, model._meta.verbose_name_plural))
+
+    def flush(self, model, batch):
+        with transaction.atomic(using=router.db_for_write(model)):
+            model.objects.bulk_create(batch)
+        return len(batch)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from app.digests import collect, deliver
+
+class Command(BaseCommand):
+    """
+        Collects new conversation messages and delivers the digests that are due.
+
+        Meant to run every minute or so (cron, systemd timer). Each recipient gets at most one digest per
+        NotificationPreference.windowMinutes and none during their quiet hours; messages held back are included in the
+        next digest. Emails go through the configured EMAIL_BACKEND, feed digests become Notification rows.
+
+        Usage: python manage.py senddigests [--batch-size 200]
+    """
+    help = 'Send batched digests of new conversation messages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Number of recipients handled per pass.')
+
+    def handle(self, *args, **options):
+        collected = collect()
+        counts = deliver(batchSize=options['batch_size'])
+        self.stdout.write('Collected %d messages; sent %d emails, posted %d feed digests, skipped %d users who turned digests off.' % (
+            collected, counts['email'], counts['feed'], counts['off'],
+        ))
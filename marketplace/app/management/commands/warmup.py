@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from app.warmup import report, warmUp
+
+class Command(BaseCommand):
+    """
+        Runs the worker warm-up and reports how long each step takes.
+
+        The warmed state only lives in this process, so the command is for measuring and for checking that every
+        template still compiles; servers warm their workers up with MARKETPLACE_WARMUP=1, see app/warmup.py.
+
+        Usage: python manage.py warmup [--prefork]
+    """
+    help = 'Warm up templates, URL resolvers, forms, connections and catalog data, and report the timings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefork', action='store_true', help='Also close connections and freeze the garbage collector.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(report(warmUp(prefork=options['prefork'])))
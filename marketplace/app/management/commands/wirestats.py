@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from app.models import Item
+
+class Command(BaseCommand):
+    """
+        Measures the bytes sent over the wire for the public pages.
+
+        Every page is requested once with the minify and compression middleware removed, once with minification only
+        and once per supported content encoding, and the sizes are printed side by side. A final request replays the
+        ETag of the first response to check that the page is answered with 304 Not Modified. HTML is never sent with
+        brotli, see app/middleware.py, so '-' in the br column is expected for the pages.
+
+        Usage: python manage.py wirestats
+    """
+    help = 'Print response sizes with and without minification and compression.'
+
+    def handle(self, *args, **options):
+        pages = [reverse('item:index'), reverse('item:search'), reverse('item:about'),
+                 reverse('item:privacy'), reverse('item:terms'), reverse('item:contact')]
+
+        item = Item.objects.filter(isSold=False).first()
+        if item is not None:
+            pages.append(reverse('item:detail', args=[item.id]))
+
+        plain = [name for name in settings.MIDDLEWARE if not name.startswith('app.middleware.')]
+        minifyOnly = [name for name in settings.MIDDLEWARE if name != 'app.middleware.CompressionMiddleware']
+
+        self.stdout.write('%-20s %10s %10s %10s %10s %6s' % ('page', 'plain', 'minified', 'gzip', 'br', '304'))
+
+        for page in pages:
+            with override_settings(MIDDLEWARE=plain):
+                raw = self.fetch(page, 'identity')
+            with override_settings(MIDDLEWARE=minifyOnly):
+                minified = self.fetch(page, 'identity')
+
+            gzipped = self.fetch(page, 'gzip')
+            brotli = self.fetch(page, 'br')
+            revalidated = self.fetch(page, 'gzip', HTTP_IF_NONE_MATCH=gzipped.get('ETag', ''))
+
+            self.stdout.write('%-20s %10d %10d %10s %10s %6s' % (
+                page, len(raw.content), len(minified.content),
+                self.size(gzipped, 'gzip'), self.size(brotli, 'br'), revalidated.status_code == 304,
+            ))
+
+    def fetch(self, path, encoding, **headers):
+        host = next((host for host in settings.ALLOWED_HOSTS if '*' not in host), 'localhost').lstrip('.')
+        return Client().get(path, HTTP_HOST=host, HTTP_ACCEPT_ENCODING=encoding, **headers)
+
+    def size(self, response, encoding):
+        if response.get('Content-Encoding') != encoding:
+            return '-'
+        return str(len(response.content))
@@ -0,0 +1,111 @@
+"""
+Response middleware for the marketplace.
+
+HtmlMinifyMiddleware strips the indentation out of rendered templates and CompressionMiddleware compresses the
+result with brotli when the client and server support it, falling back to Django's gzip handling otherwise. HTML
+always goes through the gzip handling: pages echo user input next to CSRF tokens, and only GZipMiddleware pads its
+output with random bytes against BREACH.
+"""
+
+import logging
+import re
+
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Blocks whose whitespace is significant and must be left untouched.
+preservedBlocks = re.compile(r'(<(pre|textarea|script|style)\b.*?</\2\s*>)', re.IGNORECASE | re.DOTALL)
+indentation = re.compile(r'[ \t]*\n\s*')
+acceptsBrotli = re.compile(r'\bbr\b')
+
+def minifyHtml(html):
+    """
+    Collapses every run of whitespace that contains a line break into a single line break.
+
+    The browser collapses those runs anyway, so the page renders the same while the indentation of the templates
+    is no longer sent over the wire. Content of <pre>, <textarea>, <script> and <style> blocks is kept as-is.
+
+    :param html (str): The rendered page.
+
+    :return (str): The minified page.
+    """
+    parts = preservedBlocks.split(html)
+    minified = []
+
+    # split() returns [text, block, tag name, text, block, tag name, ..., text].
+    for index in range(0, len(parts), 3):
+        minified.append(indentation.sub('\n', parts[index]))
+
+        if index + 1 < len(parts):
+            minified.append(parts[index + 1])
+
+    return ''.join(minified).strip()
+
+class HtmlMinifyMiddleware:
+    """
+        Minifies rendered HTML responses before they are compressed.
+
+        Must be listed after CompressionMiddleware and ConditionalGetMiddleware in MIDDLEWARE so it sees the
+        response first.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if (response.streaming or response.has_header('Content-Encoding')
+                or not response.get('Content-Type', '').startswith('text/html')):
+            return response
+
+        original = len(response.content)
+        response.content = minifyHtml(response.content.decode(response.charset)).encode(response.charset)
+        response.headers['Content-Length'] = str(len(response.content))
+
+        logger.debug('Minified %s from %d to %d bytes', request.path, original, len(response.content))
+        return response
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+        Compresses responses with brotli when the brotli package is installed and the client sends "br" in
+        Accept-Encoding, otherwise behaves exactly like GZipMiddleware. HTML responses are left to GZipMiddleware,
+        whose random padding the brotli output lacks.
+    """
+    def process_response(self, request, response):
+        if brotli is None or response.streaming or response.has_header('Content-Encoding'):
+            return super().process_response(request, response)
+
+        if response.get('Content-Type', '').startswith('text/html'):
+            return super().process_response(request, response)
+
+        if not acceptsBrotli.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            return super().process_response(request, response)
+
+        # It's not worth attempting to compress really short responses.
+        if len(response.content) < 200:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        compressed = brotli.compress(response.content)
+        if len(compressed) >= len(response.content):
+            return response
+
+        logger.debug('Compressed %s from %d to %d bytes', request.path, len(response.content), len(compressed))
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+
+        # A strong ETag only describes the identity encoding, so it has to become weak once compressed.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+
+        return response
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_item_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('imageHash', models.CharField(blank=True, max_length=16)),
+                ('textSignature', models.CharField(blank=True, max_length=256)),
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint', to='app.item')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FingerprintBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=24)),
+                ('fingerprint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='app.itemfingerprint')),
+            ],
+        ),
+    ]
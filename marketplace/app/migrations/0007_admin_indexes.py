@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_saved_searches'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversation',
+            name='modifiedAt',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='conversationmessage',
+            name='createdAt',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='createdAt',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='name',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+    ]
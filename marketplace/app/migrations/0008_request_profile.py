@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('method', models.CharField(max_length=10)),
+                ('statusCode', models.IntegerField()),
+                ('duration', models.FloatField()),
+                ('queryCount', models.IntegerField()),
+                ('queryTime', models.FloatField()),
+                ('profileFile', models.CharField(max_length=500)),
+                ('summary', models.TextField()),
+                ('createdAt', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ('-createdAt',),
+            },
+        ),
+    ]
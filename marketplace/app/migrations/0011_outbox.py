@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:25
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consumer', models.CharField(max_length=100, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updatedAt', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=50)),
+                ('objectId', models.BigIntegerField(blank=True, null=True)),
+                ('action', models.CharField(max_length=10)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('createdAt', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
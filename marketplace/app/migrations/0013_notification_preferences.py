@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 03:32
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0012_messaging_database'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationPreference',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(choices=[('email', 'Email'), ('feed', 'Notifications page'), ('off', 'Off')], default='email', max_length=8)),
+                ('windowMinutes', models.PositiveIntegerField(default=15, validators=[django.core.validators.MaxValueValidator(1440)])),
+                ('quietStart', models.TimeField(blank=True, null=True)),
+                ('quietEnd', models.TimeField(blank=True, null=True)),
+                ('timeZone', models.CharField(default='UTC', max_length=64)),
+                ('lastMessageId', models.BigIntegerField(default=0, editable=False)),
+                ('pendingMessageId', models.BigIntegerField(db_index=True, default=0, editable=False)),
+                ('lastDigestAt', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='notificationPreference', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:20
+
+from django.db import migrations, models
+
+
+def addCategoryKeys(apps, schema_editor):
+    SavedSearchToken = apps.get_model('app', 'SavedSearchToken')
+    tokens = SavedSearchToken.objects.filter(savedSearch__category__isnull=False).select_related('savedSearch')
+    changed = []
+    for token in tokens.iterator(chunk_size=1000):
+        token.token = '%s:%d' % (token.token, token.savedSearch.category_id)
+        changed.append(token)
+    SavedSearchToken.objects.bulk_update(changed, ['token'], batch_size=500)
+
+
+def removeCategoryKeys(apps, schema_editor):
+    SavedSearchToken = apps.get_model('app', 'SavedSearchToken')
+    changed = []
+    for token in SavedSearchToken.objects.filter(savedSearch__category__isnull=False).iterator(chunk_size=1000):
+        token.token = token.token.rsplit(':', 1)[0]
+        changed.append(token)
+    SavedSearchToken.objects.bulk_update(changed, ['token'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_category_modifiedat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='savedsearchtoken',
+            name='token',
+            field=models.CharField(db_index=True, max_length=124),
+        ),
+        migrations.RunPython(addCategoryKeys, removeCategoryKeys),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-19 04:09
+
+from django.db import migrations, models
+
+
+def addVersions(apps, schema_editor):
+    # Created up front so concurrent first writes only ever update the rows.
+    DataVersion = apps.get_model('app', 'DataVersion')
+    DataVersion.objects.using(schema_editor.connection.alias).bulk_create([
+        DataVersion(model=model) for model in ('Item', 'Category', 'Conversation', 'ConversationMessage')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_upload_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=50, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(addVersions, migrations.RunPython.noop, hints={'model_name': 'dataversion'}),
+    ]
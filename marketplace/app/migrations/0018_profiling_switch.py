@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-19 04:15
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_data_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfilingSwitch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enabled', models.BooleanField(default=True)),
+                ('sampleRate', models.FloatField(default=0.0, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)])),
+                ('sampleUntil', models.DateTimeField(blank=True, null=True)),
+                ('updatedAt', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -1,12 +1,19 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
+from django.core.validators import MaxValueValidator, MinValueValidator
+from . import geo
+from .outbox import OutboxManager, OutboxModel
 # Create your models here.
-class Category(models.Model):
+class Category(OutboxModel):
     """
         Model representing a category for items.
 
         Attributes:
             name (CharField): The name of the category.
+            modifiedAt (DateTimeField): The timestamp when the category was last modified.
 
         Meta Options:
             ordering (tuple): Orders categories by name.
@@ -16,6 +23,9 @@ class Category(models.Model):
             __str__(): Returns a string representation of the category.
         """
     name = models.CharField(max_length=200)
+    modifiedAt = models.DateTimeField(auto_now=True)
+
+    objects = OutboxManager()
 
     # Change name to Categories and name item in db as name.
     class Meta:
@@ -25,7 +35,14 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
-class Item(models.Model):
+class LiveItemManager(OutboxManager):
+    """
+        Default manager of Item that hides soft-deleted items. Item.allObjects still sees them.
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(deletedAt__isnull=True)
+
+class Item(OutboxModel):
     """
         Model representing an item in the online marketplace.
 
@@ -38,6 +55,16 @@ class Item(models.Model):
             owner (ForeignKey): The user who owns the item.
             isSold (BooleanField): Indicates whether the item is sold or not.
             createdAt (DateTimeField): The timestamp when the item was created.
+            modifiedAt (DateTimeField): The timestamp when the item was last modified.
+            latitude (FloatField): Latitude of the pickup location (optional).
+            longitude (FloatField): Longitude of the pickup location (optional).
+            postalCode (CharField): Postal area of the pickup location (optional).
+            geohash (CharField): Indexed geohash of the coordinates, used by radius searches.
+            deletedAt (DateTimeField): When the item was soft-deleted; it is purged in the background later (see purge.py).
+
+        Managers:
+            objects (LiveItemManager): Items that are not soft-deleted.
+            allObjects (Manager): All items, including soft-deleted ones.
 
         Meta Options:
             ordering (tuple): Orders items by name.
@@ -45,15 +72,25 @@ class Item(models.Model):
 
         Methods:
             __str__(): Returns a string representation of the item.
+            save(): Normalises the postal area and keeps the geohash in sync with the coordinates before saving.
         """
     category = models.ForeignKey(Category, related_name='items', on_delete=models.CASCADE)
-    name = models.CharField(max_length=200)
+    name = models.CharField(max_length=200, db_index=True)
     description = models.TextField(blank=True, null=True, max_length=500)
     price = models.FloatField()
     image = models.ImageField(upload_to='itemImages', blank=True, null=True)
     owner = models.ForeignKey(User, related_name='items', on_delete=models.CASCADE)
     isSold = models.BooleanField(default=False)
-    createdAt = models.DateTimeField(auto_now_add=True)
+    createdAt = models.DateTimeField(auto_now_add=True, db_index=True)
+    modifiedAt = models.DateTimeField(auto_now=True)
+    latitude = models.FloatField(blank=True, null=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(blank=True, null=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    postalCode = models.CharField(max_length=12, blank=True, db_index=True)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True, editable=False)
+    deletedAt = models.DateTimeField(blank=True, null=True, db_index=True, editable=False)
+
+    objects = LiveItemManager()
+    allObjects = OutboxManager()
 
     class Meta:
         ordering = ('name', )
@@ -62,7 +99,16 @@ class Item(models.Model):
     def __str__(self):
         return self.name
 
-class Conversation(models.Model):
+    def save(self, *args, **kwargs):
+        self.postalCode = self.postalCode.strip().upper()
+
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geo.encode(self.latitude, self.longitude)
+        else:
+            self.geohash = ''
+        super().save(*args, **kwargs)
+
+class Conversation(OutboxModel):
     """
         Model representing a conversation related to an item.
 
@@ -75,16 +121,37 @@ class Conversation(models.Model):
         Meta Options:
             ordering (tuple): Orders conversations by the most recent modification.
 
+        Conversations are stored on the messaging database (see app/routers.py), so item and members refer to rows on
+        another database: they have no database constraint and are not cascaded into, app.purge removes conversations
+        before their item or users.
+
     """
-    item = models.ForeignKey(Item, related_name='conversations', on_delete=models.CASCADE)
-    members = models.ManyToManyField(User, related_name='conversations')
+    item = models.ForeignKey(Item, related_name='conversations', on_delete=models.DO_NOTHING, db_constraint=False)
+    members = models.ManyToManyField(User, related_name='conversations', through='ConversationMember')
     createdAt = models.DateTimeField(auto_now_add=True)
-    modifiedAt = models.DateTimeField(auto_now=True)
+    modifiedAt = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = OutboxManager()
 
     class Meta:
         ordering = ('-modifiedAt',)
 
-class ConversationMessage(models.Model):
+class ConversationMember(models.Model):
+    """
+        Model linking a conversation to one of its members, stored with the conversation on the messaging database.
+
+        Attributes:
+            conversation (ForeignKey): The conversation.
+            user (ForeignKey): The member, a user on the default database.
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+
+    class Meta:
+        db_table = 'app_conversation_members'
+        unique_together = ('conversation', 'user')
+
+class ConversationMessage(OutboxModel):
     """
         Model representing a message within a conversation.
 
@@ -92,10 +159,277 @@ class ConversationMessage(models.Model):
             conversation (ForeignKey): The conversation to which the message belongs.
             content (TextField): The content of the message.
             createdAt (DateTimeField): The timestamp when the message was created.
-            host (ForeignKey): The user who sent the message.
+            host (ForeignKey): The user who sent the message, a user on the default database.
     """
     conversation = models.ForeignKey(Conversation, related_name='messages', on_delete=models.CASCADE)
     content = models.TextField()
+    createdAt = models.DateTimeField(auto_now_add=True, db_index=True)
+    host = models.ForeignKey(User, related_name='host', on_delete=models.DO_NOTHING, db_constraint=False)
+
+    objects = OutboxManager()
+
+class ItemFingerprint(models.Model):
+    """
+        Model holding the near-duplicate fingerprint of an item (see fingerprints.py).
+
+        Attributes:
+            item (OneToOneField): The fingerprinted item.
+            imageHash (CharField): The 64-bit difference hash of the item's image as hex (blank without an image).
+            textSignature (CharField): The MinHash signature of the item's description as hex (blank if too short).
+    """
+    item = models.OneToOneField(Item, related_name='fingerprint', on_delete=models.CASCADE)
+    imageHash = models.CharField(max_length=16, blank=True)
+    textSignature = models.CharField(max_length=256, blank=True)
+
+class FingerprintBucket(models.Model):
+    """
+        Model indexing a fingerprint by one of its image hash chunks or description bands.
+
+        Attributes:
+            fingerprint (ForeignKey): The fingerprint the key belongs to.
+            key (CharField): The indexed chunk or band key, e.g. 'i2:0f3a' or 'd5:9c1e07b2a4d3f610'.
+    """
+    fingerprint = models.ForeignKey(ItemFingerprint, related_name='buckets', on_delete=models.CASCADE)
+    key = models.CharField(max_length=24, db_index=True)
+
+class SavedSearch(models.Model):
+    """
+        Model representing a search a user wants to be notified about.
+
+        Attributes:
+            owner (ForeignKey): The user who saved the search.
+            query (CharField): The search text (optional).
+            category (ForeignKey): The category the search is restricted to (optional).
+            createdAt (DateTimeField): The timestamp when the search was saved.
+
+        Methods:
+            __str__(): Returns a string representation of the saved search.
+    """
+    owner = models.ForeignKey(User, related_name='savedSearches', on_delete=models.CASCADE)
+    query = models.CharField(max_length=200, blank=True)
+    category = models.ForeignKey(Category, related_name='savedSearches', blank=True, null=True, on_delete=models.CASCADE)
+    createdAt = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('-createdAt',)
+        verbose_name_plural = 'Saved Searches'
+
+    def __str__(self):
+        return self.query or str(self.category or 'All items')
+
+class SavedSearchToken(models.Model):
+    """
+        Model indexing a saved search by the words of its query (see percolator.py).
+
+        Attributes:
+            savedSearch (ForeignKey): The indexed saved search.
+            token (CharField): One word of the query, or '*' for searches without a query, followed by ':' and the
+                category id for searches restricted to a category, e.g. 'bike', 'bike:3' or '*:3'.
+    """
+    savedSearch = models.ForeignKey(SavedSearch, related_name='tokens', on_delete=models.CASCADE)
+    token = models.CharField(max_length=124, db_index=True)
+
+class Notification(models.Model):
+    """
+        Model representing an in-app notification.
+
+        Attributes:
+            user (ForeignKey): The user being notified.
+            item (ForeignKey): The item the notification is about (optional).
+            savedSearch (ForeignKey): The saved search that matched the item (optional).
+            text (CharField): The notification text.
+            isRead (BooleanField): Indicates whether the user has seen the notification.
+            createdAt (DateTimeField): The timestamp when the notification was created.
+
+        Meta Options:
+            ordering (tuple): Orders notifications newest first.
+    """
+    user = models.ForeignKey(User, related_name='notifications', on_delete=models.CASCADE)
+    item = models.ForeignKey(Item, related_name='notifications', blank=True, null=True, on_delete=models.CASCADE)
+    savedSearch = models.ForeignKey(SavedSearch, related_name='notifications', blank=True, null=True, on_delete=models.SET_NULL)
+    text = models.CharField(max_length=255)
+    isRead = models.BooleanField(default=False)
     createdAt = models.DateTimeField(auto_now_add=True)
-    host = models.ForeignKey(User, related_name='host', on_delete=models.CASCADE)
 
+    class Meta:
+        ordering = ('-createdAt',)
+
+class NotificationPreference(models.Model):
+    """
+        Model representing how and when a user is told about new conversation messages.
+
+        Attributes:
+            user (OneToOneField): The user the preference belongs to.
+            channel (CharField): Where digests are delivered: by email, to the in-app feed or not at all.
+            windowMinutes (PositiveIntegerField): Minimum number of minutes between two digests; messages arriving in
+                between are coalesced into the next one.
+            quietStart (TimeField): Local time at which quiet hours start (optional).
+            quietEnd (TimeField): Local time at which quiet hours end (optional). Quiet hours may wrap past midnight.
+            timeZone (CharField): The IANA time zone quiet hours are given in.
+            lastMessageId (BigIntegerField): The newest message already included in a digest.
+            pendingMessageId (BigIntegerField): The newest message waiting for a digest.
+            lastDigestAt (DateTimeField): The timestamp of the last digest (optional).
+    """
+    EMAIL = 'email'
+    FEED = 'feed'
+    OFF = 'off'
+    channels = (
+        (EMAIL, 'Email'),
+        (FEED, 'Notifications page'),
+        (OFF, 'Off'),
+    )
+
+    user = models.OneToOneField(User, related_name='notificationPreference', on_delete=models.CASCADE)
+    channel = models.CharField(max_length=8, choices=channels, default=EMAIL)
+    windowMinutes = models.PositiveIntegerField(default=15, validators=[MaxValueValidator(24 * 60)])
+    quietStart = models.TimeField(blank=True, null=True)
+    quietEnd = models.TimeField(blank=True, null=True)
+    timeZone = models.CharField(max_length=64, default='UTC')
+    lastMessageId = models.BigIntegerField(default=0, editable=False)
+    pendingMessageId = models.BigIntegerField(default=0, db_index=True, editable=False)
+    lastDigestAt = models.DateTimeField(blank=True, null=True, editable=False)
+
+class RequestProfile(models.Model):
+    """
+        Model holding the summary of a profiled request (see profiling.py).
+
+        Attributes:
+            path (CharField): The path of the profiled request.
+            method (CharField): The HTTP method of the request.
+            statusCode (IntegerField): The status code of the response.
+            duration (FloatField): The time spent in the view and inner middleware, in seconds.
+            queryCount (IntegerField): The number of SQL queries executed.
+            queryTime (FloatField): The time spent in SQL queries, in seconds.
+            profileFile (CharField): The collapsed-stack (.folded) file written for the request. In cProfile mode the
+                raw stats are written next to it with the .prof extension.
+            summary (TextField): The slowest queries, the template renders and, for cProfile, the top functions.
+            createdAt (DateTimeField): The timestamp when the request was profiled.
+
+        Meta Options:
+            ordering (tuple): Orders profiles newest first.
+    """
+    path = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    statusCode = models.IntegerField()
+    duration = models.FloatField()
+    queryCount = models.IntegerField()
+    queryTime = models.FloatField()
+    profileFile = models.CharField(max_length=500)
+    summary = models.TextField()
+    createdAt = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('-createdAt',)
+
+class ProfilingSwitch(models.Model):
+    """
+        Model holding the runtime switch of the request profiling (see profiling.py). Only the first row is used;
+        without one the PROFILING_ENABLED and PROFILING_SAMPLE_RATE settings apply.
+
+        Attributes:
+            enabled (BooleanField): Whether requests are profiled at all, including staff and token requests.
+            sampleRate (FloatField): The fraction of all requests that is profiled, between 0 and 1.
+            sampleUntil (DateTimeField): When sampling stops by itself, or empty to sample until switched off.
+            updatedAt (DateTimeField): The timestamp of the last change.
+    """
+    enabled = models.BooleanField(default=True)
+    sampleRate = models.FloatField(default=0.0, validators=[MinValueValidator(0), MaxValueValidator(1)])
+    sampleUntil = models.DateTimeField(blank=True, null=True)
+    updatedAt = models.DateTimeField(auto_now=True)
+
+class Upload(models.Model):
+    """
+        Model representing a chunked, resumable image upload (see uploads.py).
+
+        Attributes:
+            id (UUIDField): The unguessable id the client uses to send chunks and to attach the upload to an item.
+            owner (ForeignKey): The user uploading the file.
+            filename (CharField): The original file name.
+            size (BigIntegerField): The declared total size in bytes.
+            received (BigIntegerField): The number of bytes received so far, i.e. the offset to resume from.
+            contentType (CharField): The image type detected from the first bytes.
+            file (CharField): The storage name of the finished file, blank until the upload is complete.
+            isComplete (BooleanField): Indicates whether all bytes were received and the file was stored.
+            createdAt (DateTimeField): The timestamp when the upload was started.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, related_name='uploads', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    contentType = models.CharField(max_length=50, blank=True)
+    file = models.CharField(max_length=500, blank=True)
+    isComplete = models.BooleanField(default=False)
+    createdAt = models.DateTimeField(auto_now_add=True, db_index=True)
+
+class UploadUsage(models.Model):
+    """
+        Model counting the bytes a user has started uploading on one day, for the daily upload quota (see uploads.py).
+
+        Attributes:
+            owner (ForeignKey): The uploading user.
+            day (DateField): The day the uploads were started on, in UTC.
+            bytes (BigIntegerField): The declared sizes of the uploads started that day, added up.
+
+        Meta Options:
+            unique_together (tuple): One row per user and day.
+    """
+    owner = models.ForeignKey(User, related_name='uploadUsage', on_delete=models.CASCADE)
+    day = models.DateField()
+    bytes = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('owner', 'day')
+
+class UserDeletion(models.Model):
+    """
+        Model marking a user whose account is deleted in the background (see purge.py).
+
+        Attributes:
+            user (OneToOneField): The deactivated user waiting to be purged.
+            requestedAt (DateTimeField): The timestamp when the deletion was requested.
+    """
+    user = models.OneToOneField(User, related_name='deletion', on_delete=models.CASCADE)
+    requestedAt = models.DateTimeField(auto_now_add=True)
+
+class OutboxEvent(models.Model):
+    """
+        Model representing a change to a tracked model, written in the same transaction as the change (see outbox.py).
+
+        Attributes:
+            model (CharField): The name of the changed model, e.g. 'Item'.
+            objectId (BigIntegerField): The primary key of the changed row.
+            action (CharField): 'create', 'update' or 'delete'.
+            payload (JSONField): The names of the changed fields under 'fields', when known.
+            createdAt (DateTimeField): The timestamp of the change.
+    """
+    model = models.CharField(max_length=50)
+    objectId = models.BigIntegerField(blank=True, null=True)
+    action = models.CharField(max_length=10)
+    payload = models.JSONField(default=dict, blank=True)
+    createdAt = models.DateTimeField(auto_now_add=True)
+
+class OutboxCheckpoint(models.Model):
+    """
+        Model holding how far a named outbox consumer has read.
+
+        Attributes:
+            consumer (CharField): The unique name of the consumer.
+            position (BigIntegerField): The id of the last event the consumer committed.
+            updatedAt (DateTimeField): The timestamp of the last commit.
+    """
+    consumer = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    updatedAt = models.DateTimeField(default=timezone.now)
+
+class DataVersion(models.Model):
+    """
+        Model counting the committed writes to a tracked model. Bumped in the writing transaction (see outbox.py), so
+        it serves as a version stamp that is read with a single lookup.
+
+        Attributes:
+            model (CharField): The unique name of the tracked model, e.g. 'Item'.
+            version (BigIntegerField): The number of recorded writes to the model's rows.
+    """
+    model = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
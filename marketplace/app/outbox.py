@@ -0,0 +1,225 @@
+"""
+Transactional outbox for changes to Item, Category, Conversation and ConversationMessage.
+
+Every change to those models writes an OutboxEvent row in the same transaction and on the same database as the
+change itself, so an event exists if and only if the change was committed. Changes are captured from
+
+- Model.save() through OutboxModel,
+- QuerySet.update(), bulk_create() and bulk_update() through OutboxQuerySet, which covers admin actions and
+  soft deletes,
+- deletes, including cascades, through the post_delete signal (sent inside the deleting transaction),
+- Conversation.members changes through the m2m_changed signal.
+
+Events only carry the model, the primary key, the action and the names of the changed fields: consumers re-read
+the current row when they need its data. Each recorded write also bumps the model's DataVersion counter in the same
+transaction, which the ETags in etags.py use as a version stamp that costs one lookup to read. The counter's row is
+locked until the writing transaction commits, so writes to one model commit in the order of their versions. OutboxConsumer reads events in id order from a named checkpoint, in
+batches, and can be rewound to replay history.
+
+Ids are assigned when an event is inserted, not when its transaction commits, so with concurrent writers a
+lower id can become visible after a higher one. A consumer that moved past it would never see that event. poll()
+therefore stops in front of a gap in the ids until the event after the gap is OUTBOX_GAP_SECONDS old; ids that are
+never filled, e.g. by rolled back transactions, only delay the consumer by that long once.
+"""
+
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models, router, transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete
+from django.utils import timezone
+
+trackedModels = ('Item', 'Category', 'Conversation', 'ConversationMessage')
+
+def record(model, pks, action, using, fields=None):
+    """
+    Writes one outbox event per primary key and bumps the model's DataVersion. Must be called inside the transaction
+    that made the change.
+
+    :param model (Model): The class of the changed rows.
+    :param pks (iterable): Primary keys of the changed rows.
+    :param action (str): 'create', 'update' or 'delete'.
+    :param using (str): The database alias of the change; the events are written to the same database.
+    :param fields (list): Names of the changed fields, or None for all of them.
+    """
+    OutboxEvent = apps.get_model('app', 'OutboxEvent')
+    DataVersion = apps.get_model('app', 'DataVersion')
+    payload = {'fields': sorted(fields)} if fields is not None else {}
+    events = OutboxEvent.objects.using(using).bulk_create(
+        [OutboxEvent(model=model.__name__, objectId=pk, action=action, payload=payload) for pk in pks],
+        batch_size=500,
+    )
+    if not events:
+        return
+
+    versions = DataVersion.objects.using(using)
+    if not versions.filter(model=model.__name__).update(version=F('version') + 1):
+        versions.create(model=model.__name__, version=1)
+
+class OutboxQuerySet(models.QuerySet):
+    """
+        QuerySet whose bulk write methods record outbox events for the rows they change.
+    """
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            pks = list(self.values_list('pk', flat=True))
+            # Restricted to the rows read above, so a row committed by another transaction in between is not
+            # changed without an event.
+            rows = 0
+            for start in range(0, len(pks), 500):
+                rows += super(OutboxQuerySet, self.filter(pk__in=pks[start:start + 500])).update(**kwargs)
+            record(self.model, pks, 'update', self.db, kwargs)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            record(self.model, [obj.pk for obj in objs], 'create', self.db)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            rows = super().bulk_update(objs, fields, *args, **kwargs)
+            record(self.model, [obj.pk for obj in objs], 'update', self.db, fields)
+        return rows
+
+OutboxManager = models.Manager.from_queryset(OutboxQuerySet)
+
+class OutboxModel(models.Model):
+    """
+        Abstract base for tracked models: save() records a 'create' or 'update' event in the saving transaction.
+    """
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        creating = self._state.adding
+
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+            record(type(self), [self.pk], 'create' if creating else 'update', using, kwargs.get('update_fields'))
+
+def recordDelete(sender, instance, using, **kwargs):
+    record(sender, [instance.pk], 'delete', using)
+
+def recordMembers(sender, instance, action, model, pk_set, using, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    Conversation = apps.get_model('app', 'Conversation')
+    if not reverse:
+        record(Conversation, [instance.pk], 'update', using, ['members'])
+    elif pk_set:
+        # Changed from the user side: every affected conversation changed.
+        record(Conversation, pk_set, 'update', using, ['members'])
+
+def connectSignals():
+    """
+    Connects the delete and membership receivers to the tracked models only, so deletes of other models keep
+    Django's fast path that skips loading the rows. Called from AppConfig.ready().
+    """
+    for name in trackedModels:
+        post_delete.connect(recordDelete, sender=apps.get_model('app', name), dispatch_uid='outbox-delete-' + name)
+
+    m2m_changed.connect(recordMembers, sender=apps.get_model('app', 'Conversation').members.through, dispatch_uid='outbox-members')
+
+class OutboxConsumer:
+    """
+        Reads outbox events in order for one named consumer, remembering its position in OutboxCheckpoint.
+
+        Typical use by a worker that maintains derived data:
+
+            consumer = OutboxConsumer('search-index')
+            for batch in consumer.batches():
+                updateIndex(batch)
+                consumer.commit(batch[-1])
+
+        Events are handed out at least once: a worker that crashes before commit() sees the batch again, so
+        handlers must be idempotent.
+    """
+    def __init__(self, name, using='default', batchSize=500, gapSeconds=None):
+        self.name = name
+        self.using = using
+        self.batchSize = batchSize
+        self.gapSeconds = settings.OUTBOX_GAP_SECONDS if gapSeconds is None else gapSeconds
+
+    @property
+    def checkpoints(self):
+        return apps.get_model('app', 'OutboxCheckpoint').objects.using(self.using)
+
+    def position(self):
+        """
+        :return (int): The id of the last committed event, 0 if the consumer has not committed anything.
+        """
+        return self.checkpoints.filter(consumer=self.name).values_list('position', flat=True).first() or 0
+
+    def poll(self, after=None):
+        """
+        :param after (int): Read after this event id instead of the committed position.
+
+        :return (list): Up to batchSize events following the position, oldest first, ending in front of the first
+            gap in the ids that is younger than OUTBOX_GAP_SECONDS.
+        """
+        OutboxEvent = apps.get_model('app', 'OutboxEvent')
+        after = self.position() if after is None else after
+        events = list(OutboxEvent.objects.using(self.using).filter(pk__gt=after).order_by('pk')[:self.batchSize])
+
+        settled = timezone.now() - timedelta(seconds=self.gapSeconds)
+        previous = after
+        for index, event in enumerate(events):
+            # A missing id may belong to a transaction that has not committed yet.
+            if event.pk != previous + 1 and event.createdAt > settled:
+                return events[:index]
+            previous = event.pk
+        return events
+
+    def batches(self):
+        """
+        Yields batches until the consumer has caught up. Batches continue after the last event handed out, so a
+        caller that does not commit still moves forward within one call, and starts over from the checkpoint on
+        the next one.
+        """
+        after = self.position()
+        while True:
+            batch = self.poll(after)
+            if not batch:
+                return
+            yield batch
+            after = batch[-1].pk
+
+    def commit(self, event):
+        """
+        Stores the consumer's position.
+
+        :param event (OutboxEvent or int): The last event that was processed, or its id.
+        """
+        position = getattr(event, 'pk', event)
+        self.checkpoints.update_or_create(consumer=self.name, defaults={'position': position, 'updatedAt': timezone.now()})
+
+    def replay(self, fromId=0):
+        """
+        Rewinds the consumer so the next poll starts after event fromId, e.g. 0 to rebuild derived data from scratch.
+        """
+        self.commit(fromId)
+
+def prune(using='default', keep=0):
+    """
+    Deletes events that every registered consumer has already committed.
+
+    :param using (str): The database whose outbox is pruned.
+    :param keep (int): Number of already consumed events to keep for replays.
+
+    :return (int): The number of deleted events.
+    """
+    OutboxCheckpoint = apps.get_model('app', 'OutboxCheckpoint')
+    OutboxEvent = apps.get_model('app', 'OutboxEvent')
+
+    positions = list(OutboxCheckpoint.objects.using(using).values_list('position', flat=True))
+    if not positions:
+        return 0
+
+    return OutboxEvent.objects.using(using).filter(pk__lte=min(positions) - keep).delete()[0]
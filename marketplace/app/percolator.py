@@ -0,0 +1,107 @@
+"""
+Matching of new items against saved searches.
+
+Instead of running every saved search against every new item, saved searches are indexed by the words of their
+query in SavedSearchToken (searches without a query are indexed under '*'). Searches restricted to a category are
+indexed under their words suffixed with the category id, e.g. 'bike:3' or '*:3', so an item only ever looks up the
+keys of its own category. A batch of new items is matched by looking up the keys of the items in that reverse index,
+which returns only the saved searches sharing at least one word and their category with some item, and then checking
+those candidates in memory. A saved search matches an item when every
+word of its query appears in the item's name or description and its category, if any, is the item's category.
+"""
+
+import re
+from collections import defaultdict
+
+from .models import Notification, SavedSearch, SavedSearchToken
+
+matchAll = '*'
+_words = re.compile(r'\w+')
+
+def tokenize(text):
+    return {word[:100] for word in _words.findall((text or '').lower())}
+
+def indexKeys(tokens, categoryId=None):
+    if categoryId is None:
+        return set(tokens)
+    return {'%s:%d' % (token, categoryId) for token in tokens}
+
+def saveSearch(owner, query, category=None):
+    """
+    Saves a search for a user and indexes it.
+
+    :param owner (User): The user saving the search.
+    :param query (str): The search text.
+    :param category (Category): The category to restrict the search to, or None.
+
+    :return (SavedSearch): The saved search.
+    """
+    savedSearch = SavedSearch.objects.create(owner=owner, query=query.strip(), category=category)
+    SavedSearchToken.objects.bulk_create(
+        SavedSearchToken(savedSearch=savedSearch, token=key)
+        for key in indexKeys(tokenize(query) or {matchAll}, category.pk if category else None)
+    )
+    return savedSearch
+
+def percolate(items, batchSize=500):
+    """
+    Matches newly saved items against all saved searches and notifies the owners of the matching searches.
+
+    Works on any number of items at once, so bulk imports should pass the whole batch instead of calling it per item.
+    Users are notified once per item however many of their searches match, and never about their own items.
+
+    :param items (iterable): The new items.
+    :param batchSize (int): How many tokens are looked up and how many notifications are inserted per query.
+
+    :return (int): The number of notifications created.
+    """
+    items = list(items)
+    if not items:
+        return 0
+
+    itemTokens = {item.pk: tokenize(item.name) | tokenize(item.description) for item in items}
+    itemsByToken = defaultdict(list)
+    for item in items:
+        for token in itemTokens[item.pk]:
+            itemsByToken[token].append(item)
+
+    # Every item looks up its words and '*', both on their own and for its category.
+    keys = set()
+    for item in items:
+        tokens = itemTokens[item.pk] | {matchAll}
+        keys |= indexKeys(tokens) | indexKeys(tokens, item.category_id)
+
+    # Looked up in chunks so a large import stays below the database's limit on query parameters.
+    keys = sorted(keys)
+    candidateIds = set()
+    for start in range(0, len(keys), batchSize):
+        candidateIds.update(SavedSearchToken.objects.filter(token__in=keys[start:start + batchSize])
+                            .values_list('savedSearch_id', flat=True))
+
+    candidateIds = sorted(candidateIds)
+    notified = set()
+    notifications = []
+    for start in range(0, len(candidateIds), batchSize):
+        chunk = candidateIds[start:start + batchSize]
+
+        for search in SavedSearch.objects.filter(pk__in=chunk).only('id', 'owner_id', 'category_id', 'query'):
+            required = tokenize(search.query)
+            # Only the items containing the search's rarest word can match it.
+            matching = min((itemsByToken[token] for token in required), key=len) if required else items
+
+            for item in matching:
+                if search.owner_id == item.owner_id:
+                    continue
+                if search.category_id is not None and search.category_id != item.category_id:
+                    continue
+                if (search.owner_id, item.pk) in notified:
+                    continue
+                if required <= itemTokens[item.pk]:
+                    notified.add((search.owner_id, item.pk))
+                    notifications.append(Notification(
+                        user_id=search.owner_id, item=item, savedSearch=search,
+                        text='New listing matching your saved search: %s' % item.name,
+                    ))
+
+    Notification.objects.bulk_create(notifications, batch_size=batchSize)
+    return len(notifications)
@@ -0,0 +1,226 @@
+"""
+On-demand request profiling.
+
+ProfilingMiddleware profiles a single request when the request asks for it: a staff user adds ?_profile=1, a client
+sends an X-Profile header holding a token from profileToken() (python manage.py profiling --token prints one), or the
+request is picked by the sample rate. While the view runs it records
+
+- the call stacks, sampled from a background thread every PROFILING_INTERVAL seconds (low overhead), and with
+  cProfile as well when PROFILING_MODE is 'cprofile',
+- every SQL query with its duration, through the connections' execute wrappers,
+- every template render with its duration.
+
+The stacks are written in collapsed-stack format to PROFILING_DIR, ready for flamegraph.pl or speedscope, and a
+RequestProfile row with a text summary is saved for the admin. cProfile only records which function called which,
+not whole stacks, so in that mode the sampler runs alongside it for the collapsed stacks and cProfile's exact call
+counts and times are written next to them as a .prof file. The stacks are then slowed down by cProfile's overhead,
+most for functions that are called very often.
+
+Profiling is switched on and off and sampled at runtime, without a restart: the ProfilingSwitch row, edited in the
+admin or with python manage.py profiling, is re-read by every worker at most every PROFILING_SWITCH_SECONDS. A request
+that does not ask to be profiled only costs the checks in wanted(), so the middleware stays in the chain.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core import signing
+from django.db import DatabaseError, connections
+from django.template.base import Template
+from django.utils import timezone
+
+from .models import ProfilingSwitch, RequestProfile
+
+tokenSalt = 'app.profiling'
+_active = threading.local()
+
+def profileToken(maxAge=3600):
+    """
+    Creates a signed token that switches profiling on for requests sending it in the X-Profile header.
+
+    :param maxAge (int): Seconds the token stays valid.
+
+    :return (str): The token.
+    """
+    return signing.dumps({'expires': time.time() + maxAge}, salt=tokenSalt)
+
+def currentSwitch():
+    """
+    :return (tuple): Whether profiling is enabled and the sample rate, from the ProfilingSwitch row or, without one,
+        from the settings.
+    """
+    switch = ProfilingSwitch.objects.order_by('pk').first()
+    if switch is None:
+        return getattr(settings, 'PROFILING_ENABLED', True), getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+    if switch.sampleUntil is not None and switch.sampleUntil <= timezone.now():
+        return switch.enabled, 0.0
+    return switch.enabled, switch.sampleRate
+
+def _validToken(token):
+    try:
+        return signing.loads(token, salt=tokenSalt)['expires'] > time.time()
+    except (signing.BadSignature, KeyError, TypeError):
+        return False
+
+def _instrumentTemplates():
+    """
+    Wraps Template.render once so template spans are recorded for the thread being profiled. Other threads only
+    pay an attribute lookup.
+    """
+    if getattr(Template.render, 'profiled', False):
+        return
+
+    originalRender = Template.render
+
+    def render(self, context):
+        spans = getattr(_active, 'templates', None)
+        if spans is None:
+            return originalRender(self, context)
+
+        started = time.perf_counter()
+        try:
+            return originalRender(self, context)
+        finally:
+            spans.append((self.origin.template_name or self.origin.name, time.perf_counter() - started))
+
+    render.profiled = True
+    Template.render = render
+
+class StackSampler(threading.Thread):
+    """
+        Samples the call stack of another thread at a fixed interval and counts the collapsed stacks.
+    """
+    def __init__(self, threadId, interval):
+        super().__init__(daemon=True)
+        self.threadId = threadId
+        self.interval = interval
+        self.stacks = Counter()
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            frame = sys._current_frames().get(self.threadId)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+class ProfilingMiddleware:
+    """
+        Profiles requests on demand, see the module docstring. Must come after AuthenticationMiddleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.mode = getattr(settings, 'PROFILING_MODE', 'sampler')
+        self.interval = getattr(settings, 'PROFILING_INTERVAL', 0.005)
+        self.directory = getattr(settings, 'PROFILING_DIR', settings.BASE_DIR / 'profiles')
+        self.switchSeconds = getattr(settings, 'PROFILING_SWITCH_SECONDS', 10)
+        self.switchReadAt = None
+        self.enabled = getattr(settings, 'PROFILING_ENABLED', True)
+        self.sampleRate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        _instrumentTemplates()
+
+    def __call__(self, request):
+        if not self.wanted(request):
+            return self.get_response(request)
+
+        queries = []
+        _active.templates = []
+
+        def recordQuery(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append((sql, time.perf_counter() - started))
+
+        profiler = None
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recordQuery))
+
+            sampler = StackSampler(threading.get_ident(), self.interval)
+            sampler.start()
+            if self.mode == 'cprofile':
+                profiler = cProfile.Profile()
+                profiler.enable()
+
+            started = time.perf_counter()
+            try:
+                response = self.get_response(request)
+            finally:
+                duration = time.perf_counter() - started
+                if profiler is not None:
+                    profiler.disable()
+                sampler.stop()
+                templates = _active.templates
+                _active.templates = None
+
+        self.save(request, response, duration, queries, templates, profiler, sampler)
+        return response
+
+    def refreshSwitch(self):
+        now = time.monotonic()
+        if self.switchReadAt is not None and now - self.switchReadAt < self.switchSeconds:
+            return
+        self.switchReadAt = now
+        try:
+            self.enabled, self.sampleRate = currentSwitch()
+        except DatabaseError:
+            # E.g. before the migrations have run: keep the previous values.
+            pass
+
+    def wanted(self, request):
+        self.refreshSwitch()
+        if not self.enabled:
+            return False
+        if request.GET.get('_profile') and request.user.is_staff:
+            return True
+        if 'HTTP_X_PROFILE' in request.META:
+            return _validToken(request.META['HTTP_X_PROFILE'])
+        return self.sampleRate > 0 and random.random() < self.sampleRate
+
+    def save(self, request, response, duration, queries, templates, profiler, sampler):
+        os.makedirs(self.directory, exist_ok=True)
+        name = '%s-%s' % (timezone.now().strftime('%Y%m%d-%H%M%S-%f'), request.path.strip('/').replace('/', '_') or 'index')
+
+        summary = io.StringIO()
+        summary.write('%s %s -> %s in %.1f ms\n\n' % (request.method, request.get_full_path(), response.status_code, duration * 1000))
+        summary.write('SQL: %d queries, %.1f ms\n' % (len(queries), sum(spent for _, spent in queries) * 1000))
+        for sql, spent in sorted(queries, key=lambda query: -query[1])[:20]:
+            summary.write('  %8.2f ms  %s\n' % (spent * 1000, sql[:300]))
+        summary.write('\nTemplates: %d renders\n' % len(templates))
+        for templateName, spent in templates:
+            summary.write('  %8.2f ms  %s\n' % (spent * 1000, templateName))
+
+        if profiler is not None:
+            profiler.dump_stats(os.path.join(self.directory, name + '.prof'))
+            summary.write('\nTop functions by cumulative time (raw stats in %s.prof):\n' % name)
+            pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(30)
+
+        path = os.path.join(self.directory, name + '.folded')
+        with open(path, 'w') as file:
+            for stack, count in sampler.stacks.most_common():
+                file.write('%s %d\n' % (stack, count))
+
+        RequestProfile.objects.create(
+            path=request.path[:255], method=request.method, statusCode=response.status_code,
+            duration=duration, queryCount=len(queries), queryTime=sum(spent for _, spent in queries),
+            profileFile=path, summary=summary.getvalue(),
+        )
@@ -0,0 +1,120 @@
+"""
+Soft deletion and background purging.
+
+Deleting an item only sets Item.deletedAt, which hides it everywhere immediately. Deleting a user deactivates the
+account, soft-deletes their items and records a UserDeletion. The purgedeleted command later removes the rows for
+real in bounded batches, one short transaction per batch, so neither a request nor a single statement has to cascade
+through thousands of conversations and messages. Image files are removed together with the last item using them.
+
+Conversations and messages live on the messaging database and are not cascaded into from items and users (see
+app/routers.py), so they are purged explicitly before the rows they refer to. Items and users deleted any other
+way, e.g. by deleting their category or calling User.delete(), lose their conversations and messages through the
+pre_delete receivers below instead, in one go.
+"""
+
+import time
+
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import pre_delete
+from django.utils import timezone
+
+from .models import Conversation, ConversationMember, ConversationMessage, Item, Notification, UserDeletion
+
+def softDeleteItems(items):
+    """
+    Soft-deletes items.
+
+    :param items (QuerySet): The items to delete.
+
+    :return (int): The number of items deleted.
+    """
+    now = timezone.now()
+    return items.filter(deletedAt__isnull=True).update(deletedAt=now, modifiedAt=now)
+
+def softDeleteUser(user):
+    """
+    Deactivates a user, soft-deletes their items and queues the account for purging.
+    """
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+        softDeleteItems(Item.objects.filter(owner=user))
+        UserDeletion.objects.get_or_create(user=user)
+
+def deleteInBatches(queryset, batchSize, pause=0):
+    """
+    Deletes the rows of a queryset batchSize rows at a time, each batch in its own transaction.
+
+    :param queryset (QuerySet): The rows to delete.
+    :param batchSize (int): The number of rows per batch.
+    :param pause (float): Seconds to sleep between batches, giving other writers a chance at the database lock.
+
+    :return (int): The number of rows deleted, including cascaded ones.
+    """
+    deleted = 0
+    while True:
+        batch = list(queryset.order_by().values_list('pk', flat=True)[:batchSize])
+        if not batch:
+            return deleted
+
+        with transaction.atomic(using=queryset.db):
+            deleted += queryset.model._base_manager.using(queryset.db).filter(pk__in=batch).delete()[0]
+
+        if pause:
+            time.sleep(pause)
+
+def purgeItem(item, batchSize=500, pause=0):
+    """
+    Permanently deletes a soft-deleted item, its dependents and its image file.
+
+    :param item (Item): The item to purge, loaded through Item.allObjects.
+
+    :return (int): The number of rows deleted.
+    """
+    deleted = deleteInBatches(ConversationMessage.objects.filter(conversation__item_id=item.pk), batchSize, pause)
+    deleted += deleteInBatches(Conversation.objects.filter(item_id=item.pk), batchSize, pause)
+    deleted += deleteInBatches(Notification.objects.filter(item_id=item.pk), batchSize, pause)
+
+    with transaction.atomic():
+        deleted += Item.allObjects.filter(pk=item.pk).delete()[0]
+
+    if item.image and not Item.allObjects.filter(image=item.image.name).exists():
+        default_storage.delete(item.image.name)
+
+    return deleted
+
+def purgeUser(user, batchSize=500, pause=0):
+    """
+    Permanently deletes a user queued by softDeleteUser, once all their items have been purged.
+
+    :return (int): The number of rows deleted, or 0 if the user still has items.
+    """
+    if Item.allObjects.filter(owner=user).exists():
+        return 0
+
+    deleted = deleteInBatches(ConversationMessage.objects.filter(host=user), batchSize, pause)
+    deleted += deleteInBatches(ConversationMember.objects.filter(user=user), batchSize, pause)
+    deleted += deleteInBatches(Notification.objects.filter(user=user), batchSize, pause)
+
+    with transaction.atomic():
+        deleted += type(user).objects.filter(pk=user.pk).delete()[0]
+
+    return deleted
+
+def deleteItemConversations(sender, instance, **kwargs):
+    # Cascades to the conversations' members and messages on the messaging database.
+    Conversation.objects.filter(item_id=instance.pk).delete()
+
+def deleteUserMessages(sender, instance, **kwargs):
+    ConversationMessage.objects.filter(host_id=instance.pk).delete()
+    ConversationMember.objects.filter(user_id=instance.pk).delete()
+
+def connectSignals():
+    """
+    Removes the messaging rows of items and users that are deleted without going through the purge, since no
+    database cascade reaches the messaging database. Called from AppConfig.ready().
+    """
+    pre_delete.connect(deleteItemConversations, sender=Item, dispatch_uid='purge-item-conversations')
+    pre_delete.connect(deleteUserMessages, sender=User, dispatch_uid='purge-user-messages')
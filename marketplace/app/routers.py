@@ -0,0 +1,48 @@
+"""
+Database routing for the messaging tables.
+
+Conversations, their members and their messages live on the 'messaging' database alias, so a burst of chat writes
+holds that database's write lock instead of the one item and catalog writes need. The alias can point at a second
+SQLite file or at a separate server.
+
+References from the messaging tables to Item and User cross databases. They are declared with db_constraint=False
+and on_delete=DO_NOTHING, so no foreign key constraint or cascade reaches into the other database: app.purge removes
+the conversations and messages of deleted items and users explicitly, and its pre_delete receivers do the same for
+items and users deleted any other way. Queries must not join
+across the two databases, so views fetch items and users separately, with in_bulk() or prefetch_related().
+
+The outbox tables and DataVersion exist on both databases, because every change records its event and bumps its
+version on its own database.
+"""
+
+messagingAlias = 'messaging'
+messagingModels = {'conversation', 'conversationmember', 'conversation_members', 'conversationmessage'}
+sharedModels = {'outboxevent', 'outboxcheckpoint', 'dataversion'}
+
+def isMessaging(model):
+    return model._meta.app_label == 'app' and model._meta.model_name in messagingModels
+
+class MessagingRouter:
+    """
+        Routes the messaging models to the 'messaging' database and everything else to 'default'.
+    """
+    # Both name the default database explicitly: otherwise Django falls back to the database of the instance in the
+    # hints, which sends e.g. the items prefetched for conversations to the messaging database.
+    def db_for_read(self, model, **hints):
+        return messagingAlias if isMessaging(model) else 'default'
+
+    def db_for_write(self, model, **hints):
+        return messagingAlias if isMessaging(model) else 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Conversations and messages refer to items and users on the default database.
+        if isMessaging(obj1) or isMessaging(obj2):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == 'app' and model_name in sharedModels:
+            return True
+        if app_label == 'app' and model_name in messagingModels:
+            return db == messagingAlias
+        return db != messagingAlias
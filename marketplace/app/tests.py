@@ -1,3 +1,921 @@
-from django.test import TestCase
+import gc
+import gzip
+import io
+import math
+import os
+import shutil
+import tempfile
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from unittest import skipIf
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from . import digests, fingerprints, geo, percolator, warmup
+from .admin import EstimatedCountPaginator
+from .catalog import cachedCategories, categoryList, categoryVersion, forgetCategories
+from .middleware import brotli, minifyHtml
+from .profiling import currentSwitch, profileToken
+from .routers import MessagingRouter
+from .purge import purgeItem, purgeUser, softDeleteItems, softDeleteUser
+from .models import (Category, Conversation, ConversationMember, ConversationMessage, Item, Notification,
+                     NotificationPreference, OutboxEvent, ProfilingSwitch, RequestProfile, SavedSearch, Upload,
+                     UploadUsage, UserDeletion)
+from .outbox import OutboxConsumer
+from .uploads import UploadError, partialPath, receiveChunk, startUpload
+from .warmup import report, warmUp
+
+def pointAt(latitude, longitude, distanceKm, bearing):
+    """
+    :return (tuple): The coordinate distanceKm away from the given one in the direction of bearing (in degrees).
+    """
+    angle = distanceKm / geo.earthRadiusKm
+    lat1, lon1, bearing = math.radians(latitude), math.radians(longitude), math.radians(bearing)
+    lat2 = math.asin(math.sin(lat1) * math.cos(angle) + math.cos(lat1) * math.sin(angle) * math.cos(bearing))
+    lon2 = lon1 + math.atan2(math.sin(bearing) * math.sin(angle) * math.cos(lat1), math.cos(angle) - math.sin(lat1) * math.sin(lat2))
+    return math.degrees(lat2), (math.degrees(lon2) + 540) % 360 - 180
+
+def pngBytes(color='red', size=(16, 16)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+class MarketplaceTestCase(TestCase):
+    """
+        Creates a category and two users for the tests below. Conversations live on the messaging database.
+    """
+    databases = {'default', 'messaging'}
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Bikes')
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        self.buyer = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+
+    def createItem(self, name='Bike', **fields):
+        fields.setdefault('price', 10)
+        fields.setdefault('owner', self.seller)
+        fields.setdefault('category', self.category)
+        return Item.objects.create(name=name, **fields)
+
+    def createConversation(self, item, *users):
+        conversation = Conversation.objects.create(item_id=item.id)
+        ConversationMember.objects.bulk_create([ConversationMember(conversation=conversation, user_id=user.id) for user in users])
+        return conversation
+
+class ConditionalPageTests(MarketplaceTestCase):
+    def assertRevalidates(self, path, change):
+        etag = self.client.get(path)['ETag']
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def testIndexNotModified(self):
+        item = self.createItem()
+        self.assertRevalidates(reverse('item:index'), item.save)
+        self.assertRevalidates(reverse('item:index'), lambda: Item.objects.filter(pk=item.pk).update(isSold=True))
+
+    def testDetailNotModified(self):
+        item = self.createItem()
+        related = self.createItem('Helmet')
+
+        def renameCategory():
+            self.category.name = 'Bicycles'
+            self.category.save()
+
+        self.assertRevalidates(reverse('item:detail', args=[item.pk]), related.save)
+        self.assertRevalidates(reverse('item:detail', args=[item.pk]), renameCategory)
+        self.assertEqual(self.client.get(reverse('item:detail', args=[item.pk + 100])).status_code, 404)
+
+    def testSearchNotModified(self):
+        self.createItem()
+        bike = self.client.get(reverse('item:search'), {'query': 'bike'})['ETag']
+        sofa = self.client.get(reverse('item:search'), {'query': 'sofa'})['ETag']
+
+        self.assertNotEqual(bike, sofa)
+        self.assertRevalidates(reverse('item:search') + '?query=bike', lambda: self.createItem('Bike bell'))
+
+    def testLoginChangesEtag(self):
+        self.createItem()
+        etag = self.client.get(reverse('item:index'))['ETag']
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.client.get(reverse('item:index'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def testMinifyHtml(self):
+        html = '<div>\n    <p>Hello</p>\n\n    <pre>\n  keep\n    this\n</pre>\n</div>\n'
+        self.assertEqual(minifyHtml(html), '<div>\n<p>Hello</p>\n<pre>\n  keep\n    this\n</pre>\n</div>')
+
+        self.createItem()
+        response = self.client.get(reverse('item:index'))
+        self.assertNotIn(b'\n    ', response.content)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+
+    def testCompressesHtmlWithGzip(self):
+        self.createItem()
+        plain = self.client.get(reverse('item:index'))
+        response = self.client.get(reverse('item:index'), HTTP_ACCEPT_ENCODING='br, gzip')
+
+        # Even with brotli installed, pages are only sent with gzip, which pads against BREACH.
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertTrue(response['ETag'].startswith('W/'))
+
+    @skipIf(brotli is None, 'brotli is not installed')
+    def testCompressesJsonWithBrotli(self):
+        for number in range(10):
+            self.createItem('Bike %d' % number)
+        plain = self.client.get(reverse('api:items'))
+        response = self.client.get(reverse('api:items'), HTTP_ACCEPT_ENCODING='br')
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+
+class GeoTests(MarketplaceTestCase):
+    def assertCovers(self, latitude, longitude, radiusKm):
+        cells = geo.coveringCells(latitude, longitude, radiusKm)
+        for bearing in range(0, 360, 5):
+            for fraction in (0.5, 0.999):
+                point = pointAt(latitude, longitude, radiusKm * fraction, bearing)
+                self.assertTrue(any(geo.encode(*point).startswith(cell) for cell in cells),
+                                'Missed %s around (%s, %s) within %s km' % (point, latitude, longitude, radiusKm))
+
+    def testCoveringCellsCoverTheCircle(self):
+        for latitude, longitude, radiusKm in ((40.7, -74.0, 5), (51.5, -0.1, 50), (-33.9, 151.2, 0.5), (0.0, 179.99, 20)):
+            self.assertCovers(latitude, longitude, radiusKm)
+
+    def testCoveringCellsNearThePoles(self):
+        self.assertCovers(89.9, 10.0, 30)
+        self.assertCovers(-88.0, -120.0, 100)
+        self.assertCovers(78.2, 15.6, 40)
+
+    def testWithinRadius(self):
+        near = self.createItem('Near', latitude=40.7128, longitude=-74.0060)
+        nearer = self.createItem('Nearer', latitude=40.7300, longitude=-73.9950)
+        self.createItem('Far', latitude=42.3601, longitude=-71.0589)
+        self.createItem('Nowhere')
+
+        found = geo.withinRadius(Item.objects.all(), 40.7306, -73.9352, 10, sortByDistance=True)
+
+        self.assertEqual([item.pk for item in found], [nearer.pk, near.pk])
+        self.assertLess(found[0].distance, found[1].distance)
+        self.assertTrue(all(item.distance <= 10 for item in found))
+
+class FingerprintTests(MarketplaceTestCase):
+    description = 'Red road bike with a carbon frame, new tyres and a spare inner tube, barely ridden this summer.'
+
+    def fingerprint(self, item, image=None, description=None):
+        hashValue = fingerprints.imageHash(io.BytesIO(image)) if image else None
+        signature = fingerprints.textSignature(description)
+        fingerprints.storeFingerprint(item, hashValue, signature)
+        return hashValue, signature
+
+    def testFindsSimilarDescriptions(self):
+        original = self.createItem()
+        self.fingerprint(original, description=self.description)
+        other = self.createItem('Sofa')
+        self.fingerprint(other, description='Grey three seat sofa, pet free and smoke free home, pick up only please.')
+
+        signature = fingerprints.textSignature(self.description.replace('summer', 'summer!'))
+
+        self.assertEqual(fingerprints.findDuplicates(None, signature), [original.pk])
+        self.assertEqual(fingerprints.findDuplicates(None, signature, exclude=original.pk), [])
+
+    def testFindsSameImage(self):
+        original = self.createItem()
+        self.fingerprint(original, image=pngBytes('red', (64, 64)))
+
+        resized = fingerprints.imageHash(io.BytesIO(pngBytes('red', (128, 128))))
+
+        self.assertEqual(fingerprints.findDuplicates(resized, None), [original.pk])
+        self.assertEqual(fingerprints.findDuplicates(None, None), [])
+
+class SavedSearchTests(MarketplaceTestCase):
+    def testIndexesByCategory(self):
+        anywhere = percolator.saveSearch(self.buyer, '  Red Bike ')
+        inCategory = percolator.saveSearch(self.buyer, 'Red bike', self.category)
+        everything = percolator.saveSearch(self.buyer, '', self.category)
+
+        def keys(search):
+            return set(search.tokens.values_list('token', flat=True))
+
+        self.assertEqual(anywhere.query, 'Red Bike')
+        self.assertEqual(keys(anywhere), {'red', 'bike'})
+        self.assertEqual(keys(inCategory), {'red:%d' % self.category.pk, 'bike:%d' % self.category.pk})
+        self.assertEqual(keys(everything), {'*:%d' % self.category.pk})
+
+    def testPercolate(self):
+        other = Category.objects.create(name='Sofas')
+        watcher = User.objects.create_user('watcher', 'watcher@example.com', 'password')
+        percolator.saveSearch(self.buyer, 'red bike')
+        percolator.saveSearch(self.buyer, 'bike', self.category)
+        percolator.saveSearch(self.buyer, 'bike', other)
+        percolator.saveSearch(watcher, '', self.category)
+        percolator.saveSearch(watcher, 'blue bike')
+        percolator.saveSearch(self.seller, 'bike')
+
+        bike = self.createItem('Red bike', description='A fast one.')
+        sofa = Item.objects.create(category=other, name='Sofa', price=50, owner=self.seller)
+
+        self.assertEqual(percolator.percolate([bike, sofa]), 2)
+        self.assertEqual(sorted(Notification.objects.values_list('user__username', 'item_id')),
+                         [('buyer', bike.pk), ('watcher', bike.pk)])
+        self.assertEqual(percolator.percolate([]), 0)
+
+    def testSaveSearchView(self):
+        self.client.force_login(self.buyer)
+
+        for category, saved in (('abc', None), ('', None), (str(self.category.pk), self.category), ('99999', None)):
+            response = self.client.post(reverse('item:saveSearch'), {'query': 'bike', 'category': category})
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(SavedSearch.objects.latest('pk').category, saved)
+
+    def testSearchEtagFollowsCsrfSecret(self):
+        path = reverse('item:search') + '?query=bike'
+        self.client.post(reverse('item:login'), {'username': 'buyer', 'password': 'password'})
+        etag = self.client.get(path)['ETag']
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Logging in again rotates the CSRF secret, so the cached form's token is no longer valid.
+        self.client.logout()
+        self.client.post(reverse('item:login'), {'username': 'buyer', 'password': 'password'})
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+class AdminTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+
+    def changelist(self, model, **parameters):
+        response = self.client.get(reverse('admin:app_%s_changelist' % model._meta.model_name), parameters)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def testItemSearchByNamePrefixAndOwner(self):
+        bike = self.createItem('Bike')
+        bicycle = self.createItem('Bicycle')
+        self.createItem('Sofa', owner=self.buyer)
+
+        self.assertEqual({item.pk for item in self.changelist(Item, q='Bi').result_list}, {bike.pk, bicycle.pk})
+        self.assertEqual({item.pk for item in self.changelist(Item, q='Bik').result_list}, {bike.pk})
+        self.assertEqual(len(self.changelist(Item, q='seller').result_list), 2)
+        self.assertEqual(len(self.changelist(Item, q='ike').result_list), 0)
+
+    def testMessagingSearches(self):
+        conversation = self.createConversation(self.createItem('Bike'), self.seller, self.buyer)
+        self.createConversation(self.createItem('Sofa'), self.seller, self.buyer)
+        message = ConversationMessage.objects.create(conversation=conversation, host_id=self.buyer.id, content='Hello')
+
+        self.assertEqual([row.pk for row in self.changelist(Conversation, q='Bike').result_list], [conversation.pk])
+        self.assertEqual([row.pk for row in self.changelist(ConversationMessage, q='buyer').result_list], [message.pk])
+        self.assertEqual(len(self.changelist(ConversationMessage, q='nobody').result_list), 0)
+
+    def testEstimatedCount(self):
+        items = [self.createItem('Bike %d' % number) for number in range(5)]
+        Item.allObjects.filter(pk=items[2].pk).delete()
+
+        with patch.object(EstimatedCountPaginator, 'exactCountLimit', 2):
+            self.assertEqual(EstimatedCountPaginator(Item.objects.all(), 2).count, 5)
+            self.assertEqual(EstimatedCountPaginator(Item.objects.filter(isSold=False), 2).count, 4)
+        self.assertEqual(EstimatedCountPaginator(Item.objects.all(), 2).count, 4)
+        self.assertEqual(self.changelist(Item).paginator.count, 4)
+
+    def testActions(self):
+        items = [self.createItem('Bike %d' % number) for number in range(3)]
+        path = reverse('admin:app_item_changelist')
+        actions = self.client.get(path).context['action_form'].fields['action'].choices
+
+        self.assertNotIn('delete_selected', [name for name, _ in actions])
+
+        self.client.post(path, {'action': 'markSold', '_selected_action': [items[0].pk, items[1].pk]})
+        self.assertEqual(set(Item.objects.filter(isSold=True).values_list('pk', flat=True)), {items[0].pk, items[1].pk})
+
+        self.client.post(path, {'action': 'softDelete', '_selected_action': [items[2].pk]})
+        self.assertFalse(Item.objects.filter(pk=items[2].pk).exists())
+        self.assertIsNotNone(Item.allObjects.get(pk=items[2].pk).deletedAt)
+
+    def testDeletePagesSoftDelete(self):
+        item = self.createItem()
+
+        self.client.post(reverse('admin:app_item_delete', args=[item.pk]), {'post': 'yes'})
+        self.client.post(reverse('admin:auth_user_delete', args=[self.buyer.pk]), {'post': 'yes'})
+
+        self.assertIsNotNone(Item.allObjects.get(pk=item.pk).deletedAt)
+        self.buyer.refresh_from_db()
+        self.assertFalse(self.buyer.is_active)
+        self.assertTrue(UserDeletion.objects.filter(user=self.buyer).exists())
+
+class ProfilingTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.settings = override_settings(PROFILING_DIR=self.directory, PROFILING_SWITCH_SECONDS=0, PROFILING_SAMPLE_RATE=0.0)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.staff = User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+
+    def profiled(self, *args, **kwargs):
+        before = RequestProfile.objects.count()
+        self.assertEqual(self.client.get(reverse('item:index'), *args, **kwargs).status_code, 200)
+        return RequestProfile.objects.count() - before
+
+    def testStaffQueryFlag(self):
+        self.assertEqual(self.profiled({'_profile': 1}), 0)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.profiled(), 0)
+        self.assertEqual(self.profiled({'_profile': 1}), 1)
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.path, profile.method, profile.statusCode), ('/', 'GET', 200))
+        self.assertTrue(profile.profileFile.endswith('.folded'))
+        self.assertTrue(os.path.exists(profile.profileFile))
+        self.assertIn('SQL: %d queries' % profile.queryCount, profile.summary)
+        self.assertIn('app/index.html', profile.summary)
+
+    def testTokenHeader(self):
+        self.assertEqual(self.profiled(HTTP_X_PROFILE=profileToken()), 1)
+        self.assertEqual(self.profiled(HTTP_X_PROFILE=profileToken(maxAge=-1)), 0)
+        self.assertEqual(self.profiled(HTTP_X_PROFILE='forged'), 0)
+
+    def testRuntimeSwitch(self):
+        self.client.force_login(self.staff)
+        switch = ProfilingSwitch.objects.create(enabled=False, sampleRate=1.0)
+        self.assertEqual(self.profiled({'_profile': 1}), 0)
+
+        switch.enabled = True
+        switch.save()
+        self.client.logout()
+        self.assertEqual(self.profiled(), 1)
+
+        switch.sampleUntil = datetime.now(dt_timezone.utc) - timedelta(seconds=1)
+        switch.save()
+        self.assertEqual(self.profiled(), 0)
+
+    @override_settings(PROFILING_MODE='cprofile', PROFILING_INTERVAL=0.0001)
+    def testCprofileWritesCollapsedStacks(self):
+        self.assertEqual(self.profiled(HTTP_X_PROFILE=profileToken()), 1)
+
+        profile = RequestProfile.objects.get()
+        self.assertTrue(os.path.exists(profile.profileFile[:-len('.folded')] + '.prof'))
+        self.assertIn('Top functions by cumulative time', profile.summary)
+        with open(profile.profileFile) as file:
+            lines = file.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+        self.assertTrue(any('__call__ (profiling.py:' in line for line in lines))
+
+    def testCommand(self):
+        call_command('profiling', '--sample-rate', '0.5', '--minutes', '5', stdout=io.StringIO())
+        switch = ProfilingSwitch.objects.get()
+        self.assertEqual((switch.enabled, switch.sampleRate), (True, 0.5))
+        self.assertIsNotNone(switch.sampleUntil)
+
+        call_command('profiling', '--disable', stdout=io.StringIO())
+        self.assertEqual(currentSwitch(), (False, 0.5))
+
+        output = io.StringIO()
+        call_command('profiling', '--token', '--max-age', '60', stdout=output, stderr=io.StringIO())
+        self.assertEqual(self.profiled(HTTP_X_PROFILE=output.getvalue().strip()), 0)
+        call_command('profiling', '--enable', stdout=io.StringIO())
+        self.assertEqual(self.profiled(HTTP_X_PROFILE=output.getvalue().strip()), 1)
+
+        with self.assertRaises(CommandError):
+            call_command('profiling', '--sample-rate', '2')
+
+class UploadTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.settings = override_settings(UPLOAD_PARTIAL_DIR=self.directory + '/partial', MEDIA_ROOT=self.directory + '/media',
+                                          UPLOAD_CHUNK_BYTES=64)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.factory = RequestFactory()
+
+        # Noise does not compress, so the image spans several chunks.
+        buffer = io.BytesIO()
+        Image.effect_noise((16, 16), 64).save(buffer, 'PNG')
+        self.data = buffer.getvalue()
+
+    def send(self, upload, data, start, total=None):
+        total = upload.size if total is None else total
+        request = self.factory.put('/', data, content_type='application/octet-stream',
+                                   HTTP_CONTENT_RANGE='bytes %d-%d/%d' % (start, start + len(data) - 1, total))
+        return receiveChunk(upload, request)
+
+    def testResumesAcrossChunks(self):
+        data = self.data
+        upload = startUpload(self.seller, 'bike.png', len(data))
+
+        self.send(upload, data[:64], 0)
+        # A client that lost the connection reads the offset back and continues from there.
+        upload = Upload.objects.get(pk=upload.pk)
+        self.assertEqual(upload.received, 64)
+        for start in range(64, len(data), 64):
+            self.send(upload, data[start:start + 64], start)
+
+        upload.refresh_from_db()
+        self.assertTrue(upload.isComplete)
+        self.assertEqual(upload.contentType, 'image/png')
+        with open(self.directory + '/media/' + upload.file, 'rb') as file:
+            self.assertEqual(file.read(), data)
+
+    def testRejectsWrongOffset(self):
+        data = self.data
+        upload = startUpload(self.seller, 'bike.png', len(data))
+        self.send(upload, data[:64], 0)
+
+        with self.assertRaises(UploadError) as raised:
+            self.send(upload, data[100:110], 100)
+        self.assertEqual(raised.exception.status, 409)
+
+        with self.assertRaises(UploadError) as raised:
+            self.send(upload, data[64:70], 64, total=len(data) + 1)
+        self.assertEqual(raised.exception.status, 416)
+        self.assertEqual(Upload.objects.get(pk=upload.pk).received, 64)
+
+    def testRejectsBadMagicBytes(self):
+        upload = startUpload(self.seller, 'script.png', 40)
+
+        with self.assertRaises(UploadError) as raised:
+            self.send(upload, b'#!/bin/sh\necho not an image at all......', 0)
+
+        self.assertEqual(raised.exception.status, 415)
+        self.assertFalse(Upload.objects.filter(pk=upload.pk).exists())
+        self.assertFalse(os.path.exists(partialPath(upload)))
+
+    def testStoresUnderGeneratedName(self):
+        upload = startUpload(self.seller, 'evil.html', len(self.data))
+        for start in range(0, len(self.data), 64):
+            self.send(upload, self.data[start:start + 64], start)
+
+        self.assertEqual(upload.filename, 'evil.html')
+        self.assertEqual(upload.file, 'itemImages/%s.png' % upload.pk.hex)
+
+    def testRejectsCorruptImage(self):
+        data = self.data[:8] + bytes(len(self.data) - 8)
+        upload = startUpload(self.seller, 'bike.png', len(data))
+
+        with self.assertRaises(UploadError) as raised:
+            for start in range(0, len(data), 64):
+                self.send(upload, data[start:start + 64], start)
+
+        self.assertEqual(raised.exception.status, 415)
+        self.assertFalse(Upload.objects.filter(pk=upload.pk).exists())
+
+    def postItem(self, name, image):
+        return self.client.post(reverse('item:new'), {
+            'category': self.category.pk, 'name': name, 'price': 10,
+            'image': SimpleUploadedFile(name + '.png', image, 'image/png'),
+        })
+
+    def testFormImagesAreLimited(self):
+        self.client.force_login(self.seller)
+
+        with override_settings(UPLOAD_MAX_BYTES=len(self.data) - 1):
+            response = self.postItem('Bike', self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('image', response.context['form'].errors)
+
+        with override_settings(UPLOAD_DAILY_BYTES=len(self.data) + 50):
+            self.assertEqual(self.postItem('Bike', self.data).status_code, 302)
+            response = self.postItem('Sofa', pngBytes('blue'))
+        self.assertEqual(response.context['form'].errors['image'], ['Daily upload quota exceeded.'])
+        self.assertEqual(list(Item.objects.values_list('name', flat=True)), ['Bike'])
+
+class PurgeTests(MarketplaceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.settings = override_settings(UPLOAD_PARTIAL_DIR=self.directory + '/partial', MEDIA_ROOT=self.directory + '/media')
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        os.makedirs(self.directory + '/media/itemImages')
+
+    def mediaFile(self, name, age=0):
+        path = '%s/media/itemImages/%s' % (self.directory, name)
+        with open(path, 'wb') as file:
+            file.write(pngBytes())
+        if age:
+            modified = os.stat(path).st_mtime - age
+            os.utime(path, (modified, modified))
+        return path
+
+    def testSoftDeleteItems(self):
+        bike = self.createItem('Bike')
+        self.createItem('Sofa')
+
+        self.assertEqual(softDeleteItems(Item.objects.filter(pk=bike.pk)), 1)
+        self.assertEqual(softDeleteItems(Item.allObjects.all()), 1)
+        self.assertFalse(Item.objects.exists())
+        self.assertEqual(Item.allObjects.filter(deletedAt__isnull=False).count(), 2)
+
+    def testPurgeItemRemovesDependents(self):
+        path = self.mediaFile('bike.png')
+        bike = self.createItem('Bike', image='itemImages/bike.png')
+        copy = self.createItem('Bike copy', image='itemImages/bike.png')
+        conversation = self.createConversation(bike, self.seller, self.buyer)
+        ConversationMessage.objects.create(conversation=conversation, host_id=self.buyer.id, content='Hello')
+        Notification.objects.create(user=self.seller, item=bike, text='Sold')
+        softDeleteItems(Item.objects.filter(pk__in=[bike.pk, copy.pk]))
+
+        purgeItem(Item.allObjects.get(pk=bike.pk), batchSize=1)
+
+        self.assertFalse(Item.allObjects.filter(pk=bike.pk).exists())
+        self.assertFalse(Conversation.objects.exists())
+        self.assertFalse(ConversationMember.objects.exists())
+        self.assertFalse(ConversationMessage.objects.exists())
+        self.assertFalse(Notification.objects.exists())
+        # The image is still used by the copy.
+        self.assertTrue(os.path.exists(path))
+
+        purgeItem(Item.allObjects.get(pk=copy.pk))
+        self.assertFalse(os.path.exists(path))
+
+    def testPurgeUserWaitsForItems(self):
+        item = self.createItem('Sofa', owner=self.buyer)
+        conversation = self.createConversation(self.createItem('Bike'), self.seller, self.buyer)
+        ConversationMessage.objects.create(conversation=conversation, host_id=self.buyer.id, content='Hello')
+        softDeleteUser(self.buyer)
+
+        self.assertFalse(User.objects.get(pk=self.buyer.pk).is_active)
+        self.assertEqual(purgeUser(self.buyer), 0)
+
+        purgeItem(Item.allObjects.get(pk=item.pk))
+        self.assertGreater(purgeUser(self.buyer), 0)
+        self.assertFalse(User.objects.filter(pk=self.buyer.pk).exists())
+        self.assertFalse(UserDeletion.objects.exists())
+        self.assertFalse(ConversationMessage.objects.exists())
+        self.assertEqual(list(ConversationMember.objects.values_list('user_id', flat=True)), [self.seller.id])
+
+    def testPurgeDeletedCommand(self):
+        self.createItem('Sofa', owner=self.buyer)
+        self.createItem('Bike')
+        softDeleteUser(self.buyer)
+        output = io.StringIO()
+
+        call_command('purgedeleted', grace_minutes=0, pause=0, stdout=output)
+
+        self.assertIn('Purged 1 items and 1 users', output.getvalue())
+        self.assertEqual(list(Item.allObjects.values_list('name', flat=True)), ['Bike'])
+
+    def testCleanMedia(self):
+        day = 24 * 3600
+        referenced = self.mediaFile('bike.png', 2 * day)
+        unreferenced = self.mediaFile('old.png', 2 * day)
+        recent = self.mediaFile('new.png')
+        self.createItem('Bike', image='itemImages/bike.png')
+        for number in range(3):
+            startUpload(self.seller, 'part%d.png' % number, 100)
+        startUpload(self.seller, 'current.png', 100)
+        twoDaysAgo = datetime.now(dt_timezone.utc) - timedelta(days=2)
+        Upload.objects.exclude(filename='current.png').update(createdAt=twoDaysAgo)
+        UploadUsage.objects.update(day=twoDaysAgo.date())
+
+        call_command('cleanmedia', dry_run=True, stdout=io.StringIO())
+        self.assertTrue(os.path.exists(unreferenced))
+        self.assertEqual(Upload.objects.count(), 4)
+
+        output = io.StringIO()
+        call_command('cleanmedia', batch_size=2, stdout=output)
+
+        self.assertIn('Removed 1 unreferenced images and 3 abandoned uploads.', output.getvalue())
+        self.assertEqual([os.path.exists(path) for path in (referenced, unreferenced, recent)], [True, False, True])
+        self.assertEqual(list(Upload.objects.values_list('filename', flat=True)), ['current.png'])
+        self.assertFalse(UploadUsage.objects.exists())
+
+class OutboxTests(MarketplaceTestCase):
+    def testBatchesAndReplay(self):
+        start = OutboxEvent.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        consumer = OutboxConsumer('tests', batchSize=2, gapSeconds=0)
+        consumer.commit(start)
+
+        items = [self.createItem('Bike %d' % number) for number in range(5)]
+        Item.objects.filter(pk=items[0].pk).update(isSold=True)
+
+        batches = list(consumer.batches())
+        events = [event for batch in batches for event in batch]
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 2])
+        self.assertEqual([(event.objectId, event.action) for event in events],
+                         [(item.pk, 'create') for item in items] + [(items[0].pk, 'update')])
+        self.assertEqual(events[-1].payload, {'fields': ['isSold']})
+
+        # Without a commit the next call starts from the checkpoint again.
+        self.assertEqual(len(list(consumer.batches())), 3)
+        consumer.commit(events[-1])
+        self.assertEqual(list(consumer.batches()), [])
+
+        consumer.replay(events[3].pk)
+        self.assertEqual([event.pk for batch in consumer.batches() for event in batch], [event.pk for event in events[4:]])
+
+    def testWaitsForRecentGaps(self):
+        consumer = OutboxConsumer('tests', batchSize=10, gapSeconds=60)
+        consumer.commit(OutboxEvent.objects.order_by('-pk').values_list('pk', flat=True).first() or 0)
+        first, missing, last = (self.createItem('Bike %d' % number) for number in range(3))
+        OutboxEvent.objects.filter(objectId=missing.pk, model='Item').delete()
+
+        self.assertEqual([event.objectId for event in consumer.poll()], [first.pk])
+
+        OutboxEvent.objects.filter(objectId=last.pk, model='Item').update(createdAt=datetime.now(dt_timezone.utc) - timedelta(minutes=5))
+        self.assertEqual([event.objectId for event in consumer.poll()], [first.pk, last.pk])
+
+class MessagingTests(MarketplaceTestCase):
+    def testRouter(self):
+        messagingRouter = MessagingRouter()
+
+        for model in (Conversation, ConversationMember, ConversationMessage):
+            self.assertEqual(messagingRouter.db_for_read(model), 'messaging')
+            self.assertEqual(messagingRouter.db_for_write(model), 'messaging')
+            self.assertTrue(messagingRouter.allow_migrate('messaging', 'app', model._meta.model_name))
+            self.assertFalse(messagingRouter.allow_migrate('default', 'app', model._meta.model_name))
+        # An instance on the messaging database in the hints does not drag other models along.
+        conversation = self.createConversation(self.createItem(), self.seller)
+        self.assertEqual(messagingRouter.db_for_read(Item, instance=conversation), 'default')
+
+        self.assertFalse(messagingRouter.allow_migrate('messaging', 'app', 'item'))
+        self.assertFalse(messagingRouter.allow_migrate('messaging', 'auth', 'user'))
+        for name in ('outboxevent', 'outboxcheckpoint', 'dataversion'):
+            self.assertTrue(messagingRouter.allow_migrate('default', 'app', name))
+            self.assertTrue(messagingRouter.allow_migrate('messaging', 'app', name))
+
+    def testDeletingCategoryRemovesConversations(self):
+        kept = self.createConversation(self.createItem('Sofa', category=Category.objects.create(name='Furniture')), self.buyer)
+        conversation = self.createConversation(self.createItem('Bike'), self.seller, self.buyer)
+        ConversationMessage.objects.create(conversation=conversation, host_id=self.buyer.id, content='Hello')
+
+        self.category.delete()
+
+        self.assertEqual(list(Conversation.objects.values_list('pk', flat=True)), [kept.pk])
+        self.assertEqual(ConversationMember.objects.count(), 1)
+        self.assertFalse(ConversationMessage.objects.exists())
+
+    def testDeletingUserRemovesMessages(self):
+        conversation = self.createConversation(self.createItem('Bike'), self.seller, self.buyer)
+        ConversationMessage.objects.create(conversation=conversation, host_id=self.buyer.id, content='Hello')
+        ConversationMessage.objects.create(conversation=conversation, host_id=self.seller.id, content='Hi')
+
+        self.buyer.delete()
+
+        self.assertEqual(list(ConversationMessage.objects.values_list('content', flat=True)), ['Hi'])
+        self.assertEqual(list(ConversationMember.objects.values_list('user_id', flat=True)), [self.seller.id])
+
+class MoveMessagingTests(TransactionTestCase):
+    """
+        Recreates the messaging tables on the default database, where they were before the router existed. Schema
+        changes on SQLite cannot run inside the transaction TestCase wraps every test in.
+    """
+    databases = {'default', 'messaging'}
+
+    def setUp(self):
+        self.seller = User.objects.create_user('seller', 'seller@example.com', 'password')
+        self.item = Item.objects.create(category=Category.objects.create(name='Bikes'), name='Bike', price=10, owner=self.seller)
+        self.source = connections['default']
+        with self.source.schema_editor() as editor:
+            for model in (Conversation, ConversationMember, ConversationMessage):
+                editor.create_model(model)
+        self.addCleanup(self.dropOldTables)
+
+        conversations = Conversation.objects.using('default').bulk_create([Conversation(item=self.item) for _ in range(3)])
+        ConversationMember.objects.using('default').bulk_create([ConversationMember(conversation=conversation, user=self.seller)
+                                                                 for conversation in conversations])
+        ConversationMessage.objects.using('default').bulk_create([ConversationMessage(conversation=conversations[0], host=self.seller,
+                                                                                      content='Hello %d' % number) for number in range(5)])
+
+    def dropOldTables(self):
+        tables = self.source.introspection.table_names()
+        with self.source.schema_editor() as editor:
+            for model in (ConversationMessage, ConversationMember, Conversation):
+                if model._meta.db_table in tables:
+                    editor.delete_model(model)
+
+    def move(self, **options):
+        output = io.StringIO()
+        call_command('movemessaging', batch_size=2, stdout=output, **options)
+        return output.getvalue()
+
+    def testCopiesInBatchesAndResumes(self):
+        self.assertIn('app_conversationmessage: copied 5 rows, 0 already present, 0 conflicts.', self.move())
+        self.assertIn('app_conversationmessage: copied 0 rows, 5 already present, 0 conflicts.', self.move())
+
+        for model in (Conversation, ConversationMember, ConversationMessage):
+            self.assertEqual(set(model.objects.values_list('pk', flat=True)),
+                             set(model.objects.using('default').values_list('pk', flat=True)))
+        self.assertEqual(Conversation.objects.first().item, self.item)
+
+    def testConflictsKeepTheOldTables(self):
+        self.move()
+        ConversationMessage.objects.using('default').filter(content='Hello 0').update(content='Edited')
+
+        with self.assertRaises(CommandError):
+            self.move(drop=True)
+        self.assertIn(ConversationMessage._meta.db_table, self.source.introspection.table_names())
+
+    def testDrop(self):
+        self.assertIn('Dropped the old tables from default.', self.move(drop=True))
+
+        self.assertNotIn(Conversation._meta.db_table, self.source.introspection.table_names())
+        self.assertEqual(ConversationMessage.objects.count(), 5)
+
+class DigestTests(MarketplaceTestCase):
+    def testQuietHours(self):
+        preference = NotificationPreference(quietStart=time(22), quietEnd=time(7), timeZone='Europe/Berlin')
+        winter = datetime(2026, 1, 15, tzinfo=dt_timezone.utc)
+
+        self.assertTrue(digests.inQuietHours(preference, winter.replace(hour=21, minute=30)))
+        self.assertTrue(digests.inQuietHours(preference, winter.replace(hour=5, minute=30)))
+        self.assertFalse(digests.inQuietHours(preference, winter.replace(hour=6, minute=30)))
+        self.assertFalse(digests.inQuietHours(preference, winter.replace(hour=20, minute=30)))
+
+        preference.quietStart, preference.quietEnd, preference.timeZone = time(9), time(17), 'No/Such_Zone'
+        self.assertTrue(digests.inQuietHours(preference, winter.replace(hour=9)))
+        self.assertFalse(digests.inQuietHours(preference, winter.replace(hour=17)))
+
+        preference.quietEnd = None
+        self.assertFalse(digests.inQuietHours(preference, winter.replace(hour=12)))
+
+    @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+    def testDeliver(self):
+        item = self.createItem()
+        conversation = self.createConversation(item, self.seller, self.buyer)
+        digests.collect()
+
+        ConversationMessage.objects.create(conversation=conversation, host_id=self.buyer.id, content='Is it still available?')
+        ConversationMessage.objects.create(conversation=conversation, host_id=self.seller.id, content='Yes.')
+        self.assertEqual(digests.collect(), 2)
+
+        preference = NotificationPreference.objects.get(user=self.seller)
+        preference.quietStart, preference.quietEnd = time(0), time(23, 59)
+        preference.save()
+        quiet = datetime(2026, 1, 15, 12, tzinfo=dt_timezone.utc)
+
+        self.assertEqual(digests.deliver(quiet), {'email': 1, 'feed': 0, 'off': 0})
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        self.assertIn('Yes.', mail.outbox[0].body)
+
+        counts = digests.deliver(quiet.replace(hour=23, minute=59, second=30))
+
+        self.assertEqual(counts, {'email': 1, 'feed': 0, 'off': 0})
+        self.assertEqual(mail.outbox[1].to, ['seller@example.com'])
+        self.assertIn('Is it still available?', mail.outbox[1].body)
+        self.assertNotIn('Yes.', mail.outbox[1].body)
+        self.assertEqual(digests.deliver(quiet + timedelta(days=1)), {'email': 0, 'feed': 0, 'off': 0})
+
+class CatalogTests(MarketplaceTestCase):
+    def testCachedUntilCategoriesChange(self):
+        version = categoryVersion()
+        with self.assertNumQueries(0):
+            self.assertEqual(categoryList(), [self.category])
+            self.assertEqual(categoryVersion(), version)
+
+        furniture = Category.objects.create(name='Furniture')
+        with self.assertNumQueries(1):
+            self.assertEqual({category.name for category in categoryList()}, {'Bikes', 'Furniture'})
+        self.assertNotEqual(categoryVersion(), version)
+
+        version = categoryVersion()
+        furniture.delete()
+        self.assertEqual(categoryList(), [self.category])
+        self.assertNotEqual(categoryVersion(), version)
+
+    def testStaleListKeepsItsVersion(self):
+        version, categories = cachedCategories()
+        # Another process renames the category; this one still has the old list cached.
+        Category.objects.filter(pk=self.category.pk).update(name='Bicycles', modifiedAt=datetime.now(dt_timezone.utc) + timedelta(seconds=1))
+
+        self.assertEqual(cachedCategories(), (version, categories))
+        forgetCategories()
+        self.assertEqual(categoryList()[0].name, 'Bicycles')
+        self.assertNotEqual(categoryVersion(), version)
+
+    def testIndexReadsCategoriesOnce(self):
+        self.createItem()
+        self.client.get(reverse('item:index'))
+
+        with patch.object(Category.objects, 'all', side_effect=AssertionError('categories read again')):
+            self.assertEqual(self.client.get(reverse('item:index')).status_code, 200)
+
+class WarmUpTests(MarketplaceTestCase):
+    def testWarmUp(self):
+        timings = warmUp(prefork=False)
+
+        self.assertEqual([name for name, _, _ in timings], [name for name, _ in warmup.steps])
+        self.assertTrue(all(seconds >= 0 for _, seconds, _ in timings))
+        details = dict((name, detail) for name, _, detail in timings)
+        self.assertNotIn('skipped', details['templates'])
+        self.assertEqual(details['categories'], '1 categories')
+        with self.assertNumQueries(0):
+            categoryList()
+
+    def testPrefork(self):
+        self.addCleanup(gc.unfreeze)
+        # Closing the connections would end the transaction the test runs in.
+        with patch.object(warmup.connections, 'close_all') as closeAll:
+            timings = warmUp()
+
+        closeAll.assert_called_once_with()
+        self.assertEqual(timings[-1][0], 'pre-fork')
+        self.assertGreater(gc.get_freeze_count(), 0)
+
+    def testReport(self):
+        lines = report([('imports', 0.002, 'app.urls'), ('forms', 0.001, '6 forms')], startup=0.5).splitlines()
+
+        self.assertEqual(lines[0].split(), ['application', 'load', '500.0', 'ms'])
+        self.assertEqual(lines[1].split(), ['imports', '2.0', 'ms', 'app.urls'])
+        self.assertEqual(lines[-1].split(), ['total', '503.0', 'ms'])
+
+class ApiTests(MarketplaceTestCase):
+    def testItemsPagination(self):
+        items = [self.createItem('Bike %d' % number) for number in range(5)]
+        self.createItem('Sold', isSold=True)
+
+        page = self.client.get(reverse('api:items'), {'limit': 2, 'fields': 'name'}).json()
+        ids = [row['id'] for row in page['items']]
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            ids += [row['id'] for row in page['items']]
+
+        self.assertEqual(ids, [item.pk for item in reversed(items)])
+        self.assertEqual(set(page['items'][0]), {'id', 'name'})
+
+        byId = self.client.get(reverse('api:items'), {'ids': '%d,0,%d' % (items[1].pk, items[0].pk)}).json()
+        self.assertEqual([row['id'] for row in byId['items']], [items[1].pk, items[0].pk])
+        self.assertEqual(byId['missing'], [0])
+
+        self.assertEqual(self.client.get(reverse('api:items'), {'limit': 0}).status_code, 400)
+
+    def testItemsNotModified(self):
+        item = self.createItem()
+        response = self.client.get(reverse('api:items'))
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get(reverse('api:items'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        item.name = 'Renamed bike'
+        item.save()
+        self.assertEqual(self.client.get(reverse('api:items'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get(reverse('api:items')).get('ETag')
+        self.category.name = 'Bicycles'
+        self.category.save()
+        self.assertEqual(self.client.get(reverse('api:items'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def testInboxRequiresLogin(self):
+        self.assertEqual(self.client.get(reverse('api:inbox')).status_code, 401)
+
+    def testInboxPagination(self):
+        conversations = [self.createConversation(self.createItem('Bike %d' % number), self.seller, self.buyer) for number in range(3)]
+        self.createConversation(self.createItem('Other'), self.seller)
+        # Touch the first conversation so it becomes the most recently active one.
+        conversations[0].save()
+        self.client.force_login(self.buyer)
+
+        page = self.client.get(reverse('api:inbox'), {'limit': 2}).json()
+        ids = [row['id'] for row in page['conversations']]
+        self.assertEqual(page['conversations'][0]['members'], ['seller'])
+        self.assertIsNotNone(page['next'])
+        page = self.client.get(page['next']).json()
+        ids += [row['id'] for row in page['conversations']]
+
+        self.assertIsNone(page['next'])
+        self.assertEqual(ids, [conversations[0].pk, conversations[2].pk, conversations[1].pk])
+
+    def testInboxNotModified(self):
+        item = self.createItem()
+        conversation = self.createConversation(item, self.seller, self.buyer)
+        self.client.force_login(self.buyer)
+        etag = self.client.get(reverse('api:inbox'))['ETag']
+
+        self.assertEqual(self.client.get(reverse('api:inbox'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        ConversationMessage.objects.create(conversation=conversation, host_id=self.seller.id, content='Hello')
+        conversation.save()
+        response = self.client.get(reverse('api:inbox'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        item.name = 'Renamed bike'
+        item.save()
+        self.assertEqual(self.client.get(reverse('api:inbox'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def testBenchmark(self):
+        # Items without an image, as seeddata creates them.
+        item = self.createItem()
+        self.createConversation(item, self.seller, self.buyer)
+        output = io.StringIO()
+
+        call_command('benchapi', requests=2, user='buyer', stdout=output)
+
+        pages = [line.split()[:2] for line in output.getvalue().splitlines()[1:]]
+        self.assertEqual(pages, [[name, kind] for name in ('index', 'search', 'detail', 'inbox', 'conversation') for kind in ('html', 'api')])
@@ -0,0 +1,220 @@
+"""
+Chunked, resumable image uploads.
+
+A client starts an upload by declaring its file name and size, then sends the file in chunks with a Content-Range
+header. Each chunk is streamed from the request straight onto the end of a partial file, so nothing is buffered in
+memory or spooled through Django's upload handlers, and an interrupted upload resumes from Upload.received. The
+image type is checked against the first bytes of the first chunk. Once every byte has arrived the file is verified
+with Pillow and moved into storage under itemImages/, named after the upload's id and its detected type, and the item
+form only sends the upload's id.
+
+Limits come from settings: UPLOAD_MAX_BYTES per file, UPLOAD_CHUNK_BYTES per request, UPLOAD_MAX_PENDING unfinished
+uploads per user and UPLOAD_DAILY_BYTES per user per day (UTC). The daily bytes are counted in UploadUsage when an
+upload starts, so uploads that are later attached to an item, rejected or cleaned up still count for that day. Images
+posted directly with the item forms are held to the same UPLOAD_MAX_BYTES and charged to the same daily quota.
+"""
+
+import os
+import re
+import shutil
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+from PIL import Image
+
+from .models import Upload, UploadUsage
+
+readSize = 64 * 1024
+contentRange = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+# Leading bytes of the image types accepted for items.
+signatures = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+# Pillow's format name and the file extension stored for each accepted type.
+imageTypes = {
+    'image/jpeg': ('JPEG', '.jpg'),
+    'image/png': ('PNG', '.png'),
+    'image/gif': ('GIF', '.gif'),
+    'image/webp': ('WEBP', '.webp'),
+}
+
+class UploadError(Exception):
+    """
+        Raised when an upload or a chunk is rejected. status is the HTTP status code to answer with.
+    """
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def sniffImageType(head):
+    """
+    :param head (bytes): The first bytes of a file.
+
+    :return (str): The detected image content type, or None if the bytes do not start a supported image.
+    """
+    for signature, contentType in signatures:
+        if head.startswith(signature):
+            return contentType
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def partialPath(upload):
+    return os.path.join(settings.UPLOAD_PARTIAL_DIR, '%s.part' % upload.pk)
+
+def startUpload(user, filename, size):
+    """
+    Starts an upload after checking the per-file and per-user quotas.
+
+    :param user (User): The uploading user.
+    :param filename (str): The original file name.
+    :param size (int): The declared total size in bytes.
+
+    :return (Upload): The new upload.
+
+    :raises UploadError: If the size is invalid or a quota would be exceeded.
+    """
+    if size <= 0 or size > settings.UPLOAD_MAX_BYTES:
+        raise UploadError('Files must be between 1 byte and %d bytes.' % settings.UPLOAD_MAX_BYTES, 413)
+
+    if Upload.objects.filter(owner=user, isComplete=False).count() >= settings.UPLOAD_MAX_PENDING:
+        raise UploadError('Too many unfinished uploads.', 429)
+
+    if not chargeDailyQuota(user, size):
+        raise UploadError('Daily upload quota exceeded.', 429)
+
+    return Upload.objects.create(owner=user, filename=get_valid_filename(os.path.basename(filename)) or 'image', size=size)
+
+def chargeDailyQuota(user, size):
+    """
+    Adds size bytes to the user's usage of the day if that stays within UPLOAD_DAILY_BYTES.
+
+    :return (bool): True if the bytes were charged, False if they would exceed the quota.
+    """
+    today = timezone.now().date()
+    UploadUsage.objects.get_or_create(owner=user, day=today)
+    # Checked and raised in one UPDATE, so concurrent uploads cannot both slip under the quota.
+    return UploadUsage.objects.filter(
+        owner=user, day=today, bytes__lte=settings.UPLOAD_DAILY_BYTES - size,
+    ).update(bytes=F('bytes') + size) == 1
+
+def receiveChunk(upload, request):
+    """
+    Appends one chunk from the request body to an upload, finishing the upload after its last chunk.
+
+    :param upload (Upload): The upload the chunk belongs to.
+    :param request (HttpRequest): The request carrying the chunk and its Content-Range header.
+
+    :return (Upload): The updated upload.
+
+    :raises UploadError: If the chunk is malformed, out of order, too large or not an image.
+    """
+    if upload.isComplete:
+        raise UploadError('The upload is already complete.', 409)
+
+    match = contentRange.match(request.META.get('HTTP_CONTENT_RANGE', ''))
+    if not match:
+        raise UploadError('A Content-Range header of the form "bytes start-end/total" is required.')
+
+    start, end, total = (int(value) for value in match.groups())
+    length = end - start + 1
+    if total != upload.size or end >= total or length <= 0:
+        raise UploadError('The Content-Range does not match the upload.', 416)
+    if length > settings.UPLOAD_CHUNK_BYTES:
+        raise UploadError('Chunks may be at most %d bytes.' % settings.UPLOAD_CHUNK_BYTES, 413)
+    if start != upload.received:
+        raise UploadError('Expected a chunk starting at byte %d.' % upload.received, 409)
+
+    os.makedirs(settings.UPLOAD_PARTIAL_DIR, exist_ok=True)
+    written = 0
+    with open(partialPath(upload), 'r+b' if start else 'wb') as partial:
+        partial.seek(start)
+        partial.truncate()
+
+        while written < length:
+            data = request.read(min(readSize, length - written))
+            if not data:
+                break
+            if written == 0 and start == 0:
+                upload.contentType = sniffImageType(data) or ''
+                if not upload.contentType:
+                    break
+            partial.write(data)
+            written += len(data)
+
+    if start == 0 and not upload.contentType:
+        discardUpload(upload)
+        raise UploadError('Only JPEG, PNG, GIF and WebP images can be uploaded.', 415)
+
+    if written != length:
+        raise UploadError('The chunk ended after %d of %d bytes.' % (written, length))
+
+    # Guards against two requests sending the same chunk at once: only the one that still sees the old offset wins.
+    if not Upload.objects.filter(pk=upload.pk, received=start).update(received=F('received') + length, contentType=upload.contentType):
+        raise UploadError('The chunk was received twice.', 409)
+    upload.received = start + length
+
+    if upload.received == upload.size:
+        finishUpload(upload)
+
+    return upload
+
+def discardUpload(upload):
+    """
+    Deletes a rejected upload and its partial file so it no longer counts as unfinished. Its bytes stay charged to
+    the day's quota.
+    """
+    if os.path.exists(partialPath(upload)):
+        os.remove(partialPath(upload))
+    upload.delete()
+
+def finishUpload(upload):
+    """
+    Verifies a fully received upload with Pillow and moves it into storage.
+
+    The stored name is the upload's random id with the extension of the detected type. The client's file name is
+    never used for it: media is served with the type guessed from the extension, so e.g. an image named evil.html
+    would be served as a page.
+    """
+    path = partialPath(upload)
+    formatName, extension = imageTypes[upload.contentType]
+    try:
+        with Image.open(path) as image:
+            image.verify()
+            valid = image.format == formatName
+    except Exception:
+        valid = False
+    if not valid:
+        discardUpload(upload)
+        raise UploadError('The uploaded file is not a valid image.', 415)
+
+    name = default_storage.get_available_name('itemImages/%s%s' % (upload.pk.hex, extension))
+    try:
+        target = default_storage.path(name)
+    except NotImplementedError:
+        with open(path, 'rb') as file:
+            name = default_storage.save(name, File(file))
+        os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(path, target)
+
+    upload.file = name
+    upload.isComplete = True
+    upload.save(update_fields=['file', 'isComplete'])
+
+def completedUpload(user, uploadId):
+    """
+    :return (Upload): The user's finished upload with the given id, or None.
+    """
+    if not uploadId:
+        return None
+    return Upload.objects.filter(pk=uploadId, owner=user, isComplete=True).first()
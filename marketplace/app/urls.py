@@ -34,6 +34,10 @@ urlpatterns = [
     # Dashboard of all your items
     path('dashboard/', views.dashboard, name='dashboard'),
 
+    # Resumable image uploads referenced by the new and edit forms
+    path('uploads/', views.newUpload, name='newUpload'),
+    path('uploads/<uuid:pk>/', views.uploadChunk, name='uploadChunk'),
+
     # Delete or edit item if you are the owner
     path('<int:pk>/delete/', views.delete, name="delete"),
     path('<int:pk>/edit/', views.edit, name="edit"),
@@ -41,6 +45,13 @@ urlpatterns = [
     # Page where you can search for items
     path('search/', views.search, name='search'),
 
+    # Save or delete a search to be notified about new matching items
+    path('search/save/', views.saveSearch, name='saveSearch'),
+    path('search/<int:pk>/delete/', views.deleteSearch, name='deleteSearch'),
+
+    # Notifications and saved searches
+    path('notifications/', views.notifications, name='notifications'),
+
     # Start a new conversation
     path('conversation/<int:item_pk>/', views.newConversation, name='convo'),
 
@@ -1,23 +1,44 @@
+import json
+
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Category, Item, ConversationMessage, Conversation
-from .forms import SignUp, NewItem, EditItem, MessageForm
+from .models import Category, Item, ConversationMessage, Conversation, ConversationMember, SavedSearch, Notification, NotificationPreference, Upload
+from .forms import SignUp, NewItem, EditItem, MessageForm, NotificationPreferenceForm
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
 from django.contrib.auth import logout as auth_logout
+from django.contrib.auth.models import User
 from django.db.models import Q
+from django.views.decorators.http import condition, require_POST, require_http_methods
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.http import urlencode
+from .etags import indexEtag, detailEtag, searchEtag
+from .geo import withinRadius
+from .fingerprints import imageHash, textSignature, findDuplicates, storeFingerprint, fingerprintItem
+from .percolator import saveSearch as storeSavedSearch, percolate
+from .uploads import UploadError, startUpload, receiveChunk, completedUpload, chargeDailyQuota
+from .purge import softDeleteItems
+from .digests import newestMessageId
+from .catalog import categoryList
 # Create your views here.
 
 """
 
 """
+@condition(etag_func=indexEtag)
 def index(request):
     """
     The index function is the main page of the website. It displays a list of
     categories and items that are currently for sale, including the user's items.
 
+    The page is served with an ETag from etags.indexEtag, so a client holding the current copy gets
+    a 304 Not Modified without the page being rendered.
+
     :param request: Get the request from the user
     :return: A list of categories and a list of items
     """
-    categories = Category.objects.all()
+    categories = categoryList()
     items = Item.objects.filter(isSold=False)[0:6]
     return render(request, 'app/index.html', {
         'categories' : categories,
@@ -36,12 +57,13 @@ def privacy(request):
 def terms(request):
     return render(request, 'app/tos.html')
 
+@condition(etag_func=detailEtag)
 def detail(request, pk):
     """
     The detail function is used to display the details of a specific item.
     It takes in a request and an item id (pk), then returns the detail page for that
     item. It also gets three related items (items with the same category as this one)
-    to display on the side.
+    to display on the side. Like index, it answers 304 Not Modified when the client's ETag is current.
 
     :param request: Get the request from the user
     :param pk: Get the item from the database
@@ -93,16 +115,44 @@ def new(request):
     Notes:
         - The 'app/form.html' template should be created to render the item creation form.
         - The @login_required decorator ensures that only authenticated users can access this view.
+        - Listings whose image or description is a near-duplicate of an unsold item are rejected (see fingerprints.py).
+        - Users with a saved search matching the new item are notified (see percolator.py).
+        - The image can instead be sent beforehand through the resumable upload endpoint and referenced by its id in the 'upload' field.
+        - An image posted with the form is held to UPLOAD_MAX_BYTES and charged to the daily upload quota like a resumable upload.
     """
     if request.method == 'POST':
         form = NewItem(request.POST, request.FILES)
 
         if form.is_valid():
-            item = form.save(commit=False)
-            item.owner = request.user
-            item.save()
-
-            return redirect('item:detail', pk=item.id)
+            upload = completedUpload(request.user, form.cleaned_data.get('upload'))
+            image = form.cleaned_data.get('image')
+
+            if upload:
+                with default_storage.open(upload.file, 'rb') as file:
+                    hashValue = imageHash(file)
+            else:
+                hashValue = imageHash(image) if image else None
+            signature = textSignature(form.cleaned_data.get('description'))
+
+            if form.cleaned_data.get('upload') and not upload:
+                form.add_error('upload', 'The uploaded image could not be found.')
+            elif Item.objects.filter(pk__in=findDuplicates(hashValue, signature), isSold=False).exists():
+                form.add_error(None, 'This looks like a duplicate of an item that is already listed.')
+            elif image and not upload and not chargeDailyQuota(request.user, image.size):
+                form.add_error('image', 'Daily upload quota exceeded.')
+            else:
+                item = form.save(commit=False)
+                item.owner = request.user
+                if upload:
+                    item.image.name = upload.file
+                item.save()
+                storeFingerprint(item, hashValue, signature)
+                percolate([item])
+
+                if upload:
+                    upload.delete()
+
+                return redirect('item:detail', pk=item.id)
     else:
         form = NewItem()
 
@@ -143,9 +193,10 @@ def delete(request,pk):
         :raises Http404: If the item with the specified primary key does not exist or does not belong to the authenticated user.
 
         This view function deletes an item based on the provided primary key (pk) if the item exists and belongs to the currently authenticated user.
+        The item is only soft-deleted here, which hides it at once; its conversations, messages and image are purged in batches by the purgedeleted command.
     """
     item = get_object_or_404(Item, pk=pk, owner=request.user)
-    item.delete()
+    softDeleteItems(Item.objects.filter(pk=item.pk))
     return redirect('item:index')
 
 @login_required
@@ -169,9 +220,26 @@ def edit(request, pk):
         form = EditItem(request.POST, request.FILES, instance=item)
 
         if form.is_valid():
-            item.save()
+            upload = completedUpload(request.user, form.cleaned_data.get('upload'))
+
+            image = request.FILES.get('image')
 
-            return redirect('item:detail', pk=item.id)
+            if form.cleaned_data.get('upload') and not upload:
+                form.add_error('upload', 'The uploaded image could not be found.')
+            elif image and not upload and not chargeDailyQuota(request.user, image.size):
+                form.add_error('image', 'Daily upload quota exceeded.')
+            else:
+                if upload:
+                    item.image.name = upload.file
+                item.save()
+
+                if upload or 'image' in form.changed_data or 'description' in form.changed_data:
+                    fingerprintItem(item)
+
+                if upload:
+                    upload.delete()
+
+                return redirect('item:detail', pk=item.id)
     else:
         form = EditItem(instance=item)
 
@@ -180,6 +248,7 @@ def edit(request, pk):
         'title' : 'Edit Item',
     })
 
+@condition(etag_func=searchEtag)
 def search(request):
     """
         Performs a search for items in the online marketplace through the input given in the search bar.
@@ -192,11 +261,16 @@ def search(request):
         The search query is obtained from the GET request parameter 'query'. Items that are not marked as sold (isSold=False) are considered for the search.
         Users can further filter the results by category, which is obtained from the GET request parameter 'category'. If a category is selected, the search is narrowed down to items within that category.
         The 'name' and 'description' fields of items are searched for the query using a case-insensitive contains match.
+        The ETag from etags.searchEtag covers the query string, so repeated searches are answered with 304 Not Modified until an item changes.
+        Location filters: 'postal' restricts results to a postal area, and 'lat'/'lng' with an optional 'radius' in km (default 10) restrict
+        results to items within that distance, using the geohash index in geo.py. With 'sort=distance' the results are ordered nearest first.
         """
     query = request.GET.get('query', '')
     items = Item.objects.filter(isSold=False)
-    categories = Category.objects.all()
+    categories = categoryList()
     category_id = request.GET.get('category', 0)
+    postal = request.GET.get('postal', '').strip().upper()
+    sort = request.GET.get('sort', '')
 
     if category_id:
         items = items.filter(category_id=category_id)
@@ -204,14 +278,147 @@ def search(request):
     if query:
         items = items.filter(name__icontains=query or Q(description__icontains=query))
 
+    if postal:
+        items = items.filter(postalCode=postal)
+
+    try:
+        latitude = float(request.GET['lat'])
+        longitude = float(request.GET['lng'])
+        radius = min(max(float(request.GET.get('radius') or 10), 0.1), 500)
+    except (KeyError, ValueError):
+        latitude = longitude = radius = None
+
+    if latitude is not None and -90 <= latitude <= 90 and -180 <= longitude <= 180:
+        items = withinRadius(items, latitude, longitude, radius, sortByDistance=(sort == 'distance'))
 
     return render(request, 'app/search.html', {
         'items' : items,
         'query' : query,
         'categories' : categories,
         'category_id' : int(category_id),
+        'postal' : postal,
+        'lat' : request.GET.get('lat', ''),
+        'lng' : request.GET.get('lng', ''),
+        'radius' : radius or 10,
+        'radii' : (1, 5, 10, 25, 50),
+        'sort' : sort,
     })
 
+@login_required()
+@require_POST
+def saveSearch(request):
+    """
+        Saves the current search so the user is notified about new items matching it.
+
+        :param request (HttpRequest): An HTTP request object whose POST data holds the 'query' and optional 'category' of the search.
+
+        :return: Redirects back to the search page with the saved query and category.
+    """
+    query = request.POST.get('query', '')
+    categoryId = request.POST.get('category', '').strip()
+    category = Category.objects.filter(pk=categoryId).first() if categoryId.isdigit() else None
+    storeSavedSearch(request.user, query, category)
+
+    return redirect('%s?%s' % (reverse('item:search'), urlencode({'query': query, 'category': category.id if category else 0})))
+
+@login_required()
+@require_POST
+def deleteSearch(request, pk):
+    """
+        Deletes one of the authenticated user's saved searches.
+
+        :param request (HttpRequest): An HTTP request object containing metadata and data about the user's request.
+        :param pk (int): The primary key of the saved search to be deleted.
+
+        :return: Redirects to the notifications page.
+
+        :raises Http404: If the saved search does not exist or does not belong to the authenticated user.
+    """
+    savedSearch = get_object_or_404(SavedSearch, pk=pk, owner=request.user)
+    savedSearch.delete()
+    return redirect('item:notifications')
+
+@login_required()
+def notifications(request):
+    """
+        Displays the user's notifications, message digest settings and saved searches.
+
+        :param request (HttpRequest): An HTTP request object containing metadata and data about the user's request.
+
+        :return: If the HTTP request method is POST and the digest settings are valid, saves them and redirects to the notifications page.
+        :return: Otherwise renders the 'app/notifications.html' template with the latest notifications, the settings form and the user's saved searches.
+
+        Notifications are marked as read once they have been shown. A user's first saved settings only apply to
+        messages sent afterwards.
+    """
+    preference = NotificationPreference.objects.filter(user=request.user).first()
+    if preference is None:
+        newest = newestMessageId()
+        preference = NotificationPreference(user=request.user, lastMessageId=newest, pendingMessageId=newest)
+
+    if request.method == 'POST':
+        form = NotificationPreferenceForm(request.POST, instance=preference)
+
+        if form.is_valid():
+            form.save()
+            return redirect('item:notifications')
+    else:
+        form = NotificationPreferenceForm(instance=preference)
+
+    notificationList = list(Notification.objects.filter(user=request.user).select_related('item')[0:50])
+    Notification.objects.filter(pk__in=[notification.pk for notification in notificationList if not notification.isRead]).update(isRead=True)
+
+    return render(request, 'app/notifications.html', {
+        'notifications' : notificationList,
+        'form' : form,
+        'savedSearches' : SavedSearch.objects.filter(owner=request.user).select_related('category'),
+    })
+
+@login_required()
+@require_POST
+def newUpload(request):
+    """
+        Starts a chunked, resumable image upload.
+
+        :param request (HttpRequest): An HTTP request whose JSON body holds the 'filename' and total 'size' in bytes of the image.
+
+        :return: A JSON response with the upload's 'id', the 'offset' to send the first chunk from and the maximum 'chunkSize'.
+
+        The quotas enforced are described in uploads.py. Rejected uploads are answered with an 'error' and a 4xx status.
+    """
+    try:
+        data = json.loads(request.body)
+        upload = startUpload(request.user, str(data['filename']), int(data['size']))
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'A JSON body with filename and size is required.'}, status=400)
+    except UploadError as error:
+        return JsonResponse({'error': str(error)}, status=error.status)
+
+    return JsonResponse({'id': upload.pk, 'offset': 0, 'chunkSize': settings.UPLOAD_CHUNK_BYTES}, status=201)
+
+@login_required()
+@require_http_methods(['GET', 'PUT'])
+def uploadChunk(request, pk):
+    """
+        Receives a chunk of an upload (PUT) or reports how far an upload got (GET).
+
+        :param request (HttpRequest): For PUT, a request whose body is the chunk and whose Content-Range header gives its position.
+        :param pk (UUID): The id of the upload.
+
+        :return: A JSON response with the 'offset' to resume from, whether the upload is 'complete', and an 'error' if the chunk was rejected.
+
+        :raises Http404: If the upload does not exist or does not belong to the authenticated user.
+    """
+    upload = get_object_or_404(Upload, pk=pk, owner=request.user)
+
+    if request.method == 'PUT':
+        try:
+            receiveChunk(upload, request)
+        except UploadError as error:
+            return JsonResponse({'error': str(error), 'offset': upload.received}, status=error.status)
+
+    return JsonResponse({'id': upload.pk, 'offset': upload.received, 'size': upload.size, 'complete': upload.isComplete})
+
 @login_required()
 def newConversation(request, item_pk):
     """
@@ -273,9 +480,23 @@ def inbox(request):
         This view function displays the user's inbox, which contains conversations they are part of.
         Conversations are retrieved from the database based on the currently authenticated user.
         The 'app/inbox.html' template is used for rendering the inbox, showing a list of conversations the user is a member of.
+        Conversations are on the messaging database, so their items and the other members are loaded from the default
+        database in one query each instead of being joined.
 
     """
-    conversations = Conversation.objects.filter(members__in=[request.user.id])
+    conversations = [
+        conversation for conversation in Conversation.objects.filter(members__in=[request.user.id]).prefetch_related('item')
+        if conversation.item is not None and conversation.item.deletedAt is None
+    ]
+
+    memberships = ConversationMember.objects.filter(conversation__in=conversations).exclude(user=request.user).values_list('conversation_id', 'user_id')
+    users = User.objects.in_bulk({userId for _, userId in memberships})
+    otherMembers = {}
+    for conversationId, userId in memberships:
+        if userId in users:
+            otherMembers.setdefault(conversationId, []).append(users[userId])
+    for conversation in conversations:
+        conversation.otherMembers = otherMembers.get(conversation.pk, [])
 
     return render(request, 'app/inbox.html', {
         'conversations' : conversations,
@@ -316,6 +537,7 @@ def detailInfo(request,pk):
 
     return render(request, 'app/detailInfo.html', {
         'conversation' : conversation,
+        'conversationMessages' : conversation.messages.prefetch_related('host'),
         'form' : form,
     })
 
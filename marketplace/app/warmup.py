@@ -0,0 +1,146 @@
+"""
+Worker warm-up.
+
+A fresh worker pays for a lot of work on its first requests: importing the views, compiling templates, populating
+the URL resolvers, building forms and their widgets, opening database connections and reading the categories every
+page lists. warmUp() does all of that up front and reports how long each step took.
+
+Templates are compiled through the engines' cached loader, which Django uses by default, so every later
+get_template() is a dictionary lookup. With prefork=True (the default) the database connections are closed again
+once the warm-up is done, because a connection must not be shared between forked processes, and gc.freeze() moves
+everything loaded so far out of the garbage collector's reach. Collections in the workers then no longer touch those
+objects, so the memory pages stay shared with the parent instead of being copied into every worker.
+
+marketplace/wsgi.py and marketplace/asgi.py call warmUp() when MARKETPLACE_WARMUP is set. For the workers to share
+the warmed memory, the application must be loaded in the parent before forking, e.g. gunicorn --preload.
+"""
+
+import gc
+import os
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.template.backends.django import DjangoTemplates
+from django.template.utils import get_app_template_dirs
+from django.urls import get_resolver, reverse
+
+from .catalog import categoryList
+
+templateExtensions = ('.html', '.txt', '.xml')
+
+def importModules():
+    import_module(settings.ROOT_URLCONF)
+    for middleware in settings.MIDDLEWARE:
+        import_module(middleware.rsplit('.', 1)[0])
+    return '%d middleware modules and %s' % (len(settings.MIDDLEWARE), settings.ROOT_URLCONF)
+
+def templateNames(engine):
+    directories = list(engine.engine.dirs)
+    if engine.engine.app_dirs:
+        directories += get_app_template_dirs('templates')
+
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith(templateExtensions):
+                    yield os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/')
+
+def compileTemplates():
+    compiled = 0
+    failed = []
+    for engine in engines.all():
+        if not isinstance(engine, DjangoTemplates):
+            continue
+        for name in templateNames(engine):
+            try:
+                engine.get_template(name)
+                compiled += 1
+            except (TemplateDoesNotExist, TemplateSyntaxError, UnicodeDecodeError):
+                # Fragments meant to be included elsewhere, e.g. with blocks that only parse in context.
+                failed.append(name)
+
+    if failed:
+        return '%d compiled, %d skipped: %s' % (compiled, len(failed), ', '.join(failed[:5]))
+    return '%d compiled' % compiled
+
+def primeResolvers():
+    # Reading reverse_dict populates a resolver; namespaced ones are populated separately, on first use.
+    resolver = get_resolver()
+    resolver.reverse_dict
+    namespaces = 0
+    for _, namespaceResolver in resolver.namespace_dict.values():
+        namespaceResolver.reverse_dict
+        namespaces += 1
+    reverse('item:index')
+    resolver.resolve(reverse('item:index'))
+    return '%d namespaces' % namespaces
+
+def buildForms():
+    from . import forms
+
+    # Rendering also compiles the widget templates of the forms renderer, which has its own template engine.
+    formClasses = (forms.SignUp, forms.Login, forms.NewItem, forms.EditItem, forms.MessageForm, forms.NotificationPreferenceForm)
+    for formClass in formClasses:
+        str(formClass())
+    return '%d forms' % len(formClasses)
+
+def openConnections():
+    for connection in connections.all():
+        connection.ensure_connection()
+    return ', '.join(connection.alias for connection in connections.all())
+
+def loadCatalog():
+    return '%d categories' % len(categoryList())
+
+steps = (
+    ('imports', importModules),
+    ('database connections', openConnections),
+    ('templates', compileTemplates),
+    ('url resolvers', primeResolvers),
+    ('forms', buildForms),
+    ('categories', loadCatalog),
+)
+
+def warmUp(prefork=True):
+    """
+    Runs every warm-up step.
+
+    :param prefork (bool): Close the database connections and freeze the garbage collector afterwards, for a process
+        that forks its workers next.
+
+    :return (list): A (step, seconds, detail) tuple per step.
+    """
+    timings = []
+    for name, step in steps:
+        started = time.perf_counter()
+        detail = step()
+        timings.append((name, time.perf_counter() - started, detail))
+
+    if prefork:
+        started = time.perf_counter()
+        connections.close_all()
+        gc.collect()
+        gc.freeze()
+        timings.append(('pre-fork', time.perf_counter() - started, '%d objects frozen' % gc.get_freeze_count()))
+
+    return timings
+
+def report(timings, startup=None):
+    """
+    Formats warm-up timings, one line per step.
+
+    :param timings (list): The result of warmUp().
+    :param startup (float): Seconds spent loading the application before the warm-up, if known.
+
+    :return (str): The report.
+    """
+    lines = []
+    if startup is not None:
+        lines.append('%-22s %8.1f ms' % ('application load', startup * 1000))
+    for name, seconds, detail in timings:
+        lines.append('%-22s %8.1f ms  %s' % (name, seconds * 1000, detail))
+    lines.append('%-22s %8.1f ms' % ('total', (sum(seconds for _, seconds, _ in timings) + (startup or 0)) * 1000))
+    return '\n'.join(lines)
@@ -46,12 +46,16 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'app.middleware.CompressionMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'app.middleware.HtmlMinifyMiddleware',
 ]
 
 ROOT_URLCONF = 'marketplace.urls'
@@ -82,9 +86,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # Conversations and messages, see app/routers.py. Create it with: python manage.py migrate --database messaging
+    'messaging': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'messaging.sqlite3',
+    },
 }
 
+DATABASE_ROUTERS = ['app.routers.MessagingRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -124,6 +135,38 @@ STATIC_URL = 'static/'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Resumable image uploads, see app/uploads.py. Partial files are kept outside MEDIA_ROOT so they are never served.
+UPLOAD_PARTIAL_DIR = BASE_DIR / 'uploads'
+UPLOAD_MAX_BYTES = 15 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+UPLOAD_MAX_PENDING = 5
+UPLOAD_DAILY_BYTES = 200 * 1024 * 1024
+
+# On-demand request profiling, see app/profiling.py. PROFILING_ENABLED and PROFILING_SAMPLE_RATE only apply until a
+# ProfilingSwitch is saved in the admin or with manage.py profiling; workers re-read it every PROFILING_SWITCH_SECONDS.
+
+PROFILING_ENABLED = True
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_SWITCH_SECONDS = 10
+PROFILING_MODE = 'sampler'
+PROFILING_INTERVAL = 0.005
+PROFILING_DIR = BASE_DIR / 'profiles'
+
+# Seconds an outbox consumer waits for a gap in the event ids to fill before reading past it, see app/outbox.py.
+# Must exceed the longest transaction that writes tracked models, plus the clock skew between nodes.
+
+OUTBOX_GAP_SECONDS = 5
+
+# Seconds the category list stays cached, see app/catalog.py.
+
+CATEGORY_CACHE_SECONDS = 60
+
+# Message digests, see app/digests.py. The console backend prints emails; use the SMTP backend in production.
+
+SITE_URL = 'http://localhost:8000'
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+DEFAULT_FROM_EMAIL = 'Marketplace <noreply@localhost>'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
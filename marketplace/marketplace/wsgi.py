@@ -8,9 +8,21 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 """
 
 import os
+import sys
+import time
+
+started = time.perf_counter()
 
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'marketplace.settings')
 
 application = get_wsgi_application()
+
+# Set MARKETPLACE_WARMUP=1 to warm the process up before it serves requests, see app/warmup.py. Load the application
+# before forking (e.g. gunicorn --preload) so the workers share the warmed memory.
+if os.environ.get('MARKETPLACE_WARMUP'):
+    from app.warmup import report, warmUp
+
+    startup = time.perf_counter() - started
+    sys.stderr.write('Warm-up of %d:\n%s\n' % (os.getpid(), report(warmUp(), startup)))